@@ -1,6 +1,6 @@
 # Đường dẫn: excel_toolkit/app_controller.py
-# Phiên bản 1.0 - Tách logic xử lý ra khỏi main.py
-# Ngày cập nhật: 2025-09-16
+# Phiên bản 1.8 - Báo controller khi xử lý file lỗi để không chạy thao tác hẹn sau khi đóng
+# Ngày cập nhật: 2026-10-19
 
 import tkinter.filedialog as filedialog
 import threading
@@ -20,8 +20,14 @@ from processes import (
     delete_defined_names, 
     set_print_settings,
     clear_excess_cell_formatting,
+    clean_named_styles,
+    optimize_cell_formats,
+    compact_shared_strings,
+    remove_calc_chain,
     compress_all_images,
-    refresh_and_clean_pivot_caches
+    consolidate_duplicate_images,
+    refresh_and_clean_pivot_caches,
+    consolidate_pivot_caches
 )
 
 class AppController:
@@ -38,8 +44,14 @@ class AppController:
             "delete_defined_names": (translator.get_text("task_delete_defined_names"), delete_defined_names.run),
             "set_print_settings": (translator.get_text("task_set_print_settings"), set_print_settings.run),
             "clear_excess_cell_formatting": (translator.get_text("task_clear_excess_cell_formatting"), clear_excess_cell_formatting.run),
+            "clean_named_styles": (translator.get_text("task_clean_named_styles"), clean_named_styles.run),
+            "optimize_cell_formats": (translator.get_text("task_optimize_cell_formats"), optimize_cell_formats.run),
+            "compact_shared_strings": (translator.get_text("task_compact_shared_strings"), compact_shared_strings.run),
+            "remove_calc_chain": (translator.get_text("task_remove_calc_chain"), remove_calc_chain.run),
             "compress_all_images": (translator.get_text("task_compress_all_images"), compress_all_images.run),
-            "refresh_and_clean_pivot_caches": (translator.get_text("task_refresh_and_clean_pivot_caches"), refresh_and_clean_pivot_caches.run)
+            "consolidate_duplicate_images": (translator.get_text("task_consolidate_duplicate_images"), consolidate_duplicate_images.run),
+            "refresh_and_clean_pivot_caches": (translator.get_text("task_refresh_and_clean_pivot_caches"), refresh_and_clean_pivot_caches.run),
+            "consolidate_pivot_caches": (translator.get_text("task_consolidate_pivot_caches"), consolidate_pivot_caches.run)
         }
 
     def open_folder(self, folder_path):
@@ -129,7 +141,7 @@ class AppController:
             save_details['folder'] = folder
 
         dialog = TaskSelectionDialog(self.root)
-        selected_tasks, selected_engine_text, quality_param, selected_label_text = dialog.get_selected_tasks()
+        selected_tasks, selected_engine_text, quality_param, selected_label_text, selected_tolerance_text = dialog.get_selected_tasks()
         
         engine = None
         if selected_engine_text == translator.get_text("engine_pil"):
@@ -137,18 +149,24 @@ class AppController:
         elif selected_engine_text == translator.get_text("engine_spire"):
             engine = "spire"
 
+        tolerance_level = consolidate_duplicate_images.TOLERANCE_CONSERVATIVE
+        if selected_tolerance_text == translator.get_text("duplicate_tolerance_exact"):
+            tolerance_level = consolidate_duplicate_images.TOLERANCE_EXACT
+        elif selected_tolerance_text == translator.get_text("duplicate_tolerance_loose"):
+            tolerance_level = consolidate_duplicate_images.TOLERANCE_LOOSE
+
         if not selected_tasks: 
             self.log_message("Cancelled.", style="info", duration=0)
             return
             
         save_details['text'] = save_mode_text
-        self.process_files(selected_files, selected_tasks, engine, quality_param, selected_label_text, save_details)
+        self.process_files(selected_files, selected_tasks, engine, quality_param, selected_label_text, tolerance_level, save_details)
 
-    def process_files(self, files, tasks, engine, quality_param, label_text, save_details):
-        processing_thread = threading.Thread(target=self._run_batch_thread, args=(files, tasks, self.task_map, engine, quality_param, label_text, save_details))
+    def process_files(self, files, tasks, engine, quality_param, label_text, tolerance_level, save_details):
+        processing_thread = threading.Thread(target=self._run_batch_thread, args=(files, tasks, self.task_map, engine, quality_param, label_text, tolerance_level, save_details))
         processing_thread.start()
 
-    def _run_batch_thread(self, files, tasks, task_map, engine, quality_param, label_text, save_details):
+    def _run_batch_thread(self, files, tasks, task_map, engine, quality_param, label_text, tolerance_level, save_details):
         total_files, temp_dir = len(files), tempfile.mkdtemp()
         try:
             self.log_message(f"Processing {total_files} files...", style="process", duration=0)
@@ -173,12 +191,16 @@ class AppController:
                                 task_func(controller, temp_path, engine, quality_value)
                             elif task_id == "add_label":
                                 task_func(controller, temp_path, label_text=label_text)
+                            elif task_id == "consolidate_duplicate_images":
+                                task_func(controller, temp_path, tolerance_level=tolerance_level)
                             else:
                                 task_func(controller, temp_path)
                         
-                        controller.save_workbook()
+                        if not controller.save_workbook():
+                            raise Exception(f"Could not save workbook: {file_name}")
 
                     except Exception as e:
+                        controller.mark_failed(e)
                         self.log_message(f"ERROR processing file: {file_name}\nDetails: {e}", style="error", duration=8)
                         logging.exception(f"An exception occurred while processing {file_name}")
                         is_file_processed_successfully = False
@@ -1,15 +1,16 @@
 # Đường dẫn: excel_toolkit/excel_controller.py
-# Phiên bản: 4.9 - Sửa lỗi logic gọi engine Spire
-# Ngày cập nhật: 2025-09-15
+# Phiên bản: 7.1 - Bỏ các thao tác hẹn sau khi đóng workbook nếu tác vụ hoặc lần lưu cuối thất bại
+# Ngày cập nhật: 2026-10-19
 
 import logging
 import xlwings as xw
 import os 
+import zipfile
 
 from utils import (
     app_ops, cleanup_ops, convert_ops, data_ops, file_system_ops,
     print_ops, range_ops, shape_ops, worksheet_ops, 
-    compressor_engine_pil, compressor_engine_spire
+    compressor_engine_pil, compressor_engine_spire, image_ops, media_ops, package_cleanup_ops
 )
 
 class ExcelController:
@@ -22,6 +23,8 @@ class ExcelController:
         self.visible = visible
         self.optimize_performance = optimize_performance
         self.last_error = None
+        self.failed = False
+        self._after_close_operations = []
         
     def __enter__(self):
         try:
@@ -53,6 +56,13 @@ class ExcelController:
             except Exception as e:
                 logging.error(f"Lỗi khi thoát ứng dụng Excel: {e}")
 
+        if exc_type is None and not self.failed:
+            self._run_after_close_operations()
+        elif self._after_close_operations:
+            names = ", ".join(f"'{op.__name__}'" for _, op, _, _ in self._after_close_operations)
+            logging.warning(f"Bỏ qua thao tác đã hẹn sau khi đóng workbook ({names}) vì xử lý file thất bại.")
+            self._after_close_operations = []
+
     # ======================================================================
     # --- 1. I/O Operations ---
     # ======================================================================
@@ -100,6 +110,7 @@ class ExcelController:
             return True
         except Exception as e:
             self.last_error = f"Lỗi khi lưu workbook: {e}"
+            self.failed = True
             logging.error(self.last_error); return False
             
     def close_workbook(self, save=True):
@@ -113,6 +124,68 @@ class ExcelController:
         except Exception as e:
             self.last_error = f"Lỗi khi đóng workbook: {e}"
             logging.error(self.last_error); return False
+
+    def _run_on_closed_workbook(self, operation, *args, **kwargs):
+        """
+        Lưu và đóng workbook đang mở, chạy ``operation(file_path, ...)`` trực tiếp trên file
+        (không qua Excel), sau đó mở lại workbook để các tác vụ COM tiếp theo dùng tiếp.
+        """
+        if not self.workbook:
+            logging.warning("Không có workbook nào đang hoạt động."); return False
+        file_path = self.workbook.fullname
+        if not self.close_workbook(save=True):
+            return False
+        try:
+            return operation(file_path, *args, **kwargs)
+        finally:
+            if not self.open_workbook(file_path):
+                logging.error(f"Không thể mở lại workbook '{file_path}' sau khi xử lý trực tiếp.")
+
+    def _is_ooxml_package(self):
+        """Workbook đang mở là gói OOXML (xlsx/xlsm, không mã hoá) nên có thể sửa thẳng trên file."""
+        return bool(self.workbook) and zipfile.is_zipfile(self.workbook.fullname)
+
+    def _run_package_operation(self, operation, *args, **kwargs):
+        """
+        ``_run_on_closed_workbook`` cho thao tác chỉ làm được trên gói OOXML. File .xls hoặc có
+        mật khẩu (gói mã hoá không phải zip, mở lại cũng cần mật khẩu) được bỏ qua, không đóng workbook.
+        """
+        if not self._is_ooxml_package():
+            logging.info(f"Bỏ qua '{operation.__name__}': file không phải gói OOXML (xls hoặc có mật khẩu).")
+            return False
+        return self._run_on_closed_workbook(operation, *args, **kwargs)
+
+    def mark_failed(self, error=None):
+        """
+        Đánh dấu lượt xử lý file thất bại (lỗi được bắt bên trong khối ``with``) để ``__exit__``
+        không chạy các thao tác đã hẹn bằng ``_run_after_final_save`` trên file dở dang.
+        """
+        self.failed = True
+        if error is not None:
+            self.last_error = str(error)
+
+    def _run_after_final_save(self, operation, *args, **kwargs):
+        """
+        Hẹn ``operation(file_path, ...)`` chạy trên gói OOXML sau khi workbook đã được lưu lần
+        cuối và đóng (trong ``__exit__``). Dùng cho thay đổi mà Excel sẽ làm lại nếu file được mở
+        và lưu tiếp: Excel ghi lại calcChain, hay refresh cache có ``refreshOnLoad`` khi mở.
+        """
+        if not self._is_ooxml_package():
+            logging.info(f"Bỏ qua '{operation.__name__}': file không phải gói OOXML (xls hoặc có mật khẩu).")
+            return False
+        self._after_close_operations.append((self.workbook.fullname, operation, args, kwargs))
+        logging.info(f"Đã hẹn '{operation.__name__}' chạy trên file sau khi lưu và đóng workbook.")
+        return True
+
+    def _run_after_close_operations(self):
+        """Chạy các thao tác đã hẹn bằng ``_run_after_final_save`` theo thứ tự đã hẹn."""
+        operations, self._after_close_operations = self._after_close_operations, []
+        for file_path, operation, args, kwargs in operations:
+            try:
+                if operation(file_path, *args, **kwargs) is False:
+                    logging.error(f"Thao tác '{operation.__name__}' sau khi đóng workbook thất bại.")
+            except Exception as e:
+                logging.error(f"Lỗi khi chạy '{operation.__name__}' sau khi đóng workbook: {e}", exc_info=True)
     
     # ======================================================================
     # --- 2. Worksheet Operations ---
@@ -204,18 +277,52 @@ class ExcelController:
         return shape_ops.add_picture(self.workbook, sheet_name, image_path, top, left, width, height, name)
     def delete_shape(self, sheet_name, shape_name):
         return shape_ops.delete_shape(self.workbook, sheet_name, shape_name)
+    def apply_picture_crops(self):
+        return self._run_package_operation(media_ops.apply_picture_crops)
+    def compress_package_media(self, **kwargs):
+        return self._run_package_operation(media_ops.compress_package_media, **kwargs)
+    def transcode_legacy_media(self, **kwargs):
+        return self._run_package_operation(media_ops.transcode_legacy_media, **kwargs)
+    def consolidate_near_duplicate_media(self, max_distance=4, tolerance=image_ops.NEAR_DUPLICATE_TOLERANCE):
+        return self._run_package_operation(media_ops.consolidate_near_duplicate_media, max_distance, tolerance)
+
+    @staticmethod
+    def _combine_image_reports(engine_report, package_report):
+        """Gộp thống kê của engine với thống kê nén trong gói và in bảng tổng hợp theo vị trí."""
+        if not isinstance(engine_report, image_ops.CompressionReport):
+            return engine_report
+        for entry in engine_report.entries:
+            entry.location = entry.location or media_ops.LOCATION_LABELS[media_ops.LOCATION_PICTURE]
+        if isinstance(package_report, image_ops.CompressionReport):
+            engine_report.entries.extend(package_report.entries)
+        if engine_report.entries:
+            logging.info("Tổng hợp dung lượng ảnh theo vị trí:\n" + engine_report.format_breakdown())
+        return engine_report
     
     # Hàm nén ảnh tổng hợp, cho phép chọn engine
     def compress_all_images(self, file_path, engine='pil', quality=70):
         if engine == 'pil':
             logging.info("Sử dụng engine 'Pillow' để nén ảnh.")
+            # Ảnh BMP/TIFF cũ: chuyển định dạng trong gói trước (engine chỉ thấy bitmap clipboard).
+            self.transcode_legacy_media(quality=quality)
             # Pillow engine cần workbook object
-            return compressor_engine_pil.compress_images(self.workbook, quality=quality)
+            report = compressor_engine_pil.compress_images(self.workbook, quality=quality)
+            # Engine Pillow chỉ duyệt Shapes trên sheet hiển thị -> nén phần còn lại ngay trong gói.
+            package_report = self.compress_package_media(quality=quality)
+            return self._combine_image_reports(report, package_report)
         elif engine == 'spire':
             logging.info("Sử dụng engine 'Spire' để nén ảnh.")
-            # Spire engine cần đường dẫn file
-            # SỬA LỖI: Chỉ truyền một tham số đường dẫn
-            return compressor_engine_spire.compress_images(file_path, max_size_kb=quality)
+            # Spire đọc ảnh gốc nguyên vẹn -> cắt thật vùng crop trước để không nén phần bị che.
+            # (Engine Pillow chụp ảnh qua clipboard nên vốn chỉ lấy phần hiển thị.)
+            self.transcode_legacy_media()
+            self.apply_picture_crops()
+            # Spire đã duyệt Pictures của mọi sheet (kể cả sheet ẩn), chỉ còn nền/header/footer/chart.
+            package_report = self.compress_package_media(locations=(
+                media_ops.LOCATION_BACKGROUND, media_ops.LOCATION_HEADER_FOOTER, media_ops.LOCATION_CHART_FILL,
+            ))
+            # Spire chỉ đọc; ảnh nén được ghi thẳng vào media part của gói -> chạy khi file đã đóng.
+            report = self._run_package_operation(compressor_engine_spire.compress_images, max_size_kb=quality)
+            return self._combine_image_reports(report, package_report)
         else:
             logging.error(f"Engine nén ảnh '{engine}' không hợp lệ. Vui lòng chọn 'pil' hoặc 'spire'.")
             return False
@@ -225,15 +332,43 @@ class ExcelController:
     # ======================================================================
 
     def delete_external_links(self):
+        # File OOXML: đóng băng công thức về giá trị đã lưu trong gói; BreakLink qua COM có thể
+        # treo nhiều phút khi Excel cố kết nối tới đường dẫn mạng không còn tồn tại.
+        if self._is_ooxml_package():
+            result = self._run_on_closed_workbook(package_cleanup_ops.remove_external_links)
+            if result is not None:
+                return result
+            logging.info("Chuyển sang ngắt liên kết ngoài qua Excel (BreakLink) cho phần không đóng băng được trong gói.")
         return cleanup_ops.delete_external_links(self.workbook)
     def delete_defined_names(self):
+        # File OOXML: phân loại & xóa name trong workbook.xml một lần, không gọi COM từng name.
+        if self._is_ooxml_package():
+            return self._run_on_closed_workbook(package_cleanup_ops.clean_defined_names)
         return cleanup_ops.delete_defined_names(self.workbook)
     def remove_personal_info(self):
         return cleanup_ops.remove_personal_info(self.workbook)
     def clear_excess_cell_formatting(self):
+        # File OOXML (xlsx/xlsm): sửa thẳng XML của sheet, không phải clear_formats hàng triệu ô qua COM.
+        if self._is_ooxml_package():
+            return self._run_on_closed_workbook(package_cleanup_ops.trim_excess_formatting)
         return cleanup_ops.clear_excess_cell_formatting(self.workbook)
+    def clean_named_styles(self):
+        return self._run_package_operation(package_cleanup_ops.clean_named_styles)
+    def optimize_cell_formats(self):
+        return self._run_package_operation(package_cleanup_ops.optimize_cell_formats)
+    def compact_shared_strings(self):
+        return self._run_package_operation(package_cleanup_ops.compact_shared_strings)
+    def remove_calc_chain(self):
+        # Chạy sau lần lưu cuối: mở lại và lưu bằng Excel sẽ ghi lại calcChain.xml.
+        return self._run_after_final_save(package_cleanup_ops.remove_calc_chain)
     def refresh_and_clean_pivot_caches(self):
+        # File OOXML: bỏ pivotCacheRecords trong gói sau lần lưu cuối, không Refresh() về nguồn
+        # (thường không còn truy cập được); mở lại bằng Excel sẽ refresh ngay do refreshOnLoad.
+        if self._is_ooxml_package():
+            return self._run_after_final_save(package_cleanup_ops.strip_pivot_cache_records)
         return cleanup_ops.refresh_and_clean_pivot_caches(self.workbook)
+    def consolidate_pivot_caches(self):
+        return self._run_package_operation(package_cleanup_ops.consolidate_pivot_caches)
 
     # ======================================================================
     # --- 6. Print Operations ---
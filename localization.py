@@ -1,6 +1,6 @@
 # Đường dẫn: excel_toolkit/localization.py
-# Phiên bản 3.0 - Cập nhật văn bản cho nút hành động chính
-# Ngày cập nhật: 2025-09-16
+# Phiên bản 3.7 - Thêm chuỗi mức gộp ảnh trùng
+# Ngày cập nhật: 2026-10-19
 
 class Translator:
     def __init__(self):
@@ -30,12 +30,22 @@ class Translator:
                 "task_delete_defined_names": "Xóa Defined Names (An toàn)",
                 "task_set_print_settings": "Thiết lập trang in",
                 "task_clear_excess_cell_formatting": "Dọn dẹp định dạng ô thừa",
+                "task_clean_named_styles": "Dọn style có tên trùng/thừa",
+                "task_optimize_cell_formats": "Gộp & dọn định dạng ô trùng/không dùng",
+                "task_compact_shared_strings": "Nén bảng chuỗi dùng chung (sharedStrings)",
+                "task_remove_calc_chain": "Xóa chuỗi tính toán (calcChain)",
                 "task_compress_all_images": "Nén tất cả hình ảnh",
                 "task_compress_all_images_engine_label": "Engine nén ảnh:",
                 "engine_pil": "Pillow (Chất lượng cao)",
                 "engine_spire": "Spire.Xls (Ổn định)",
                 "image_max_size_kb": "Kích thước tối đa (KB)",
+                "task_consolidate_duplicate_images": "Gộp ảnh trùng/gần trùng",
+                "duplicate_tolerance_label": "Mức gộp:",
+                "duplicate_tolerance_exact": "Giống hệt từng pixel",
+                "duplicate_tolerance_conservative": "Gần trùng - thận trọng (khuyến nghị)",
+                "duplicate_tolerance_loose": "Gần trùng - nới (cả ảnh nén mạnh)",
                 "task_refresh_and_clean_pivot_caches": "Dọn dẹp Pivot Table caches",
+                "task_consolidate_pivot_caches": "Gộp Pivot cache trùng nguồn",
                 "run_button_dialog": "Chạy",
                 "cancel_button_dialog": "Hủy",
                 "log_level_label": "Mức độ Log:",
@@ -73,12 +83,22 @@ class Translator:
                 "task_delete_defined_names": "Delete Defined Names (Safe)",
                 "task_set_print_settings": "Set Print Settings",
                 "task_clear_excess_cell_formatting": "Clear Excess Cell Formatting",
+                "task_clean_named_styles": "Clean Up Named Cell Styles",
+                "task_optimize_cell_formats": "Deduplicate Cell Formats",
+                "task_compact_shared_strings": "Compact Shared Strings",
+                "task_remove_calc_chain": "Remove calculation chain (calcChain)",
                 "task_compress_all_images": "Compress All Images",
                 "task_compress_all_images_engine_label": "Image compression engine:",
                 "engine_pil": "Pillow (High Quality)",
                 "engine_spire": "Spire.Xls (Stable)",
                 "image_max_size_kb": "Max Size (KB)",
+                "task_consolidate_duplicate_images": "Consolidate Duplicate Images",
+                "duplicate_tolerance_label": "Match level:",
+                "duplicate_tolerance_exact": "Pixel-identical only",
+                "duplicate_tolerance_conservative": "Near-identical - conservative (recommended)",
+                "duplicate_tolerance_loose": "Near-identical - loose (heavily compressed too)",
                 "task_refresh_and_clean_pivot_caches": "Clean Pivot Table Caches",
+                "task_consolidate_pivot_caches": "Consolidate Duplicate Pivot Caches",
                 "run_button_dialog": "Run",
                 "cancel_button_dialog": "Cancel",
                 "log_level_label": "Log Level:",
@@ -116,12 +136,22 @@ class Translator:
                 "task_delete_defined_names": "定義された名前を削除 (安全)",
                 "task_set_print_settings": "印刷設定",
                 "task_clear_excess_cell_formatting": "余分なセルの書式設定をクリア",
+                "task_clean_named_styles": "不要なセルスタイルを整理",
+                "task_optimize_cell_formats": "重複・未使用のセル書式を整理",
+                "task_compact_shared_strings": "共有文字列テーブルを圧縮",
+                "task_remove_calc_chain": "計算チェーン (calcChain) を削除",
                 "task_compress_all_images": "すべての画像を圧縮",
                 "task_compress_all_images_engine_label": "画像圧縮エンジン:",
                 "engine_pil": "Pillow (高品質)",
                 "engine_spire": "Spire.Xls (安定)",
                 "image_max_size_kb": "最大サイズ (KB)",
+                "task_consolidate_duplicate_images": "重複画像を統合",
+                "duplicate_tolerance_label": "統合レベル:",
+                "duplicate_tolerance_exact": "ピクセル単位で同一のみ",
+                "duplicate_tolerance_conservative": "ほぼ同一 - 慎重 (推奨)",
+                "duplicate_tolerance_loose": "ほぼ同一 - 緩め (強圧縮も含む)",
                 "task_refresh_and_clean_pivot_caches": "ピボットテーブルキャッシュを整理",
+                "task_consolidate_pivot_caches": "重複したピボットキャッシュを統合",
                 "run_button_dialog": "実行",
                 "cancel_button_dialog": "キャンセル",
                 "log_level_label": "ログレベル:",
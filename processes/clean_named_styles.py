@@ -0,0 +1,19 @@
+# Đường dẫn: excel_toolkit/processes/clean_named_styles.py
+# Phiên bản 1.0 - Quy trình dọn style có tên (Normal 2, Comma 15...) trùng lặp/không dùng
+# Ngày cập nhật: 2026-10-19
+
+import logging
+import os
+from excel_controller import ExcelController
+
+def run(controller, file_path):
+    """
+    Gộp các style có tên bị nhân bản và xóa style không còn ô nào dùng.
+    """
+    logging.info(f"Bắt đầu dọn style có tên cho file: {os.path.basename(file_path)}")
+    try:
+        controller.clean_named_styles()
+        logging.info(f"Hoàn tất dọn style có tên cho file: {os.path.basename(file_path)}")
+    except Exception as e:
+        logging.error(f"Lỗi khi dọn style có tên cho file '{file_path}': {e}", exc_info=True)
+        raise
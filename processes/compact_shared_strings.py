@@ -0,0 +1,19 @@
+# Đường dẫn: excel_toolkit/processes/compact_shared_strings.py
+# Phiên bản 1.0 - Quy trình nén bảng chuỗi dùng chung (sharedStrings.xml)
+# Ngày cập nhật: 2026-10-19
+
+import logging
+import os
+from excel_controller import ExcelController
+
+def run(controller, file_path):
+    """
+    Bỏ các chuỗi không còn ô nào dùng (sau khi xóa sheet/nội dung) khỏi bảng chuỗi dùng chung.
+    """
+    logging.info(f"Bắt đầu nén bảng chuỗi dùng chung cho file: {os.path.basename(file_path)}")
+    try:
+        controller.compact_shared_strings()
+        logging.info(f"Hoàn tất nén bảng chuỗi dùng chung cho file: {os.path.basename(file_path)}")
+    except Exception as e:
+        logging.error(f"Lỗi khi nén bảng chuỗi dùng chung cho file '{file_path}': {e}", exc_info=True)
+        raise
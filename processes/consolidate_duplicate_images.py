@@ -0,0 +1,32 @@
+# Đường dẫn: excel_toolkit/processes/consolidate_duplicate_images.py
+# Phiên bản 1.2 - Gộp cả ảnh gần trùng (khác kích thước/mức nén), mức ngưỡng chọn được
+# Ngày cập nhật: 2026-10-19
+
+import logging
+import os
+from excel_controller import ExcelController
+from utils import image_ops
+
+# Mức ngưỡng chênh lệch cục bộ (xem ``image_ops.local_difference``) người dùng chọn được.
+TOLERANCE_EXACT = "exact"                  # chỉ gộp ảnh giống hệt từng pixel
+TOLERANCE_CONSERVATIVE = "conservative"    # mặc định: gộp bản nén lại / xuất lại cỡ khác
+TOLERANCE_LOOSE = "loose"                  # gộp cả bản nén JPEG rất mạnh
+TOLERANCE_LEVELS = {
+    TOLERANCE_EXACT: 0.0,
+    TOLERANCE_CONSERVATIVE: image_ops.NEAR_DUPLICATE_TOLERANCE,
+    TOLERANCE_LOOSE: 22.0,
+}
+
+def run(controller, file_path, tolerance_level=TOLERANCE_CONSERVATIVE):
+    """
+    Gộp các ảnh trùng/gần trùng (cùng ảnh chèn nhiều lần, xuất lại ở kích thước hoặc mức nén
+    khác) trong workbook về một media dùng chung.
+    """
+    tolerance = TOLERANCE_LEVELS.get(tolerance_level, image_ops.NEAR_DUPLICATE_TOLERANCE)
+    logging.info(f"Bắt đầu gộp ảnh trùng (ngưỡng {tolerance:g}) cho file: {os.path.basename(file_path)}")
+    try:
+        controller.consolidate_near_duplicate_media(tolerance=tolerance)
+        logging.info(f"Hoàn tất gộp ảnh trùng cho file: {os.path.basename(file_path)}")
+    except Exception as e:
+        logging.error(f"Lỗi khi gộp ảnh trùng cho file '{file_path}': {e}", exc_info=True)
+        raise
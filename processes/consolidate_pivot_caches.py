@@ -0,0 +1,19 @@
+# Đường dẫn: excel_toolkit/processes/consolidate_pivot_caches.py
+# Phiên bản 1.0 - Quy trình gộp các pivot cache trùng nguồn
+# Ngày cập nhật: 2026-10-19
+
+import logging
+import os
+from excel_controller import ExcelController
+
+def run(controller, file_path):
+    """
+    Gộp các pivot cache có cùng nguồn dữ liệu (do copy pivot table) về một cache dùng chung.
+    """
+    logging.info(f"Bắt đầu gộp pivot cache trùng cho file: {os.path.basename(file_path)}")
+    try:
+        controller.consolidate_pivot_caches()
+        logging.info(f"Hoàn tất gộp pivot cache trùng cho file: {os.path.basename(file_path)}")
+    except Exception as e:
+        logging.error(f"Lỗi khi gộp pivot cache trùng cho file '{file_path}': {e}", exc_info=True)
+        raise
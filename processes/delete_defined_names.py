@@ -1,6 +1,6 @@
 # Đường dẫn: excel_toolkit/processes/delete_defined_names.py
-# Phiên bản 3.0 - Cập nhật để hoạt động với ExcelController đã mở sẵn
-# Ngày cập nhật: 2025-09-15
+# Phiên bản 3.1 - Phân loại name (#REF!, workbook ngoài, ẩn, không dùng) trước khi xóa
+# Ngày cập nhật: 2026-10-19
 
 import logging
 import os
@@ -9,6 +9,7 @@ from excel_controller import ExcelController
 def run(controller, file_path):
     """
     Xóa Defined Name trong workbook (an toàn, không xóa thiết lập in).
+    Với xlsx/xlsm: xóa name lỗi #REF!, trỏ workbook ngoài, ẩn và không được dùng; giữ name đang dùng.
     """
     logging.info(f"Bắt đầu xóa Defined Name cho file: {os.path.basename(file_path)}")
     try:
@@ -1,6 +1,6 @@
 # Đường dẫn: excel_toolkit/processes/delete_external_links.py
-# Phiên bản 3.0 - Cập nhật để hoạt động với ExcelController đã mở sẵn
-# Ngày cập nhật: 2025-09-15
+# Phiên bản 3.1 - Gỡ liên kết ngoài không cần kết nối tới file nguồn
+# Ngày cập nhật: 2026-10-19
 
 import logging
 import os
@@ -9,6 +9,7 @@ from excel_controller import ExcelController
 def run(controller, file_path):
     """
     Xóa các liên kết ngoài trong workbook.
+    Với xlsx/xlsm: công thức trỏ ra ngoài được thay bằng giá trị đã lưu, không truy cập mạng.
     """
     logging.info(f"Bắt đầu xóa liên kết ngoài cho file: {os.path.basename(file_path)}")
     try:
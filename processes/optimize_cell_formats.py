@@ -0,0 +1,19 @@
+# Đường dẫn: excel_toolkit/processes/optimize_cell_formats.py
+# Phiên bản 1.0 - Quy trình gộp & dọn bảng định dạng ô (styles.xml)
+# Ngày cập nhật: 2026-10-19
+
+import logging
+import os
+from excel_controller import ExcelController
+
+def run(controller, file_path):
+    """
+    Gộp các định dạng ô trùng lặp và bỏ định dạng không còn ô nào dùng.
+    """
+    logging.info(f"Bắt đầu gộp & dọn định dạng ô cho file: {os.path.basename(file_path)}")
+    try:
+        controller.optimize_cell_formats()
+        logging.info(f"Hoàn tất gộp & dọn định dạng ô cho file: {os.path.basename(file_path)}")
+    except Exception as e:
+        logging.error(f"Lỗi khi gộp & dọn định dạng ô cho file '{file_path}': {e}", exc_info=True)
+        raise
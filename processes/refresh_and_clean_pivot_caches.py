@@ -1,6 +1,6 @@
 # Đường dẫn: excel_toolkit/processes/refresh_and_clean_pivot_caches.py
-# Phiên bản 1.0 - Quy trình dọn dẹp Pivot Table caches
-# Ngày cập nhật: 2025-09-15
+# Phiên bản 1.1 - File OOXML: bỏ cache records trên file sau lần lưu cuối
+# Ngày cập nhật: 2026-10-19
 
 import logging
 import os
@@ -8,7 +8,8 @@ from excel_controller import ExcelController
 
 def run(controller, file_path):
     """
-    Quy trình làm mới và dọn dẹp Pivot Table caches.
+    Quy trình làm mới và dọn dẹp Pivot Table caches. Với file OOXML, pivotCacheRecords được bỏ
+    trực tiếp trên file sau khi workbook được lưu lần cuối và đóng.
     """
     logging.info(f"Bắt đầu làm mới và dọn dẹp Pivot Table caches cho file: {os.path.basename(file_path)}")
     try:
@@ -0,0 +1,21 @@
+# Đường dẫn: excel_toolkit/processes/remove_calc_chain.py
+# Phiên bản 1.1 - Xóa calcChain trên file sau lần lưu cuối
+# Ngày cập nhật: 2026-10-19
+
+import logging
+import os
+from excel_controller import ExcelController
+
+def run(controller, file_path):
+    """
+    Xóa calcChain.xml để file mở không bị sửa lỗi (repair) và tải nhanh hơn; Excel tự dựng lại khi tính.
+    Việc xóa được hẹn chạy trên file sau khi workbook được lưu lần cuối và đóng, vì Excel lưu lại
+    sẽ ghi lại calcChain.
+    """
+    logging.info(f"Bắt đầu xóa calcChain cho file: {os.path.basename(file_path)}")
+    try:
+        if controller.remove_calc_chain():
+            logging.info(f"Đã hẹn xóa calcChain sau khi lưu file: {os.path.basename(file_path)}")
+    except Exception as e:
+        logging.error(f"Lỗi khi xóa calcChain cho file '{file_path}': {e}", exc_info=True)
+        raise
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Cho phép import các module của toolkit (``utils``...) khi chạy pytest từ thư mục gốc.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
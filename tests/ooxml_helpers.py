@@ -0,0 +1,92 @@
+"""Dựng file .xlsx nhỏ bằng openpyxl rồi sửa trực tiếp các part XML cho test thao tác trên gói."""
+
+import copy
+import re
+import zipfile
+
+import openpyxl
+
+
+def build_xlsx(path, populate=None, parts=None):
+    """
+    Tạo workbook bằng openpyxl (``populate(wb)`` để điền dữ liệu), lưu ra ``path`` rồi áp
+    ``parts`` (xem :func:`patch_parts`). Trả về ``str(path)``.
+    """
+    wb = openpyxl.Workbook()
+    if populate:
+        populate(wb)
+    wb.save(path)
+    if parts:
+        patch_parts(path, parts)
+    return str(path)
+
+
+def patch_parts(path, updates):
+    """
+    Ghi lại gói với ``updates``: ``{tên part: bytes | hàm(bytes cũ) -> bytes | None}``
+    (``None`` là xoá part).
+    """
+    with zipfile.ZipFile(path) as z:
+        parts = {name: z.read(name) for name in z.namelist()}
+    for name, value in updates.items():
+        if value is None:
+            parts.pop(name, None)
+        elif callable(value):
+            parts[name] = value(parts.get(name, b""))
+        else:
+            parts[name] = value
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, data in parts.items():
+            z.writestr(name, data)
+
+
+def read_part(path, name):
+    with zipfile.ZipFile(path) as z:
+        return z.read(name)
+
+
+def part_names(path):
+    with zipfile.ZipFile(path) as z:
+        return z.namelist()
+
+
+def insert_before(tag, xml):
+    """Hàm cho :func:`patch_parts`: chèn ``xml`` ngay trước thẻ ``tag`` (ví dụ ``b"</sheets>"``)."""
+    return lambda data: data.replace(tag, xml + tag, 1)
+
+
+def insert_after(tag, xml):
+    """Hàm cho :func:`patch_parts`: chèn ``xml`` ngay sau thẻ ``tag``."""
+    return lambda data: data.replace(tag, tag + xml, 1)
+
+
+def add_override(part_name, content_type):
+    """Hàm cho :func:`patch_parts` trên ``[Content_Types].xml``."""
+    override = f'<Override PartName="/{part_name}" ContentType="{content_type}"/>'.encode()
+    return insert_before(b"</Types>", override)
+
+
+def cell_styles(path, sheet="xl/worksheets/sheet1.xml"):
+    """``{ô: chỉ số s=}`` của các ô trên sheet."""
+    data = read_part(path, sheet)
+    return {
+        ref.decode(): int(style or 0)
+        for ref, style in re.findall(rb'<c r="([A-Z]+\d+)"(?:[^>]*?\ss="(\d+)")?', data)
+    }
+
+
+def cell_snapshot(path, sheet=None):
+    """
+    ``{ô: (giá trị, numFmt, font, fill, border, alignment, protection)}`` đọc lại bằng openpyxl,
+    cho mọi ô có giá trị hoặc style - để so sánh trước/sau khi sửa gói.
+    """
+    wb = openpyxl.load_workbook(path)
+    ws = wb[sheet] if sheet else wb.worksheets[0]
+    return {
+        cell.coordinate: (cell.value, cell.number_format) + tuple(
+            copy.copy(style) for style in (cell.font, cell.fill, cell.border, cell.alignment, cell.protection)
+        )
+        for row in ws.iter_rows()
+        for cell in row
+        if cell.value is not None or cell.has_style
+    }
@@ -0,0 +1,66 @@
+import random
+
+import pytest
+
+pytest.importorskip("pythoncom")  # engine PIL dùng COM (chỉ có trên Windows)
+
+from utils import compressor_engine_pil as engine
+
+
+def _apply_moves(order, moves):
+    """Mô phỏng lệnh ZOrder trên danh sách tên xếp từ sau ra trước."""
+    order = list(order)
+    for name, command, count in moves:
+        assert count > 0
+        index = order.index(name)
+        order.pop(index)
+        if command == engine.msoBringToFront:
+            index = len(order)
+        elif command == engine.msoSendToBack:
+            index = 0
+        elif command == engine.msoBringForward:
+            index = min(index + count, len(order))
+        elif command == engine.msoSendBackward:
+            index = max(index - count, 0)
+        else:
+            pytest.fail(f"Lệnh ZOrder lạ: {command}")
+        order.insert(index, name)
+    return order
+
+
+def test_plan_zorder_moves_noop_when_order_matches():
+    assert engine._plan_zorder_moves(["a", "b", "c"], ["a", "b", "c"]) == []
+
+
+@pytest.mark.parametrize("current, desired", [
+    (["b", "a", "c"], ["a", "b", "c"]),
+    (["c", "b", "a"], ["a", "b", "c"]),
+    (["a", "c", "d", "e", "b"], ["a", "b", "c", "d", "e"]),     # một shape mới chèn lên trên cùng
+    (["e", "a", "b", "c", "d"], ["a", "b", "c", "d", "e"]),
+    (["b", "a", "d", "c", "f", "e"], ["a", "b", "c", "d", "e", "f"]),
+])
+def test_plan_zorder_moves_reaches_desired_order(current, desired):
+    moves = engine._plan_zorder_moves(current, desired)
+    assert _apply_moves(current, moves) == desired
+    assert sum(count for _, _, count in moves) <= len(desired)
+
+
+def test_plan_zorder_moves_random_permutations():
+    rng = random.Random(0)
+    for size in range(2, 12):
+        desired = [f"s{i}" for i in range(size)]
+        for _ in range(30):
+            current = rng.sample(desired, size)
+            # Vài shape không có trong thứ tự đã lưu nằm xen giữa.
+            for extra in range(rng.randint(0, 2)):
+                current.insert(rng.randint(0, len(current)), f"x{extra}")
+            moves = engine._plan_zorder_moves(current, desired)
+            assert [nm for nm in _apply_moves(current, moves) if nm in desired] == desired
+
+
+def test_plan_zorder_moves_ignores_shapes_missing_from_either_side():
+    # "new" không có trong thứ tự đã lưu, "gone" đã bị xoá khỏi sheet.
+    current = ["b", "new", "a"]
+    moves = engine._plan_zorder_moves(current, ["a", "gone", "b"])
+    assert {name for name, _, _ in moves} <= {"a", "b"}
+    assert [nm for nm in _apply_moves(current, moves) if nm != "new"] == ["a", "b"]
@@ -0,0 +1,151 @@
+import io
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from utils import image_ops
+
+
+def _noisy_rgba(alpha):
+    """Ảnh chụp nhiều màu (nhiễu ngẫu nhiên) với kênh alpha cho trước."""
+    rng = np.random.default_rng(0)
+    rgb = rng.integers(0, 256, size=alpha.shape + (3,), dtype=np.uint8)
+    return Image.fromarray(np.dstack([rgb, alpha]), "RGBA")
+
+
+def test_binary_alpha_with_many_colors_is_png():
+    alpha = np.full((200, 200), 255, dtype=np.uint8)
+    alpha[50:150, 50:150] = 0
+    profile = image_ops.classify_image(_noisy_rgba(alpha))
+    assert profile.alpha == "binary"
+    assert profile.format == image_ops.FORMAT_PNG
+
+
+def test_nearly_opaque_alpha_is_not_flattened():
+    alpha = np.full((200, 200), 255, dtype=np.uint8)
+    alpha[0, 0] = 252
+    profile = image_ops.classify_image(_noisy_rgba(alpha))
+    assert not profile.flatten_alpha
+    assert profile.format != image_ops.FORMAT_JPEG
+
+
+def test_fully_opaque_photo_is_jpeg():
+    profile = image_ops.classify_image(_noisy_rgba(np.full((200, 200), 255, dtype=np.uint8)))
+    assert profile.flatten_alpha
+    assert profile.format == image_ops.FORMAT_JPEG
+
+
+def _reencode(img, fmt, **params):
+    buffer = io.BytesIO()
+    img.save(buffer, fmt, **params)
+    buffer.seek(0)
+    return Image.open(buffer)
+
+
+def _logo():
+    img = Image.new("RGB", (300, 150), "white")
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((10, 15, 130, 135), fill=(200, 30, 40))
+    draw.rectangle((150, 50, 280, 100), fill=(20, 40, 120))
+    return img
+
+
+def _table(changed_value):
+    """Ảnh chụp bảng số 10 x 4 ô; ô (4, 2) mang ``changed_value``."""
+    img = Image.new("RGB", (400, 200), "white")
+    draw = ImageDraw.Draw(img)
+    for row in range(11):
+        draw.line((0, row * 20, 400, row * 20), fill=(180, 180, 180))
+    for col in range(5):
+        draw.line((col * 100, 0, col * 100, 200), fill=(180, 180, 180))
+    for row in range(10):
+        for col in range(4):
+            value = changed_value if (row, col) == (4, 2) else 1000 + row * 37 + col * 11
+            draw.text((col * 100 + 8, row * 20 + 4), str(value), fill="black")
+    return img
+
+
+def test_recompressed_and_resized_logo_is_near_duplicate():
+    logo = _logo()
+    q90, q60 = _reencode(logo, "JPEG", quality=90), _reencode(logo, "JPEG", quality=60)
+    assert image_ops.local_difference(q90, q60) <= image_ops.NEAR_DUPLICATE_TOLERANCE
+    larger = _reencode(logo.resize((360, 180), Image.LANCZOS), "JPEG", quality=75)
+    assert image_ops.local_difference(logo, larger) <= image_ops.NEAR_DUPLICATE_TOLERANCE
+
+
+def test_table_differing_in_one_digit_is_not_near_duplicate():
+    original, changed = _table(1185), _table(1186)
+    assert image_ops.local_difference(original, changed) > image_ops.NEAR_DUPLICATE_TOLERANCE
+    compressed = _reencode(changed, "JPEG", quality=60)
+    assert image_ops.local_difference(original, compressed) > image_ops.NEAR_DUPLICATE_TOLERANCE
+
+
+def test_local_difference_identical_and_aspect_ratio():
+    logo = _logo()
+    assert image_ops.local_difference(logo, logo.copy()) == 0
+    assert image_ops.local_difference(logo, logo.resize((300, 100))) is None
+    transparent = logo.convert("RGBA")
+    transparent.putalpha(0)
+    assert image_ops.local_difference(logo, transparent) > image_ops.NEAR_DUPLICATE_TOLERANCE
+
+
+def test_compression_report_shows_chosen_quality_and_ssim():
+    report = image_ops.CompressionReport()
+    entry = report.add("Sheet1!Picture 1", 4096, 1024, note="JPEG", quality=72, ssim=0.98765)
+    report.add("Sheet1!Picture 2", 2048, 2048, kept_original=True)
+
+    assert (entry.quality, entry.ssim) == (72, 0.98765)
+    table = report.format_table()
+    assert "JPEG, q72, SSIM 0.9877" in table
+    assert "giữ ảnh gốc" in table
+
+
+class _SizedEncoder:
+    """Bộ mã hoá giả: số byte tỉ lệ với số điểm ảnh và chất lượng; ghi lại các lần gọi."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, img, quality):
+        self.calls.append((img.size, quality))
+        return b"x" * (img.width * img.height * quality // 100)
+
+
+def _target_size_case(max_bytes, sizes):
+    img = Image.new("RGB", sizes[0], "white")
+    encoder = _SizedEncoder()
+    data, result, quality, fits = image_ops.encode_to_target_size(img, max_bytes, encoder, range(30, 91), sizes)
+    return encoder, data, result, quality, fits
+
+
+_TARGET_SIZES = [(100, 100), (80, 80), (64, 64), (51, 51)]
+
+
+def test_encode_to_target_size_already_met_encodes_once():
+    encoder, data, result, quality, fits = _target_size_case(10_000, _TARGET_SIZES)
+    assert fits and quality == 90 and result.size == (100, 100)
+    assert len(data) == 9000
+    assert encoder.calls == [((100, 100), 90)]
+
+
+def test_encode_to_target_size_picks_largest_size_then_highest_quality():
+    # 100x100 ở q30 = 3000B không đạt; 80x80 ở q30 = 1920B đạt -> tìm q cao nhất ở 80x80.
+    encoder, data, result, quality, fits = _target_size_case(2500, _TARGET_SIZES)
+    assert fits and result.size == (80, 80)
+    assert quality == 39 and len(data) <= 2500
+    assert 80 * 80 * (quality + 1) // 100 > 2500
+    assert len(encoder.calls) == len(set(encoder.calls))
+
+
+def test_encode_to_target_size_unreachable_at_full_size_without_downscale():
+    encoder, data, result, quality, fits = _target_size_case(2500, _TARGET_SIZES[:1])
+    assert not fits
+    assert (result.size, quality, len(data)) == ((100, 100), 30, 3000)
+
+
+def test_encode_to_target_size_below_smallest_output_returns_smallest():
+    # 51x51 ở q30 = 780B vẫn vượt 500B: trả về kết quả nhỏ nhất với fits=False.
+    encoder, data, result, quality, fits = _target_size_case(500, _TARGET_SIZES)
+    assert not fits
+    assert (result.size, quality, len(data)) == ((51, 51), 30, 780)
+    assert ((80, 80), 30) not in encoder.calls        # không thử dần từng kích thước
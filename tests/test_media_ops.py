@@ -0,0 +1,60 @@
+import re
+
+import pytest
+from openpyxl.drawing.image import Image as SheetImage
+from PIL import Image
+
+from ooxml_helpers import build_xlsx
+from utils import media_ops, package_ops
+
+DRAWING = "xl/drawings/drawing1.xml"
+
+
+def _pictures_workbook(tmp_path, drawing_patch=None):
+    red, blue = tmp_path / "red.png", tmp_path / "blue.png"
+    Image.new("RGB", (40, 20), "red").save(red)
+    Image.new("RGB", (30, 30), "blue").save(blue)
+
+    def populate(wb):
+        wb.active.add_image(SheetImage(str(red)), "A1")     # Image 1 -> rId1 -> image1.png
+        wb.active.add_image(SheetImage(str(blue)), "D5")    # Image 2 -> rId2 -> image2.png
+
+    return build_xlsx(tmp_path / "pictures.xlsx", populate, {DRAWING: drawing_patch} if drawing_patch else None)
+
+
+def _sheet_pictures(path):
+    with package_ops.ExcelPackage(path) as pkg:
+        return media_ops.sheet_picture_media(pkg)["Sheet"]
+
+
+def test_sheet_picture_media_follows_r_embed_not_name_or_order(tmp_path):
+    # Hai picture cùng tên, picture đầu trỏ tới rId2: chỉ r:embed cho biết media nào.
+    def swap(data):
+        data = data.replace(b'name="Image 2"', b'name="Image 1"')
+        return re.sub(rb'r:embed="rId([12])"', lambda m: b'r:embed="rId%d"' % (3 - int(m.group(1))), data)
+
+    pictures = _sheet_pictures(_pictures_workbook(tmp_path, swap))
+
+    assert [(name, media) for name, media, _ in pictures] == [
+        ("Image 1", "xl/media/image2.png"),
+        ("Image 1", "xl/media/image1.png"),
+    ]
+    # Kích thước hiển thị đọc từ xdr:ext của oneCellAnchor (EMU -> point).
+    assert pictures[0][2] == pytest.approx((30.0, 15.0))
+    assert pictures[1][2] == pytest.approx((22.5, 22.5))
+
+
+def test_sheet_picture_media_prefers_xfrm_and_skips_unresolved_embed(tmp_path):
+    def patch(data):
+        data = data.replace(
+            b'<spPr><a:prstGeom prst="rect" /></spPr>',
+            b'<spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="1270000" cy="635000"/></a:xfrm>'
+            b'<a:prstGeom prst="rect" /></spPr>', 1)
+        return data.replace(b'r:embed="rId2"', b'r:embed="rId9"')
+
+    pictures = _sheet_pictures(_pictures_workbook(tmp_path, patch))
+
+    assert len(pictures) == 1
+    name, media, size = pictures[0]
+    assert (name, media) == ("Image 1", "xl/media/image1.png")
+    assert size == pytest.approx((100.0, 50.0))
@@ -0,0 +1,536 @@
+import re
+
+import pytest
+from openpyxl.styles import Border, Font, PatternFill, Side
+
+from ooxml_helpers import (
+    add_override, build_xlsx, cell_snapshot, cell_styles, insert_before, part_names, patch_parts, read_part,
+)
+from utils import package_cleanup_ops, package_ops
+
+SHEET = "xl/worksheets/sheet1.xml"
+
+_BOLD = Font(bold=True)
+_YELLOW = PatternFill("solid", fgColor="FFFF00")
+_THIN = Border(bottom=Side(style="thin"))
+
+# ======================================================================
+# --- Định dạng ô thừa ---
+# ======================================================================
+
+
+def test_trim_excess_formatting_keeps_content_values_and_styles(tmp_path):
+    def populate(wb):
+        ws = wb.active
+        ws["A1"], ws["A1"].font = "Tiêu đề", _BOLD
+        ws["B3"], ws["B3"].number_format, ws["B3"].fill = 1234.5, "#,##0.00", _YELLOW
+        ws["D1"] = 7
+        ws["C2"].border = _THIN                      # ô trống có style, trong vùng dữ liệu
+        ws.merge_cells("A5:B6")
+        ws["Z200"].fill = _YELLOW                    # định dạng thừa ngoài vùng dữ liệu
+        ws["F4"].fill = _YELLOW
+        ws.row_dimensions[300].height = 30           # hàng có chiều cao riêng: giữ hàng, bỏ style
+
+    path = build_xlsx(tmp_path / "trim.xlsx", populate)
+    before = cell_snapshot(path)
+    assert package_cleanup_ops.trim_excess_formatting(path) is True
+
+    after = cell_snapshot(path)
+    assert set(after) == {"A1", "D1", "C2", "B3"}
+    assert {ref: before[ref] for ref in after} == after
+    sheet = read_part(path, SHEET)
+    assert b'<dimension ref="A1:D6"' in sheet
+    assert b'r="Z200"' not in sheet and b'r="F4"' not in sheet
+    assert b'<row r="300"' in sheet
+
+# ======================================================================
+# --- Gộp & dọn bảng định dạng ô ---
+# ======================================================================
+
+STYLES = "xl/styles.xml"
+
+
+def _duplicate_formats_workbook(tmp_path):
+    def populate(wb):
+        ws = wb.active
+        ws["A1"], ws["A1"].font = "a", _BOLD
+        ws["A2"], ws["A2"].font = "b", _BOLD
+        ws["B1"], ws["B1"].number_format = 1.5, "#,##0.0"
+        ws["C1"], ws["C1"].number_format = 2.5, "#,##0.0"
+        ws["B2"], ws["B2"].fill = "c", _YELLOW
+
+    # openpyxl đã tự gộp style -> thêm bản trùng như file Excel thật: font 2 = font 1,
+    # numFmt 165 = numFmt 164, xf 4/5 trùng nội dung xf 1/2 (A2, C1 dùng), xf 6 không ô nào dùng.
+    def duplicate_styles(data):
+        data = data.replace(b"</fonts>", b'<font><b val="1" /></font></fonts>')
+        data = data.replace(b"</numFmts>", b'<numFmt numFmtId="165" formatCode="#,##0.0" /></numFmts>')
+        return data.replace(b"</cellXfs>", (
+            b'<xf numFmtId="0" fontId="2" fillId="0" borderId="0" pivotButton="0" quotePrefix="0" xfId="0" />'
+            b'<xf numFmtId="165" fontId="0" fillId="0" borderId="0" pivotButton="0" quotePrefix="0" xfId="0" />'
+            b'<xf numFmtId="0" fontId="1" fillId="2" borderId="0" pivotButton="0" quotePrefix="0" xfId="0" />'
+            b'</cellXfs>'))
+
+    def use_duplicates(data):
+        return data.replace(b'<c r="A2" s="1"', b'<c r="A2" s="4"').replace(b'<c r="C1" s="2"', b'<c r="C1" s="5"')
+
+    return build_xlsx(tmp_path / "formats.xlsx", populate, {STYLES: duplicate_styles, SHEET: use_duplicates})
+
+
+def test_optimize_cell_formats_dedupes_and_remaps_style_indices(tmp_path):
+    path = _duplicate_formats_workbook(tmp_path)
+    before = cell_snapshot(path)
+    assert cell_styles(path) == {"A1": 1, "B1": 2, "C1": 5, "A2": 4, "B2": 3}
+
+    counts = package_cleanup_ops.optimize_cell_formats(path)
+
+    assert counts["cellXfs"] == (7, 4)
+    assert counts["fonts"] == (3, 2)
+    assert counts["numFmts"] == (2, 1)
+    assert cell_snapshot(path) == before
+    styles = cell_styles(path)
+    assert styles["A1"] == styles["A2"] and styles["B1"] == styles["C1"]
+    assert sorted(set(styles.values())) == [1, 2, 3]
+
+
+# ======================================================================
+# --- Style có tên ---
+# ======================================================================
+
+_NAMED_STYLE_XFS = (
+    b'<cellStyleXfs count="5"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" />'
+    b'<xf numFmtId="0" fontId="1" fillId="0" borderId="0" applyFont="1" />'
+    b'<xf numFmtId="0" fontId="1" fillId="0" borderId="0" applyFont="1" />'
+    b'<xf numFmtId="0" fontId="1" fillId="2" borderId="0" applyFont="1" applyFill="1" />'
+    b'<xf numFmtId="0" fontId="0" fillId="2" borderId="0" applyFill="1" /></cellStyleXfs>'
+    b'<cellXfs count="3"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0" />'
+    b'<xf numFmtId="0" fontId="1" fillId="0" borderId="0" applyFont="1" xfId="2" />'
+    b'<xf numFmtId="0" fontId="1" fillId="2" borderId="0" applyFont="1" applyFill="1" xfId="3" /></cellXfs>'
+    b'<cellStyles count="5"><cellStyle name="Normal" xfId="0" builtinId="0" />'
+    b'<cellStyle name="Heading" xfId="1" /><cellStyle name="Heading 2" xfId="2" />'
+    b'<cellStyle name="Heading 3" xfId="3" /><cellStyle name="Unused" xfId="4" /></cellStyles>'
+)
+
+
+def test_clean_named_styles_merges_identical_copies_only(tmp_path):
+    def populate(wb):
+        ws = wb.active
+        ws["A1"], ws["A1"].font = "a", _BOLD
+        ws["B2"], ws["B2"].font, ws["B2"].fill = "b", _BOLD, _YELLOW
+
+    def named_styles(data):
+        start, end = data.index(b"<cellStyleXfs"), data.index(b"</cellStyles>") + len(b"</cellStyles>")
+        return data[:start] + _NAMED_STYLE_XFS + data[end:]
+
+    path = build_xlsx(tmp_path / "named.xlsx", populate, {STYLES: named_styles})
+    before = cell_snapshot(path)
+
+    counts = package_cleanup_ops.clean_named_styles(path)
+
+    # "Heading 2" cùng định dạng với "Heading" -> gộp; "Heading 3" khác định dạng và đang dùng -> giữ;
+    # "Unused" không ô nào dùng -> xoá.
+    styles = read_part(path, STYLES)
+    assert re.findall(rb'<cellStyle name="([^"]+)"', styles) == [b"Normal", b"Heading", b"Heading 3"]
+    assert counts["cellStyles"] == (5, 3)
+    assert counts["cellStyleXfs"] == (5, 3)
+    assert cell_snapshot(path) == before
+    assert cell_styles(path) == {"A1": 1, "B2": 2}
+    assert re.findall(rb'<xf [^>]*xfId="(\d+)"', styles) == [b"0", b"1", b"2"]
+
+
+# ======================================================================
+# --- Bảng chuỗi dùng chung ---
+# ======================================================================
+
+SHARED_STRINGS = "xl/sharedStrings.xml"
+
+
+def _shared_strings_workbook(tmp_path):
+    sheet_data = (
+        b'<sheetData><row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1"><v>5</v></c></row>'
+        b'<row r="2"><c r="A2" t="s"><v>2</v></c></row>'
+        b'<row r="3"><c r="A3" s="0" t="s"><v>3</v></c></row></sheetData>'
+    )
+    # 0 và 2 trùng nhau, 1 và 4 không ô nào dùng.
+    sst = (
+        b'<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" count="3" uniqueCount="5">'
+        b'<si><t>alpha</t></si><si><t>beta</t></si><si><t>alpha</t></si>'
+        b'<si><t xml:space="preserve">gamma </t></si><si><r><rPr><b/></rPr><t>rich</t></r></si></sst>'
+    )
+    return build_xlsx(tmp_path / "sst.xlsx", parts={
+        SHEET: lambda data: data.replace(b"<sheetData></sheetData>", sheet_data),
+        SHARED_STRINGS: sst,
+        "xl/_rels/workbook.xml.rels": insert_before(
+            b"</Relationships>",
+            b'<Relationship Id="rId9" Target="sharedStrings.xml" Type="http://schemas.'
+            b'openxmlformats.org/officeDocument/2006/relationships/sharedStrings"/>'),
+        "[Content_Types].xml": add_override(
+            SHARED_STRINGS, "application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"),
+    })
+
+
+def test_compact_shared_strings_dedupes_and_reindexes_cells(tmp_path):
+    path = _shared_strings_workbook(tmp_path)
+    assert package_cleanup_ops.compact_shared_strings(path) == (5, 2)
+
+    sst = read_part(path, SHARED_STRINGS)
+    assert b'count="3" uniqueCount="2"' in sst
+    assert re.findall(rb"<si>.*?</si>", sst) == [b"<si><t>alpha</t></si>", b'<si><t xml:space="preserve">gamma </t></si>']
+    sheet = read_part(path, SHEET)
+    assert re.findall(rb'<c r="(A\d)"[^>]*t="s"><v>(\d+)</v>', sheet) == [(b"A1", b"0"), (b"A2", b"0"), (b"A3", b"1")]
+    assert b'<c r="B1"><v>5</v></c>' in sheet
+    assert {ref: value for ref, (value, *_) in cell_snapshot(path).items()} == {
+        "A1": "alpha", "B1": 5, "A2": "alpha", "A3": "gamma ",
+    }
+
+
+# ======================================================================
+# --- Pivot cache ---
+# ======================================================================
+
+_NS = b'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" ' \
+      b'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"'
+_REL_NS = b"http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_CT_PIVOT = "application/vnd.openxmlformats-officedocument.spreadsheetml.pivot"
+
+
+def _relationship_elements(*rels):
+    return b"".join(
+        b'<Relationship Id="%s" Type="%s/%s" Target="%s"/>' % (rel_id, _REL_NS, rel_type, target)
+        for rel_id, rel_type, target in rels
+    )
+
+
+def _relationships(*rels):
+    return (
+        b'<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">%s</Relationships>'
+        % _relationship_elements(*rels)
+    )
+
+
+def _pivot_workbook(tmp_path, count=3, consumers=None):
+    """
+    Workbook có ``count`` pivot cache giống hệt nhau (cacheId ``n``, x14 ``pivotCacheId`` ``10 + n``),
+    mỗi cache có records và một pivot table. ``consumers``: ``{part: XML}`` slicer/timeline cache.
+    """
+    parts = {}
+    caches, wb_rels, overrides = b"", [], []
+    for n in range(1, count + 1):
+        definition = f"xl/pivotCache/pivotCacheDefinition{n}.xml"
+        records = f"xl/pivotCache/pivotCacheRecords{n}.xml"
+        table = f"xl/pivotTables/pivotTable{n}.xml"
+        caches += b'<pivotCache cacheId="%d" r:id="rIdPc%d"/>' % (n, n)
+        wb_rels.append((b"rIdPc%d" % n, b"pivotCacheDefinition", b"pivotCache/pivotCacheDefinition%d.xml" % n))
+        parts[definition] = (
+            b'<pivotCacheDefinition %s r:id="rId1" refreshedBy="user%d" recordCount="2">'
+            b'<cacheSource type="worksheet"><worksheetSource ref="A1:B3" sheet="Sheet"/></cacheSource>'
+            b'<cacheFields count="1"><cacheField name="K" numFmtId="0"><sharedItems/></cacheField></cacheFields>'
+            b'<extLst><ext uri="{725AE2AE-9491-48be-B2B4-4EB974FC3084}" '
+            b'xmlns:x14="http://schemas.microsoft.com/office/spreadsheetml/2009/9/main">'
+            b'<x14:pivotCacheDefinition pivotCacheId="%d"/></ext></extLst></pivotCacheDefinition>'
+        ) % (_NS, n, 10 + n)
+        parts[f"xl/pivotCache/_rels/pivotCacheDefinition{n}.xml.rels"] = _relationships(
+            (b"rId1", b"pivotCacheRecords", b"pivotCacheRecords%d.xml" % n))
+        parts[records] = b'<pivotCacheRecords %s count="2"><r><x v="0"/></r><r><x v="1"/></r></pivotCacheRecords>' % _NS
+        parts[table] = b'<pivotTableDefinition %s name="PT%d" cacheId="%d" dataCaption="Values"/>' % (_NS, n, n)
+        parts[f"xl/pivotTables/_rels/pivotTable{n}.xml.rels"] = _relationships(
+            (b"rId1", b"pivotCacheDefinition", b"../pivotCache/pivotCacheDefinition%d.xml" % n))
+        overrides += [
+            (definition, _CT_PIVOT + "CacheDefinition+xml"),
+            (records, _CT_PIVOT + "CacheRecords+xml"),
+            (table, _CT_PIVOT + "Table+xml"),
+        ]
+    parts.update(consumers or {})
+
+    def content_types(data):
+        for part, content_type in overrides:
+            data = add_override(part, content_type)(data)
+        return data
+
+    parts["xl/_rels/workbook.xml.rels"] = insert_before(b"</Relationships>", _relationship_elements(*wb_rels))
+    parts["[Content_Types].xml"] = content_types
+    parts["xl/workbook.xml"] = insert_before(b"</workbook>", b"<pivotCaches>%s</pivotCaches>" % caches)
+    return build_xlsx(tmp_path / "pivot.xlsx", parts=parts)
+
+
+def test_strip_pivot_cache_records_removes_records_and_refreshes_on_load(tmp_path):
+    path = _pivot_workbook(tmp_path, count=2)
+    assert package_cleanup_ops.strip_pivot_cache_records(path) > 0
+
+    names = part_names(path)
+    assert not any("pivotCacheRecords" in name for name in names)
+    assert b"pivotCacheRecords" not in read_part(path, "[Content_Types].xml")
+    for n in (1, 2):
+        definition = read_part(path, f"xl/pivotCache/pivotCacheDefinition{n}.xml")
+        start = definition[:definition.index(b">") + 1]
+        assert b'saveData="0"' in start and b'refreshOnLoad="1"' in start
+        assert b"r:id=" not in start
+        # Định nghĩa field của cache giữ nguyên để pivot table dựng lại được.
+        assert b'<cacheField name="K"' in definition
+        rels = f"xl/pivotCache/_rels/pivotCacheDefinition{n}.xml.rels"
+        assert rels not in names or b"pivotCacheRecords" not in read_part(path, rels)
+
+
+_SLICER_CACHE = (
+    b'<slicerCacheDefinition xmlns="http://schemas.microsoft.com/office/spreadsheetml/2009/9/main" '
+    b'name="Slicer_K" sourceName="K"><pivotTables><pivotTable tabId="1" name="PT2"/></pivotTables>'
+    b'<data><tabular pivotCacheId="12"><items count="0"/></tabular></data></slicerCacheDefinition>'
+)
+_TIMELINE_CACHE = (
+    b'<timelineCacheDefinition xmlns="http://schemas.microsoft.com/office/spreadsheetml/2010/11/main" '
+    b'name="NativeTimeline_K" sourceName="K"><pivotTables><pivotTable tabId="1" name="PT3"/></pivotTables>'
+    b'<state pivotCacheId="13" filterType="unknown"/></timelineCacheDefinition>'
+)
+
+
+def test_consolidate_pivot_caches_merges_identical_caches(tmp_path):
+    path = _pivot_workbook(tmp_path)
+    assert package_cleanup_ops.consolidate_pivot_caches(path) == 2
+
+    assert re.findall(rb'<pivotCache cacheId="(\d+)"', read_part(path, "xl/workbook.xml")) == [b"1"]
+    names = part_names(path)
+    assert "xl/pivotCache/pivotCacheDefinition1.xml" in names
+    assert "xl/pivotCache/pivotCacheDefinition2.xml" not in names
+    assert "xl/pivotCache/pivotCacheRecords3.xml" not in names
+    for n in (1, 2, 3):
+        assert b'cacheId="1"' in read_part(path, f"xl/pivotTables/pivotTable{n}.xml")
+        assert b"pivotCacheDefinition1.xml" in read_part(path, f"xl/pivotTables/_rels/pivotTable{n}.xml.rels")
+
+
+@pytest.mark.parametrize("consumers, kept", [
+    ({"xl/slicerCaches/slicerCache1.xml": _SLICER_CACHE}, [1, 2]),
+    ({"xl/timelineCaches/timelineCache1.xml": _TIMELINE_CACHE}, [1, 3]),
+    ({"xl/slicerCaches/slicerCache1.xml": _SLICER_CACHE,
+      "xl/timelineCaches/timelineCache1.xml": _TIMELINE_CACHE}, [1, 2, 3]),
+], ids=["slicer", "timeline", "both"])
+def test_consolidate_pivot_caches_keeps_caches_used_by_slicers_and_timelines(tmp_path, consumers, kept):
+    # Slicer trỏ tới x14 pivotCacheId 12 (cache 2), timeline trỏ tới 13 (cache 3).
+    path = _pivot_workbook(tmp_path, consumers=consumers)
+    assert package_cleanup_ops.consolidate_pivot_caches(path) == 3 - len(kept)
+
+    workbook = read_part(path, "xl/workbook.xml")
+    assert [int(n) for n in re.findall(rb'<pivotCache cacheId="(\d+)"', workbook)] == kept
+    names = part_names(path)
+    for n in kept:
+        assert f"xl/pivotCache/pivotCacheDefinition{n}.xml" in names
+        assert b'cacheId="%d"' % n in read_part(path, f"xl/pivotTables/pivotTable{n}.xml")
+    for part, data in consumers.items():
+        assert read_part(path, part) == data
+
+
+# ======================================================================
+# --- Defined Name ---
+# ======================================================================
+
+_DEFINED_NAMES = (
+    b'<definedNames>'
+    b'<definedName name="Target">Sheet!$C$1:$C$5</definedName>'
+    b'<definedName name="UsedInCell">Sheet!$D$1</definedName>'
+    b'<definedName name="BrokenUsed">#REF!$A$1</definedName>'
+    b'<definedName name="BrokenUnused">#REF!$B$1</definedName>'
+    b'<definedName name="HiddenName" hidden="1">Sheet!$E$1</definedName>'
+    b'<definedName name="Unused">Sheet!$F$1</definedName>'
+    b'</definedNames>'
+)
+
+
+def _names_workbook(tmp_path, extra_parts=None):
+    def populate(wb):
+        ws = wb.active
+        ws["A1"] = "=UsedInCell*2"
+        ws["A2"] = "=BrokenUsed+1"
+
+    parts = {"xl/workbook.xml": lambda data: data.replace(b"<definedNames />", _DEFINED_NAMES)}
+    parts.update(extra_parts or {})
+    return build_xlsx(tmp_path / "names.xlsx", populate, parts)
+
+
+def _remaining_names(path):
+    return re.findall(rb'<definedName name="([^"]+)"', read_part(path, "xl/workbook.xml"))
+
+
+def test_defined_names_default_classes(tmp_path):
+    path = _names_workbook(tmp_path)
+    summary = package_cleanup_ops.clean_defined_names(path)
+
+    # Name #REF! còn được công thức dùng và name ẩn được giữ; name lỗi/không dùng bị xoá.
+    assert _remaining_names(path) == [b"UsedInCell", b"BrokenUsed", b"HiddenName"]
+    assert summary[package_cleanup_ops.NAME_IN_USE] == (2, 0)
+    assert summary[package_cleanup_ops.NAME_BROKEN] == (1, 1)
+    assert summary[package_cleanup_ops.NAME_HIDDEN] == (1, 0)
+    assert summary[package_cleanup_ops.NAME_UNUSED] == (2, 2)
+
+
+_VML = (
+    b'<xml xmlns:v="urn:schemas-microsoft-com:vml" xmlns:x="urn:schemas-microsoft-com:office:excel">'
+    b'<v:shape id="_x0000_s1025"><x:ClientData ObjectType="Drop">'
+    b'<x:FmlaRange>Target</x:FmlaRange><x:Sel>1</x:Sel></x:ClientData></v:shape></xml>'
+)
+
+_REFERENCE_SOURCES = {
+    "formula": {SHEET: lambda data: data.replace(b"<f>UsedInCell*2</f>", b"<f>UsedInCell*SUM(Target)</f>")},
+    "hyperlink_location": {SHEET: insert_before(
+        b"<pageMargins", b'<hyperlinks><hyperlink ref="B1" location="Target" display="Go"/></hyperlinks>')},
+    "ctrl_props_range": {"xl/ctrlProps/ctrlProp1.xml": (
+        b'<formControlPr xmlns="http://schemas.microsoft.com/office/spreadsheetml/2009/9/main" '
+        b'objectType="Drop" dropStyle="combo" fmlaRange="Target"/>')},
+    "ctrl_props_link": {"xl/ctrlProps/ctrlProp1.xml": (
+        b'<formControlPr xmlns="http://schemas.microsoft.com/office/spreadsheetml/2009/9/main" '
+        b'objectType="CheckBox" fmlaLink="Target"/>')},
+    "vml_form_control": {"xl/drawings/vmlDrawing1.vml": _VML},
+    "data_validation_attribute": {SHEET: insert_before(
+        b"<pageMargins",
+        b'<dataValidations count="1"><dataValidation type="list" sqref="B1" formula1="Target"/></dataValidations>')},
+    "data_validation_element": {SHEET: insert_before(
+        b"<pageMargins",
+        b'<dataValidations count="1"><dataValidation type="list" sqref="B1">'
+        b'<formula1>Target</formula1></dataValidation></dataValidations>')},
+}
+
+
+@pytest.mark.parametrize("source", sorted(_REFERENCE_SOURCES))
+def test_defined_name_referenced_from_source_is_kept(tmp_path, source):
+    path = _names_workbook(tmp_path, _REFERENCE_SOURCES[source])
+    package_cleanup_ops.clean_defined_names(path)
+
+    remaining = _remaining_names(path)
+    assert b"Target" in remaining
+    assert b"Unused" not in remaining
+
+
+def test_defined_names_hidden_removed_when_requested(tmp_path):
+    path = _names_workbook(tmp_path)
+    package_cleanup_ops.clean_defined_names(path, remove_classes=(package_cleanup_ops.NAME_HIDDEN,))
+    assert b"HiddenName" not in _remaining_names(path)
+    assert b"Unused" in _remaining_names(path)
+
+
+def test_classify_defined_names_covers_every_class(tmp_path):
+    extra = (
+        b'<definedName name="_xlnm.Print_Area" localSheetId="0">Sheet!$A$1:$D$20</definedName>'
+        b'<definedName name="Rates">[1]Data!$A$1:$A$9</definedName>'
+        b'<definedName name="Chain">Sheet!$G$1</definedName>'
+        b'<definedName name="UsesChain">Chain*2</definedName>'
+        b'<definedName name="_xlfn.SINGLE">#NAME?</definedName>'
+    )
+    path = _names_workbook(tmp_path, {"xl/workbook.xml": lambda data: data.replace(
+        b"<definedNames />", _DEFINED_NAMES.replace(b"</definedNames>", extra + b"</definedNames>"))})
+
+    with package_ops.ExcelPackage(path) as pkg:
+        root, _ = pkg.read_xml(pkg.workbook_part())
+        names = root.find(package_ops.qn(package_ops.NS_MAIN, "definedNames"))
+        classes = {element.get("name"): category for element, category in
+                   package_cleanup_ops.classify_defined_names(pkg, list(names))}
+
+    assert classes == {
+        "Target": package_cleanup_ops.NAME_UNUSED,
+        "UsedInCell": package_cleanup_ops.NAME_IN_USE,
+        "BrokenUsed": package_cleanup_ops.NAME_IN_USE,
+        "BrokenUnused": package_cleanup_ops.NAME_BROKEN,
+        "HiddenName": package_cleanup_ops.NAME_HIDDEN,
+        "Unused": package_cleanup_ops.NAME_UNUSED,
+        "_xlnm.Print_Area": package_cleanup_ops.NAME_PRINT,
+        "Rates": package_cleanup_ops.NAME_EXTERNAL,
+        "Chain": package_cleanup_ops.NAME_IN_USE,        # được name khác tham chiếu
+        "UsesChain": package_cleanup_ops.NAME_UNUSED,
+        "_xlfn.SINGLE": package_cleanup_ops.NAME_IN_USE,  # name nội bộ của Excel
+    }
+
+
+# ======================================================================
+# --- Liên kết ngoài ---
+# ======================================================================
+
+_EXTERNAL_SHEET_DATA = (
+    b'<sheetData>'
+    b'<row r="1"><c r="A1"><f>[1]Data!$A$1*2</f><v>10</v></c>'
+    b'<c r="B1" t="str"><f>[1]Data!$B$1&amp;"x"</f><v>abc</v></c>'
+    b'<c r="C1"><f>A1+1</f><v>11</v></c></row>'
+    b'<row r="2"><c r="A2"><f t="shared" ref="A2:A3" si="0">[1]Data!$A$2</f><v>1</v></c></row>'
+    b'<row r="3"><c r="A3"><f t="shared" si="0"/><v>2</v></c></row>'
+    b'</sheetData>'
+)
+
+_CHART = (
+    b'<c:chartSpace xmlns:c="http://schemas.openxmlformats.org/drawingml/2006/chart" '
+    b'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main"><c:chart>'
+    b'<c:title><c:tx><c:strRef><c:f>[1]Data!$D$1</c:f><c:strCache><c:ptCount val="1"/>'
+    b'<c:pt idx="0"><c:v>Doanh thu</c:v></c:pt></c:strCache></c:strRef></c:tx></c:title>'
+    b'<c:plotArea><c:barChart><c:ser><c:idx val="0"/><c:order val="0"/>'
+    b'<c:tx><c:strRef><c:f>[1]Data!$B$1</c:f><c:strCache><c:ptCount val="1"/>'
+    b'<c:pt idx="0"><c:v>Q1</c:v></c:pt></c:strCache></c:strRef></c:tx>'
+    b'<c:cat><c:strRef><c:f>[1]Data!$A$2:$A$3</c:f><c:strCache><c:ptCount val="2"/>'
+    b'<c:pt idx="0"><c:v>HN</c:v></c:pt><c:pt idx="1"><c:v>HCM</c:v></c:pt></c:strCache></c:strRef></c:cat>'
+    b'<c:val><c:numRef><c:f>[1]Data!$B$2:$B$3</c:f><c:numCache><c:formatCode>General</c:formatCode>'
+    b'<c:ptCount val="2"/><c:pt idx="0"><c:v>5</c:v></c:pt><c:pt idx="1"><c:v>7</c:v></c:pt>'
+    b'</c:numCache></c:numRef></c:val></c:ser></c:barChart></c:plotArea></c:chart></c:chartSpace>'
+)
+
+_EXTERNAL_LINK = "xl/externalLinks/externalLink1.xml"
+
+
+def _linked_workbook(tmp_path, extra_parts=None):
+    parts = {
+        SHEET: lambda data: data.replace(b"<sheetData></sheetData>", _EXTERNAL_SHEET_DATA),
+        "xl/workbook.xml": insert_before(
+            b"<definedNames />", b'<externalReferences><externalReference r:id="rId9"/></externalReferences>'),
+        "xl/_rels/workbook.xml.rels": insert_before(
+            b"</Relationships>",
+            b'<Relationship Id="rId9" Target="externalLinks/externalLink1.xml" Type="http://schemas.'
+            b'openxmlformats.org/officeDocument/2006/relationships/externalLink"/>'),
+        _EXTERNAL_LINK: (
+            b'<externalLink xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            b'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            b'<externalBook r:id="rId1"/></externalLink>'),
+        "xl/externalLinks/_rels/externalLink1.xml.rels": (
+            b'<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            b'<Relationship Id="rId1" Target="file:///\\\\server\\share\\source.xlsx" TargetMode="External" '
+            b'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/externalLinkPath"/>'
+            b'</Relationships>'),
+        "[Content_Types].xml": add_override(
+            _EXTERNAL_LINK, "application/vnd.openxmlformats-officedocument.spreadsheetml.externalLink+xml"),
+    }
+    parts.update(extra_parts or {})
+    return build_xlsx(tmp_path / "linked.xlsx", parts=parts)
+
+
+def test_external_links_freeze_plain_shared_and_string_formulas(tmp_path):
+    path = _linked_workbook(tmp_path)
+    assert package_cleanup_ops.remove_external_links(path) == (1, 4)
+
+    sheet = read_part(path, SHEET)
+    assert b"[1]" not in sheet
+    assert b'<c r="A1"><v>10</v></c>' in sheet
+    assert b'<c r="B1" t="inlineStr"><is><t xml:space="preserve">abc</t></is></c>' in sheet
+    assert b'<c r="A2"><v>1</v></c>' in sheet and b'<c r="A3"><v>2</v></c>' in sheet
+    # Công thức nội bộ giữ nguyên.
+    assert b'<c r="C1"><f>A1+1</f><v>11</v></c>' in sheet
+    assert _EXTERNAL_LINK not in part_names(path)
+    assert b"externalReferences" not in read_part(path, "xl/workbook.xml")
+    assert b"externalLink" not in read_part(path, "[Content_Types].xml")
+
+
+def test_external_links_freeze_chart_references_from_cache(tmp_path):
+    path = _linked_workbook(tmp_path, {"xl/charts/chart1.xml": _CHART})
+    assert package_cleanup_ops.remove_external_links(path) == (1, 8)
+
+    chart = read_part(path, "xl/charts/chart1.xml")
+    assert b"<c:f>" not in chart and b"Ref>" not in chart
+    assert b"<a:t>Doanh thu</a:t>" in chart
+    assert b"<c:tx><c:v>Q1</c:v></c:tx>" in chart
+    assert b'<c:cat><c:strLit><c:ptCount val="2" /><c:pt idx="0"><c:v>HN</c:v>' in chart
+    assert b"<c:val><c:numLit><c:formatCode>General</c:formatCode>" in chart
+
+
+def test_external_links_unfreezable_reference_leaves_file_unchanged(tmp_path):
+    validation = insert_before(
+        b"<pageMargins",
+        b'<dataValidations count="1"><dataValidation type="list" sqref="D1">'
+        b'<formula1>[1]Data!$A$1:$A$3</formula1></dataValidation></dataValidations>')
+    path = _linked_workbook(tmp_path)
+    patch_parts(path, {SHEET: validation})
+    before = read_part(path, SHEET)
+
+    assert package_cleanup_ops.remove_external_links(path) is None
+    assert read_part(path, SHEET) == before
+    assert _EXTERNAL_LINK in part_names(path)
+
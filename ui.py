@@ -1,6 +1,6 @@
 # Đường dẫn: excel_toolkit/ui.py
-# Phiên bản 1.3 - Sửa lỗi khoảng trống layout trong giao diện chính
-# Ngày cập nhật: 2025-09-16
+# Phiên bản 2.0 - Tùy chọn mức gộp cho tác vụ gộp ảnh trùng
+# Ngày cập nhật: 2026-10-19
 
 import customtkinter
 import tkinter as tk
@@ -49,6 +49,7 @@ class TaskSelectionDialog(customtkinter.CTkToplevel):
         self.quality_entry = None
         self.quality_label = None
         self.label_text_var = None
+        self.duplicate_tolerance_var = None
         self.task_option_frames = {}
         self.task_option_pack_opts = {}
         self._bulk_toggle_in_progress = False
@@ -182,6 +183,15 @@ class TaskSelectionDialog(customtkinter.CTkToplevel):
             reset_callback=self._reset_compress_state
         )
 
+        duplicate_var = self.tasks_vars.get("consolidate_duplicate_images")
+        should_show_duplicate_options = duplicate_var and duplicate_var.get() == "on"
+        self._render_option(
+            "consolidate_duplicate_images",
+            should_show_duplicate_options,
+            self._build_duplicate_images_options,
+            reset_callback=lambda: setattr(self, "duplicate_tolerance_var", None)
+        )
+
     def _render_option(self, task_id, should_show, builder, reset_callback=None):
         frame = self.task_option_frames.get(task_id)
         if not frame:
@@ -224,6 +234,29 @@ class TaskSelectionDialog(customtkinter.CTkToplevel):
         )
         label_option_menu.grid(row=0, column=1, pady=5, sticky="w")
 
+    def _build_duplicate_images_options(self, frame):
+        frame.grid_columnconfigure(1, weight=1)
+
+        tolerance_label = customtkinter.CTkLabel(
+            frame,
+            text=translator.get_text("duplicate_tolerance_label"),
+            font=customtkinter.CTkFont(weight="bold")
+        )
+        tolerance_label.grid(row=0, column=0, padx=(0, 5), pady=5, sticky="w")
+
+        tolerance_options = [
+            translator.get_text("duplicate_tolerance_conservative"),
+            translator.get_text("duplicate_tolerance_exact"),
+            translator.get_text("duplicate_tolerance_loose"),
+        ]
+        self.duplicate_tolerance_var = customtkinter.StringVar(value=tolerance_options[0])
+        tolerance_menu = customtkinter.CTkOptionMenu(
+            frame,
+            values=tolerance_options,
+            variable=self.duplicate_tolerance_var
+        )
+        tolerance_menu.grid(row=0, column=1, pady=5, sticky="w")
+
     def _build_compress_options(self, frame):
         frame.grid_columnconfigure(3, weight=1)
 
@@ -293,8 +326,14 @@ class TaskSelectionDialog(customtkinter.CTkToplevel):
             },
             "category_optimization": {
                 "clear_excess_cell_formatting": translator.get_text("task_clear_excess_cell_formatting"),
+                "clean_named_styles": translator.get_text("task_clean_named_styles"),
+                "optimize_cell_formats": translator.get_text("task_optimize_cell_formats"),
+                "compact_shared_strings": translator.get_text("task_compact_shared_strings"),
+                "remove_calc_chain": translator.get_text("task_remove_calc_chain"),
                 "compress_all_images": translator.get_text("task_compress_all_images"),
+                "consolidate_duplicate_images": translator.get_text("task_consolidate_duplicate_images"),
                 "refresh_and_clean_pivot_caches": translator.get_text("task_refresh_and_clean_pivot_caches"),
+                "consolidate_pivot_caches": translator.get_text("task_consolidate_pivot_caches"),
             },
             "category_utilities": {
                 "add_label": translator.get_text("task_add_label"),
@@ -368,9 +407,15 @@ class TaskSelectionDialog(customtkinter.CTkToplevel):
         else:
             label_value = None
 
+        if "consolidate_duplicate_images" in self.result and self.duplicate_tolerance_var:
+            tolerance_value = self.duplicate_tolerance_var.get()
+        else:
+            tolerance_value = None
+
         self.engine_var = engine_value
         self.quality_var = quality_value
         self.label_text_var = label_value
+        self.duplicate_tolerance_var = tolerance_value
 
         self._close_dialog()
 
@@ -380,7 +425,7 @@ class TaskSelectionDialog(customtkinter.CTkToplevel):
 
     def get_selected_tasks(self):
         self.wait_window()
-        return self.result, self.engine_var, self.quality_var, self.label_text_var
+        return self.result, self.engine_var, self.quality_var, self.label_text_var, self.duplicate_tolerance_var
 
     def _update_dialog_geometry(self):
         self.update_idletasks()
@@ -1,18 +1,23 @@
 # Đường dẫn: excel_toolkit/utils/compressor_engine_pil.py
 # Tên cũ: image_compressor_api.py
-# Phiên bản 1.8 - Vô hiệu hóa kiểm tra xoay/khóa tỉ lệ theo yêu cầu
-# Ngày cập nhật: 2025-09-15
+# Phiên bản 3.1 - Lập lệnh z-order trên toàn bộ shape của sheet (kể cả shape không có trong thứ tự đã lưu)
+# Ngày cập nhật: 2026-10-19
 
+import io
 import os
 import time
-import uuid
+import shutil
 import logging
+import tempfile
+import itertools
 from dataclasses import dataclass, replace
 from typing import Dict, Optional, Tuple
 
 import pythoncom
 from PIL import Image, ImageGrab
 
+from utils import image_ops, media_ops
+
 # --- Hằng số Office/Excel ---
 xlScreen = 1
 xlBitmap = 2
@@ -27,6 +32,8 @@ msoSendBackward = 3
 msoTrue = -1
 msoFalse = 0
 
+_PICTURE_TYPES = (msoPicture, msoLinkedPicture)
+
 def _doevents_pulse():
     """Bơm message queue để COM không treo."""
     try:
@@ -58,51 +65,61 @@ def _copy_shape_to_image(shape, timeout_sec=3.0, sleep_step=0.05):
     logging.warning(f"Clipboard không trả về ảnh sau {timeout_sec} giây.")
     return None
 
-def _snapshot_shape_props(shape):
+def _snapshot_shape_props(api, name=None, zpos=None, size=None):
     """
-    Lấy ảnh chụp thuộc tính cần bảo toàn để khôi phục sau:
+    Lấy ảnh chụp thuộc tính cần bảo toàn để khôi phục sau (đọc trực tiếp từ COM ``api``):
     vị trí, kích thước, xoay, khoá tỉ lệ, placement, tên, visible, alt text, hyperlink, z-order.
+    ``name``/``zpos``/``size`` (width, height) đã đọc sẵn thì truyền vào để khỏi gọi COM lại.
     """
-    api = shape.api
+    width, height = size if size is not None else (api.Width, api.Height)
     props = {
-        'name': shape.name,
-        'left': shape.left,
-        'top': shape.top,
-        'width': shape.width,
-        'height': shape.height,
+        'name': name if name is not None else api.Name,
+        'left': api.Left,
+        'top': api.Top,
+        'width': width,
+        'height': height,
         'rotation': getattr(api, 'Rotation', 0),
         'lock_aspect': getattr(api, 'LockAspectRatio', False),
         'placement': getattr(api, 'Placement', None),  # xlMove/xlMoveAndSize/xlFreeFloating
         'visible': getattr(api, 'Visible', True),
         'alt_text': getattr(api, 'AlternativeText', ''),
-        'zpos': getattr(api, 'ZOrderPosition', None),
+        'zpos': zpos if zpos is not None else getattr(api, 'ZOrderPosition', None),
         'hyperlink': None,
     }
-    # Hyperlink (nếu có)
+    # Hyperlink (nếu có) - shape không có hyperlink sẽ ném lỗi COM
     try:
-        hl = getattr(shape, 'hyperlink', None)
-        # xlwings wrapper có .hyperlink hoặc shape.api.Hyperlink
-        if hl and (getattr(hl, 'address', None) or getattr(hl, 'sub_address', None)):
+        hla = api.Hyperlink
+        if hla and (getattr(hla, 'Address', None) or getattr(hla, 'SubAddress', None)):
             props['hyperlink'] = {
-                'address': getattr(hl, 'address', None),
-                'sub_address': getattr(hl, 'sub_address', None),
-                'screen_tip': getattr(hl, 'screen_tip', None),
-                'text_to_display': getattr(hl, 'text_to_display', None),
+                'address': getattr(hla, 'Address', None),
+                'sub_address': getattr(hla, 'SubAddress', None),
+                'screen_tip': getattr(hla, 'ScreenTip', None),
+                'text_to_display': getattr(hla, 'TextToDisplay', None),
             }
-        else:
-            # Thử COM thuần
-            hla = getattr(api, 'Hyperlink', None)
-            if hla and (getattr(hla, 'Address', None) or getattr(hla, 'SubAddress', None)):
-                props['hyperlink'] = {
-                    'address': getattr(hla, 'Address', None),
-                    'sub_address': getattr(hla, 'SubAddress', None),
-                    'screen_tip': getattr(hla, 'ScreenTip', None),
-                    'text_to_display': getattr(hla, 'TextToDisplay', None),
-                }
     except Exception:
         pass
     return props
 
+def _snapshot_sheet_shapes(sheet):
+    """
+    Duyệt ``Shapes`` của sheet một lượt duy nhất, trả về danh sách theo z-order (sau -> trước),
+    mỗi phần tử gồm ``name``, ``type``, ``zpos`` và ``size`` (width, height - chỉ với ảnh).
+    COM không cho đọc thuộc tính hàng loạt, nên thuộc tính đầy đủ (:func:`_snapshot_shape_props`)
+    chỉ được đọc cho ảnh thực sự được thay, ngay trước khi xoá.
+    """
+    entries = []
+    for api in sheet.api.Shapes:
+        try:
+            entry = {'name': api.Name, 'type': api.Type, 'zpos': api.ZOrderPosition, 'size': None}
+            if entry['type'] in _PICTURE_TYPES:
+                entry['size'] = (api.Width, api.Height)
+        except Exception as e:
+            logging.debug(f"Không đọc được thuộc tính shape trên sheet '{sheet.name}': {e}")
+            continue
+        entries.append(entry)
+    entries.sort(key=lambda e: e['zpos'] if e['zpos'] is not None else 0)
+    return entries
+
 def _normalize_lock_value(value):
     """Chuẩn hoá LockAspectRatio sang tuple (bool, hằng số mso)."""
 
@@ -227,15 +244,29 @@ class CompressionOptions:
     """Tập hợp các tùy chọn nén ảnh.
 
     Các trường được giữ đơn giản để vẫn tương thích với tham số cũ:
-    - ``mode``: chiến lược chọn định dạng đầu ra.
+    - ``mode``: chiến lược chọn định dạng đầu ra (``auto``/``jpeg``/``png``/``webp``/``png_lossless``).
+      ``auto`` phân loại nội dung ảnh (xem ``image_ops.classify_image``) để chọn JPEG (kèm chroma
+      subsampling phù hợp), PNG bảng màu hoặc PNG truecolor.
+      ``png_lossless`` giữ nguyên từng pixel: thử song song các biến thể bit-depth/bảng màu
+      chính xác, mức nén và chiến lược zlib rồi giữ file PNG nhỏ nhất.
     - ``jpeg_quality``/``jpeg_optimize``/``jpeg_progressive``: cấu hình JPEG.
     - ``jpeg_background``: màu nền dùng để làm phẳng lớp alpha khi ép sang JPEG.
     - ``png_optimize``/``png_colors``/``png_compress_level``: cấu hình PNG.
+    - ``png_trial_workers``: số luồng thử nghiệm của ``png_lossless``; ``None`` để tự chọn.
     - ``webp_quality``/``webp_lossless``: cấu hình WebP (nếu được chọn).
     - ``keep_dpi``: đặt DPI cho ảnh đầu ra; ``None`` để giữ nguyên.
     - ``max_width``/``max_height``: thu nhỏ ảnh khi lớn hơn kích thước chỉ định.
+    - ``target_dpi``: DPI hiệu dụng mong muốn theo kích thước hiển thị của từng ảnh
+      trên sheet; ``None`` để tắt.
     - ``resize_filter``: bộ lọc nội suy (Pillow constant, ví dụ ``Image.LANCZOS``).
     - ``strip_metadata``: loại bỏ EXIF/IPTC để giảm dung lượng.
+    - ``max_size_kb``: dung lượng mục tiêu cho mỗi ảnh; ``None`` để tắt. Khi bật, chất lượng
+      được tìm trong khoảng ``min_quality``..``jpeg_quality``/``webp_quality`` và ảnh có thể
+      được thu nhỏ tối đa ``max_downscale_iterations`` lần theo hệ số ``downscale_step``.
+    - ``ssim_threshold``: bật chế độ cảm nhận - chọn chất lượng JPEG/WebP thấp nhất mà SSIM
+      so với ảnh gốc vẫn không dưới ngưỡng (ví dụ ``0.98``); ``None`` để tắt.
+    - ``min_saving_ratio``: chỉ thay ảnh khi nhỏ hơn ảnh gốc ít nhất tỉ lệ này (0.05 = 5%),
+      ngược lại giữ nguyên ảnh gốc.
     """
 
     mode: str = "auto"
@@ -246,13 +277,21 @@ class CompressionOptions:
     png_optimize: bool = True
     png_colors: Optional[int] = 256
     png_compress_level: int = 9
+    png_trial_workers: Optional[int] = None
     webp_quality: int = 75
     webp_lossless: bool = False
     keep_dpi: Optional[int] = 96
     max_width: Optional[int] = None
     max_height: Optional[int] = None
+    target_dpi: Optional[int] = 150
     resize_filter: int = Image.LANCZOS
     strip_metadata: bool = True
+    max_size_kb: Optional[int] = None
+    min_quality: int = 35
+    downscale_step: float = 0.85
+    max_downscale_iterations: int = 4
+    ssim_threshold: Optional[float] = None
+    min_saving_ratio: float = 0.05
 
     @staticmethod
     def from_legacy(quality: int = 70, mode: str = "auto", keep_dpi: Optional[int] = 96, **kwargs) -> "CompressionOptions":
@@ -271,10 +310,28 @@ class CompressionOptions:
         return opts
 
 
-def _prepare_image(img: Image.Image, opts: CompressionOptions) -> Tuple[Image.Image, str, Dict[str, object]]:
-    """Chuyển đổi ảnh gốc sang định dạng và tham số lưu phù hợp với ``opts``."""
+def _prepare_image(
+    img: Image.Image,
+    opts: CompressionOptions,
+    display_size: Optional[Tuple[float, float]] = None,
+) -> Tuple[Image.Image, str, Dict[str, object]]:
+    """Chuyển đổi ảnh gốc sang định dạng và tham số lưu phù hợp với ``opts``.
+
+    ``display_size`` là kích thước (point) của ảnh trên sheet, dùng cùng ``target_dpi``
+    để thu nhỏ ảnh về đúng số pixel thực sự hiển thị.
+    """
+
+    # Tính kích thước đích trước để co nguyên lần bằng ``reduce`` rồi mới resample,
+    # tránh sao chép/resample toàn bộ ảnh gốc ở độ phân giải đầy đủ.
+    target_size = image_ops.bounded_size(img.size, opts.max_width, opts.max_height)
+    if opts.target_dpi and display_size:
+        target_size = image_ops.display_fit_size(target_size, display_size, opts.target_dpi)
+    if target_size != img.size:
+        image_ops.prepare_draft(img, target_size)
+        img = image_ops.resize_reduced(img, target_size, opts.resize_filter)
+    else:
+        img = img.copy()
 
-    img = img.copy()
     if opts.strip_metadata:
         try:
             img.info.pop("exif", None)
@@ -284,37 +341,32 @@ def _prepare_image(img: Image.Image, opts: CompressionOptions) -> Tuple[Image.Im
         except Exception:
             pass
 
-    if opts.max_width or opts.max_height:
-        max_w = opts.max_width or img.width
-        max_h = opts.max_height or img.height
-        if img.width > max_w or img.height > max_h:
-            ratio_w = max_w / img.width
-            ratio_h = max_h / img.height
-            ratio = min(ratio_w, ratio_h)
-            new_size = (int(img.width * ratio), int(img.height * ratio))
-            if new_size[0] > 0 and new_size[1] > 0:
-                img = img.resize(new_size, opts.resize_filter)
-
     mode = opts.mode.lower()
     save_kwargs: Dict[str, object] = {}
     if opts.keep_dpi:
         save_kwargs["dpi"] = (opts.keep_dpi, opts.keep_dpi)
 
     # Tự chọn định dạng nếu để auto.
+    profile = None
     if mode == "auto":
-        if img.mode in ("RGBA", "LA", "P") and getattr(img, "info", {}).get("transparency") is not None:
-            fmt = "PNG"
-        else:
-            fmt = "JPEG"
+        profile = image_ops.classify_image(img)
+        logging.debug(
+            f"    -> Phân loại ảnh: {profile.format}, {profile.unique_colors or 'nhiều'} màu, "
+            f"mật độ cạnh {profile.edge_density:.3f}, alpha '{profile.alpha}'"
+        )
+        if profile.flatten_alpha:
+            # Alpha đục hoàn toàn -> bỏ kênh alpha thay vì coi là ảnh trong suốt.
+            img = img.convert("RGB")
+        fmt = "JPEG" if profile.format == image_ops.FORMAT_JPEG else "PNG"
     elif mode == "jpeg":
         fmt = "JPEG"
-    elif mode == "png":
+    elif mode in ("png", "png_lossless"):
         fmt = "PNG"
     elif mode == "webp":
         fmt = "WEBP"
     else:
         logging.warning(f"Mode '{opts.mode}' không hợp lệ, sử dụng 'auto'.")
-        return _prepare_image(img, replace(opts, mode="auto"))
+        return _prepare_image(img, replace(opts, mode="auto"), display_size)
 
     if fmt == "JPEG":
         if img.mode not in ("RGB", "L"):
@@ -331,6 +383,20 @@ def _prepare_image(img: Image.Image, opts: CompressionOptions) -> Tuple[Image.Im
             optimize=opts.jpeg_optimize,
             progressive=opts.jpeg_progressive,
         )
+        if profile is not None:
+            save_kwargs["subsampling"] = profile.subsampling
+    elif fmt == "PNG" and mode == "png_lossless":
+        # Mode/bảng màu được chọn lúc mã hoá (xem ``image_ops.optimize_png_lossless``).
+        pass
+    elif fmt == "PNG" and profile is not None:
+        # Ít màu -> bảng màu chính xác (không mất dữ liệu); nhiều màu -> giữ truecolor.
+        palette = image_ops.exact_palette(img) if profile.format == image_ops.FORMAT_PNG_PALETTE else None
+        if palette is not None:
+            img, palette_kwargs = palette
+            save_kwargs.update(palette_kwargs)
+        elif img.mode not in ("RGBA", "LA", "RGB", "L"):
+            img = img.convert("RGBA" if profile.alpha != "none" else "RGB")
+        save_kwargs.update(optimize=opts.png_optimize, compress_level=max(0, min(9, opts.png_compress_level)))
     elif fmt == "PNG":
         if img.mode not in ("RGBA", "LA", "RGB", "L"):
             img = img.convert("RGBA")
@@ -348,39 +414,187 @@ def _prepare_image(img: Image.Image, opts: CompressionOptions) -> Tuple[Image.Im
     return img, fmt, save_kwargs
 
 
-def _export_and_replace(shape, sheet, quality=70, mode='auto', keep_dpi=96, *, options: Optional[CompressionOptions] = None, **extra):
+def _encode_image(
+    img: Image.Image, fmt: str, save_kwargs: Dict[str, object], opts: Optional[CompressionOptions] = None
+) -> bytes:
+    if fmt == "PNG" and opts is not None and opts.mode.lower() == "png_lossless":
+        optimized = image_ops.optimize_png_lossless(img, save_kwargs.get("dpi"), opts.png_trial_workers)
+        if optimized is not None:
+            return optimized[0]
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt, **save_kwargs)
+    return buffer.getvalue()
+
+
+def _encode_with_target_size(
+    img: Image.Image, fmt: str, save_kwargs: Dict[str, object], opts: CompressionOptions
+) -> Tuple[bytes, Dict[str, object]]:
     """
-    Trích xuất shape -> nén -> xoá shape cũ -> chèn lại ảnh -> khôi phục props.
+    Mã hoá ảnh theo ``save_kwargs``, có thể kèm:
+    - ``ssim_threshold``: hạ chất lượng xuống mức thấp nhất vẫn giữ SSIM đạt ngưỡng;
+    - ``max_size_kb``: tìm chất lượng/kích thước lớn nhất (không vượt mức trên) vừa mục tiêu.
+
+    Trả về ``(data, details)`` với ``details`` gồm ``quality`` và ``ssim`` (nếu có).
     """
-    logging.debug("    -> Lấy thuộc tính của shape để khôi phục...")
-    props = _snapshot_shape_props(shape)
 
+    lossy = fmt in ("JPEG", "WEBP") and not save_kwargs.get("lossless")
+    details: Dict[str, object] = {"quality": save_kwargs.get("quality") if lossy else None, "ssim": None}
+    if not opts.max_size_kb and not (lossy and opts.ssim_threshold):
+        return _encode_image(img, fmt, save_kwargs, opts), details
+
+    encoded: Dict[Tuple[Tuple[int, int], Optional[int]], bytes] = {}
+
+    def encode(candidate: Image.Image, quality: Optional[int]) -> bytes:
+        key = (candidate.size, quality)
+        if key not in encoded:
+            kwargs = dict(save_kwargs)
+            if quality is not None:
+                kwargs["quality"] = quality
+            encoded[key] = _encode_image(candidate, fmt, kwargs, opts)
+        return encoded[key]
+
+    if lossy:
+        top_quality = int(save_kwargs["quality"])
+        qualities = range(max(1, min(opts.min_quality, top_quality)), top_quality + 1)
+    else:
+        qualities = [None]
+
+    if lossy and opts.ssim_threshold:
+        top_quality, score = image_ops.select_quality_by_ssim(img, encode, qualities, opts.ssim_threshold)
+        qualities = [q for q in qualities if q <= top_quality]
+        details.update(quality=top_quality, ssim=score)
+        if not opts.max_size_kb:
+            return encode(img, top_quality), details
+
+    sizes = image_ops.downscale_sizes(img.size, opts.downscale_step, opts.max_downscale_iterations)
+    data, result_img, quality, fits = image_ops.encode_to_target_size(
+        img, opts.max_size_kb * 1024, encode, qualities, sizes, opts.resize_filter
+    )
+    if quality != details["quality"] or result_img.size != img.size:
+        details.update(quality=quality, ssim=None)
+    if not fits:
+        logging.debug(f"    -> Không đạt được {opts.max_size_kb}KB, dùng kết quả nhỏ nhất ({len(data) / 1024:.1f}KB).")
+    return data, details
+
+
+class _ImageStaging:
+    """
+    Nơi lưu tạm ảnh đã nén trước khi chèn lại (``Shapes.AddPicture`` chỉ nhận đường dẫn file).
+
+    Mỗi lượt nén dùng một thư mục riêng trong thư mục tạm của hệ thống (ổ cục bộ/tmpfs, không
+    phải thư mục làm việc có thể nằm trên mạng) nên nhiều tiến trình chạy song song không đụng
+    nhau; toàn bộ thư mục được xoá một lần khi kết thúc thay vì xoá từng file.
+    """
+
+    def __init__(self):
+        self.directory = tempfile.mkdtemp(prefix="excel_img_")
+        self._counter = itertools.count(1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.cleanup()
+
+    def stage(self, data: bytes, fmt: str) -> str:
+        path = os.path.join(self.directory, f"{next(self._counter)}.{fmt.lower()}")
+        with open(path, "wb") as staged_file:
+            staged_file.write(data)
+        return path
+
+    def discard(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def cleanup(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _stage_replacement(
+    shape,
+    sheet,
+    props: Dict[str, object],
+    opts: CompressionOptions,
+    staging: _ImageStaging,
+    *,
+    original_bytes: Optional[int] = None,
+    report: Optional[image_ops.CompressionReport] = None,
+) -> Optional[Dict[str, object]]:
+    """
+    Trích xuất shape -> nén -> lưu vào ``staging``. Không sửa workbook. ``props`` chỉ cần
+    ``name``, ``width``, ``height``.
+
+    Trả về thông tin để :func:`_insert_replacement` chèn lại, hoặc ``None`` nếu bỏ qua (lỗi,
+    hoặc ảnh mới không nhỏ hơn ảnh gốc ``original_bytes`` đủ ``min_saving_ratio``).
+    """
     img = _copy_shape_to_image(shape)
     if img is None:
         logging.warning(f"Clipboard không trả ảnh cho '{props['name']}'. Bỏ qua.")
         return None
 
-    logging.debug("    -> Bắt đầu xử lý và lưu ảnh tạm thời...")
-
-    opts = options or CompressionOptions.from_legacy(quality=quality, mode=mode, keep_dpi=keep_dpi, **extra)
+    logging.debug("    -> Bắt đầu xử lý và nén ảnh...")
     try:
-        prepared_img, fmt, save_kwargs = _prepare_image(img, opts)
+        prepared_img, fmt, save_kwargs = _prepare_image(img, opts, (props['width'], props['height']))
     except Exception as prep_err:
         logging.error(f"    -> Lỗi khi chuẩn bị ảnh '{props['name']}': {prep_err}")
         return None
 
-    tmp_dir = os.path.join(os.getcwd(), "_tmp_excel_img")
-    os.makedirs(tmp_dir, exist_ok=True)
-    tmp_path = os.path.join(tmp_dir, f"{uuid.uuid4().hex}.{fmt.lower()}")
+    try:
+        logging.debug(f"    -> Mã hoá ảnh ở định dạng {fmt} với tham số {save_kwargs}...")
+        data, details = _encode_with_target_size(prepared_img, fmt, save_kwargs, opts)
+        if details.get("ssim") is not None:
+            logging.info(
+                f"    -> '{props['name']}': {fmt} chất lượng {details['quality']}, "
+                f"SSIM {details['ssim']:.4f}, {len(data) / 1024:.1f}KB"
+            )
+    except Exception as e:
+        logging.error(f"    -> Lỗi khi nén ảnh '{props['name']}': {e}")
+        return None
+
+    entry_name = f"{sheet.name}!{props['name']}"
+    if not image_ops.is_worth_replacing(original_bytes, len(data), opts.min_saving_ratio):
+        logging.info(
+            f"    -> Giữ ảnh gốc '{props['name']}': {original_bytes / 1024:.1f}KB -> "
+            f"{len(data) / 1024:.1f}KB không đủ giảm {opts.min_saving_ratio:.0%}."
+        )
+        if report is not None:
+            report.add(
+                entry_name, original_bytes, original_bytes, kept_original=True,
+                quality=details["quality"], ssim=details["ssim"],
+            )
+        return None
 
     try:
-        logging.debug(f"    -> Lưu ảnh tạm thời ở định dạng {fmt} tại '{tmp_path}' với tham số {save_kwargs}...")
-        prepared_img.save(tmp_path, format=fmt, **save_kwargs)
-        logging.debug("    -> Đã lưu ảnh tạm thời thành công.")
+        path = staging.stage(data, fmt)
     except Exception as e:
         logging.error(f"    -> Lỗi khi lưu ảnh tạm thời: {e}")
         return None
-    
+    logging.debug(f"    -> Đã lưu ảnh tạm thời tại '{path}'.")
+
+    return {
+        'props': props,
+        'path': path,
+        'fmt': fmt,
+        'bytes': len(data),
+        'entry_name': entry_name,
+        'original_bytes': original_bytes,
+        'quality': details["quality"],
+        'ssim': details["ssim"],
+    }
+
+
+def _insert_replacement(
+    shape,
+    sheet,
+    staged: Dict[str, object],
+    *,
+    report: Optional[image_ops.CompressionReport] = None,
+) -> Optional[str]:
+    """Xoá shape cũ -> chèn ảnh đã lưu tạm -> khôi phục props. Trả về tên shape mới."""
+    props = staged['props']
+
     logging.debug("    -> Bắt đầu xóa shape cũ...")
     # Xoá shape cũ
     try:
@@ -392,7 +606,7 @@ def _export_and_replace(shape, sheet, quality=70, mode='auto', keep_dpi=96, *, o
 
     logging.debug("    -> Bắt đầu chèn ảnh mới...")
     # Chèn ảnh mới
-    pic = sheet.pictures.add(tmp_path, left=props['left'], top=props['top'])
+    pic = sheet.pictures.add(staged['path'], left=props['left'], top=props['top'])
     logging.debug(f"    -> Đã chèn ảnh mới thành công với tên '{pic.name}'.")
 
     # Cố gắng giữ nguyên kích thước (tránh scale theo DPI)
@@ -407,26 +621,128 @@ def _export_and_replace(shape, sheet, quality=70, mode='auto', keep_dpi=96, *, o
     _apply_props_to_picture(pic, props)
     logging.debug("    -> Đã áp dụng lại thuộc tính thành công.")
 
-    # Xóa file tạm
-    try:
-        os.remove(tmp_path)
-        logging.debug("    -> Đã xóa file ảnh tạm thời.")
-    except Exception as e:
-        logging.warning(f"Không thể xóa file ảnh tạm thời '{tmp_path}': {e}")
+    if report is not None:
+        report.add(
+            staged['entry_name'], staged['original_bytes'], staged['bytes'], note=staged['fmt'],
+            quality=staged['quality'], ssim=staged['ssim'],
+        )
 
     # Trả về tên shape mới (tên có thể đổi nếu trùng)
     return pic.name
-    
+
+
+def _longest_increasing_subsequence(values):
+    """Chỉ số các phần tử thuộc một dãy con tăng dài nhất của ``values`` (O(n log n))."""
+    tails = []      # tails[k]: chỉ số phần tử cuối nhỏ nhất của dãy con dài k + 1
+    parents = [-1] * len(values)
+    for i, value in enumerate(values):
+        lo, hi = 0, len(tails)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if values[tails[mid]] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        parents[i] = tails[lo - 1] if lo else -1
+        if lo == len(tails):
+            tails.append(i)
+        else:
+            tails[lo] = i
+    result = []
+    i = tails[-1] if tails else -1
+    while i != -1:
+        result.append(i)
+        i = parents[i]
+    return result[::-1]
+
+def _plan_zorder_moves(current, desired):
+    """
+    Lập danh sách lệnh ``(tên, lệnh ZOrder, số lần)`` đưa ``current`` về ``desired``
+    (cả hai xếp từ sau ra trước) với ít lời gọi COM nhất có thể. Shape chỉ có ở một phía
+    không được di chuyển, nhưng vẫn được tính khi đếm số bước BringForward/SendBackward.
+
+    Hai phương án được so sánh:
+    - Giữ nguyên dãy con tăng dài nhất (LIS) so với thứ tự mong muốn, chỉ dời các shape
+      còn lại tới đúng chỗ bằng BringForward/SendBackward (hoặc lên đầu/xuống đáy trước).
+    - Giữ nguyên một đoạn liên tiếp của ``desired`` đang đúng thứ tự, đưa phần trước đoạn
+      xuống đáy và phần sau lên trên cùng (mỗi shape một lệnh).
+    """
+    rank = {nm: i for i, nm in enumerate(desired)}
+    sim = list(current)
+    current = [nm for nm in current if nm in rank]
+    present = set(current)
+    desired = [nm for nm in desired if nm in present]
+    if current == desired:
+        return []
+
+    # --- Phương án 1: LIS + dời từng shape lệch chỗ ---
+    kept = {current[i] for i in _longest_increasing_subsequence([rank[nm] for nm in current])}
+    placed = set(kept)
+    lis_moves = []
+    previous = None  # shape đã đúng chỗ gần nhất phía sau trong thứ tự mong muốn
+    for nm in desired:
+        if nm not in placed:
+            src = sim.index(nm)
+            sim.pop(src)
+            dst = sim.index(previous) + 1 if previous is not None else 0
+            sim.insert(dst, nm)
+            last = len(sim) - 1
+            options = [
+                [(msoBringForward, dst - src)] if dst >= src else [(msoSendBackward, src - dst)],
+                [(msoBringToFront, 1), (msoSendBackward, last - dst)],
+                [(msoSendToBack, 1), (msoBringForward, dst)],
+            ]
+            best = min(options, key=lambda ops: sum(count for _, count in ops))
+            lis_moves.extend((nm, op, count) for op, count in best if count)
+            placed.add(nm)
+        previous = nm
+
+    # --- Phương án 2: giữ đoạn liên tiếp dài nhất, còn lại đưa lên đầu/xuống đáy ---
+    position = {nm: i for i, nm in enumerate(current)}
+    best_start, best_len, start = 0, 1, 0
+    for i in range(1, len(desired) + 1):
+        if i == len(desired) or position[desired[i]] < position[desired[i - 1]]:
+            if i - start > best_len:
+                best_start, best_len = start, i - start
+            start = i
+    block_moves = [(nm, msoSendToBack, 1) for nm in reversed(desired[:best_start])]
+    block_moves += [(nm, msoBringToFront, 1) for nm in desired[best_start + best_len:]]
+
+    lis_cost = sum(count for _, _, count in lis_moves)
+    return lis_moves if lis_cost <= len(block_moves) else block_moves
+
+def _current_zorder_names(sheet):
+    """Tên shape trên sheet theo z-order hiện tại (sau -> trước), đọc trong một lượt."""
+    order = []
+    for api in sheet.api.Shapes:
+        try:
+            order.append((api.ZOrderPosition, api.Name))
+        except Exception:
+            pass
+    order.sort(key=lambda x: x[0])
+    return [nm for _, nm in order]
+
 def _reorder_zorder_exact(sheet, saved_order_back_to_front):
     """
     Khôi phục thứ tự chồng lớp chính xác.
-    Cách làm: duyệt theo thứ tự từ “phía sau” -> “phía trước”, mỗi shape gọi BringToFront.
-    Kết quả: các shape sẽ xếp đúng như saved_order_back_to_front.
+    Cách làm: so z-order hiện tại với thứ tự đã lưu, giữ nguyên các shape đã đúng tương đối
+    và chỉ di chuyển những shape lệch chỗ (xem :func:`_plan_zorder_moves`).
     """
-    for nm in saved_order_back_to_front:
+    try:
+        current = _current_zorder_names(sheet)
+    except Exception as e:
+        logging.warning(f"Không đọc được z-order hiện tại của sheet '{sheet.name}': {e}")
+        return
+
+    moves = _plan_zorder_moves(current, saved_order_back_to_front)
+    if moves:
+        logging.debug(f"Khôi phục z-order sheet '{sheet.name}': {len(moves)} lệnh, {len({m[0] for m in moves})} shape.")
+    shapes_api = sheet.api.Shapes
+    for nm, op, count in moves:
         try:
-            shp = sheet.shapes[nm]
-            shp.api.ZOrder(msoBringToFront)
+            api = shapes_api.Item(nm)
+            for _ in range(count):
+                api.ZOrder(op)
         except Exception:
             # Có thể tên bị đổi sau khi chèn lại; bỏ qua nếu không còn tồn tại.
             pass
@@ -445,10 +761,15 @@ def compress_images(
     - Bảo toàn vị trí, kích thước, xoay, tỉ lệ, placement, tên, visible, alt text, hyperlink.
     - Khôi phục z-order để textbox/shape khác vẫn đè đúng.
     - Bỏ qua nhóm (msoGroup) để tránh phá vỡ group.
+    - Mỗi sheet được xử lý theo lô: nén và lưu tạm mọi ảnh trước, sau đó mới xoá/chèn lại;
+      ảnh tạm nằm trong thư mục tạm riêng của lượt nén và được xoá khi kết thúc.
 
     Tham số ``kwargs`` cho phép tuỳ biến sâu hơn (ví dụ ``max_width``, ``max_height``,
     ``png_colors``, ``jpeg_progressive``...). Nếu đã khởi tạo ``compression_options`` thì
     các giá trị trong ``kwargs`` sẽ được bỏ qua.
+
+    Trả về :class:`image_ops.CompressionReport` (bảng trước/sau từng ảnh). Dung lượng ảnh
+    gốc được đọc từ file đã lưu trên đĩa để so sánh.
     """
     excel = wb.app.api
     prev_screen = excel.ScreenUpdating
@@ -463,6 +784,8 @@ def compress_images(
 
     total = 0
     compressed = 0
+    report = image_ops.CompressionReport()
+    media_index = media_ops.picture_media_index(wb.fullname)
     
     # Duyệt qua từng sheet hiển thị
     options = compression_options or CompressionOptions.from_legacy(
@@ -472,76 +795,88 @@ def compress_images(
         **kwargs,
     )
 
-    for sheet in wb.sheets:
-        if getattr(sheet.api, 'Visible', -1) != -1:
-            continue
-
-        # Lấy z-order của tất cả các shapes trên sheet
-        try:
-            shapes_with_z = []
-            for s in sheet.shapes:
-                try:
-                    z = getattr(s.api, 'ZOrderPosition', None)
-                    if z is not None:
-                        shapes_with_z.append((z, s.name))
-                except Exception:
-                    pass
-            shapes_with_z.sort(key=lambda x: x[0])  # Sắp xếp từ sau ra trước
-            z_order_names = [nm for _, nm in shapes_with_z]
-        except Exception:
-            z_order_names = [s.name for s in sheet.shapes]
-
-        shape_names = [s.name for s in sheet.shapes]
-        new_names_map = {}
+    with _ImageStaging() as staging:
+        for sheet in wb.sheets:
+            if getattr(sheet.api, 'Visible', -1) != -1:
+                continue
 
-        for nm in shape_names:
+            # Đọc tên, loại, z-order (và kích thước ảnh) của mọi shape trong một lượt
             try:
-                shp = sheet.shapes[nm]
-                t = getattr(shp.api, 'Type', None)
-            except Exception:
+                entries = _snapshot_sheet_shapes(sheet)
+            except Exception as e:
+                logging.warning(f"Không đọc được danh sách shape của sheet '{sheet.name}': {e}")
                 continue
-
-            if t in (msoPicture, msoLinkedPicture):
-                total += 1
+            z_order_names = [entry['name'] for entry in entries]
+            new_names_map = {}
+
+            # Lô 1: trích xuất và nén mọi ảnh của sheet vào vùng tạm (chưa sửa workbook)
+            staged_items = []
+            for entry in entries:
+                nm, t = entry['name'], entry['type']
+
+                if t in _PICTURE_TYPES:
+                    total += 1
+                    try:
+                        shp = sheet.shapes[nm]
+                    except Exception:
+                        continue
+                    
+                    # # SỬA LỖI: Kiểm tra các thuộc tính không ổn định trước khi nén
+                    # # Tạm thời vô hiệu hóa theo yêu cầu để nén tất cả ảnh
+                    # try:
+                    #     rotation = getattr(shp.api, 'Rotation', 0)
+                    #     is_locked = getattr(shp.api, 'LockAspectRatio', False)
+
+                    #     if rotation != 0 or is_locked:
+                    #         logging.warning(f"Bỏ qua ảnh '{nm}' trên sheet '{sheet.name}' do có góc xoay hoặc bị khóa tỉ lệ.")
+                    #         continue # Bỏ qua và chuyển sang shape tiếp theo
+                    # except Exception as prop_err:
+                    #     logging.warning(f"Không thể kiểm tra thuộc tính của ảnh '{nm}'. Lỗi: {prop_err}")
+
+                    logging.info(f"Đang nén ảnh '{nm}' trên sheet '{sheet.name}'...")
+                    try:
+                        width, height = entry['size']
+                        staged = _stage_replacement(
+                            shp,
+                            sheet,
+                            {'name': nm, 'width': width, 'height': height},
+                            options,
+                            staging,
+                            original_bytes=media_index.get((sheet.name, nm), {}).get('bytes'),
+                            report=report,
+                        )
+                        if staged:
+                            staged_items.append((entry, shp, staged))
+                    except Exception as e:
+                        logging.warning(f"Lỗi khi nén ảnh '{nm}' ở sheet '{sheet.name}': {e}")
+                else:
+                    logging.debug(f"Bỏ qua shape '{nm}' (loại: {t}) vì không phải ảnh.")
+                    pass
                 
-                # # SỬA LỖI: Kiểm tra các thuộc tính không ổn định trước khi nén
-                # # Tạm thời vô hiệu hóa theo yêu cầu để nén tất cả ảnh
-                # try:
-                #     rotation = getattr(shp.api, 'Rotation', 0)
-                #     is_locked = getattr(shp.api, 'LockAspectRatio', False)
-
-                #     if rotation != 0 or is_locked:
-                #         logging.warning(f"Bỏ qua ảnh '{nm}' trên sheet '{sheet.name}' do có góc xoay hoặc bị khóa tỉ lệ.")
-                #         continue # Bỏ qua và chuyển sang shape tiếp theo
-                # except Exception as prop_err:
-                #     logging.warning(f"Không thể kiểm tra thuộc tính của ảnh '{nm}'. Lỗi: {prop_err}")
-
-                logging.info(f"Đang nén ảnh '{nm}' trên sheet '{sheet.name}'...")
+                _doevents_pulse()
+
+            # Lô 2: xoá và chèn lại các ảnh đã nén
+            for entry, shp, staged in staged_items:
+                nm = entry['name']
                 try:
-                    new_nm = _export_and_replace(
-                        shp,
-                        sheet,
-                        quality=quality,
-                        mode=mode,
-                        keep_dpi=keep_dpi,
-                        options=options,
-                        **kwargs,
-                    )
+                    staged['props'] = _snapshot_shape_props(shp.api, nm, entry['zpos'], entry['size'])
+                    new_nm = _insert_replacement(shp, sheet, staged, report=report)
                     if new_nm:
                         compressed += 1
                         new_names_map[nm] = new_nm
                 except Exception as e:
-                    logging.warning(f"Lỗi khi nén ảnh '{nm}' ở sheet '{sheet.name}': {e}")
-            else:
-                logging.debug(f"Bỏ qua shape '{nm}' (loại: {t}) vì không phải ảnh.")
-                pass
-            
-            _doevents_pulse()
+                    logging.warning(f"Lỗi khi chèn lại ảnh '{nm}' ở sheet '{sheet.name}': {e}")
+                finally:
+                    staging.discard(staged['path'])
+                _doevents_pulse()
 
-        z_order_names_updated = [new_names_map.get(nm, nm) for nm in z_order_names]
-        _reorder_zorder_exact(sheet, z_order_names_updated)
+            if new_names_map:
+                z_order_names_updated = [new_names_map.get(nm, nm) for nm in z_order_names]
+                _reorder_zorder_exact(sheet, z_order_names_updated)
 
     logging.info(f"Hoàn tất nén ảnh. Đã nén {compressed}/{total} ảnh.")
+    if report.entries:
+        logging.info("Thống kê dung lượng ảnh:\n" + report.format_table())
     
     excel.ScreenUpdating = prev_screen
     excel.DisplayAlerts = prev_alerts
@@ -550,5 +885,5 @@ def compress_images(
     except Exception:
         pass
     
-    return True
+    return report
 
@@ -1,26 +1,23 @@
 # Đường dẫn: excel_toolkit/utils/compressor_engine_spire.py
 # Tên cũ: image_compressor_spire_api.py
-# Phiên bản 1.3 - Nâng cấp thuật toán nén và thêm tùy chọn linh hoạt
-# Ngày cập nhật: 2025-10-05
+# Phiên bản 2.4 - Ghép picture với media qua r:embed của drawing thay vì theo tên/thứ tự
+# Ngày cập nhật: 2026-10-19
 
-__version__ = "1.3.0"
+__version__ = "2.2.0"
 
+from collections import Counter
 from dataclasses import dataclass, field
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Set, Tuple, Union
 
 from spire.xls import *
 from spire.xls.common import *
 import io
 import logging
-import os
-import shutil
-import tempfile
-import uuid
 
-import pythoncom
-import win32com.client
 from PIL import Image
 
+from utils import image_ops, media_ops, package_ops
+
 
 @dataclass
 class CompressionOptions:
@@ -28,6 +25,7 @@ class CompressionOptions:
 
     max_size_kb: int = 300
     max_dimensions: Tuple[int, int] = (1200, 1200)
+    target_dpi: Optional[int] = 150
     min_dimensions: Tuple[int, int] = (320, 320)
     min_quality: int = 35
     max_quality: int = 90
@@ -36,12 +34,14 @@ class CompressionOptions:
     downscale_step: float = 0.85
     max_downscale_iterations: int = 4
     progressive_jpeg: bool = True
+    ssim_threshold: Optional[float] = None
     prefer_png: bool = False
     convert_png_to_jpeg: bool = True
     alpha_replacement_color: Tuple[int, int, int] = (255, 255, 255)
     png_compress_level: int = 9
     preserve_excel_dimensions: bool = True
     skip_small_images_kb: int = 0
+    min_saving_ratio: float = 0.05
     extra_metadata: Dict[str, str] = field(default_factory=dict)
 
     def __post_init__(self) -> None:
@@ -53,51 +53,47 @@ class CompressionOptions:
         self.downscale_step = min(max(self.downscale_step, 0.1), 0.95)
         self.max_downscale_iterations = max(0, self.max_downscale_iterations)
         self.skip_small_images_kb = max(0, self.skip_small_images_kb)
+        self.min_saving_ratio = min(max(self.min_saving_ratio, 0.0), 0.95)
+        if self.ssim_threshold is not None:
+            self.ssim_threshold = min(max(self.ssim_threshold, 0.5), 1.0)
+        if self.target_dpi is not None:
+            self.target_dpi = max(36, self.target_dpi)
 
 
-def _normalize_output_path(output_stub: str, extension: str) -> str:
-    base, _ = os.path.splitext(output_stub)
-    return f"{base}.{extension.lower()}"
-
-
-def _resize_image(img: Image.Image, max_dimensions: Tuple[int, int]) -> Image.Image:
-    max_width, max_height = max_dimensions
-    width, height = img.size
-    if max_width <= 0 or max_height <= 0:
-        return img
+def _load_resized(
+    img: Image.Image,
+    options: CompressionOptions,
+    display_size: Optional[Tuple[float, float]] = None,
+) -> Image.Image:
+    """Giải mã ảnh trực tiếp ở kích thước đích (``max_dimensions`` và DPI hiển thị).
 
-    ratio = min(max_width / width, max_height / height, 1)
-    if ratio >= 1:
+    Kích thước đích được tính từ header trước khi giải mã để JPEG có thể dùng draft mode,
+    sau đó co nguyên lần bằng ``reduce`` rồi mới resample LANCZOS.
+    """
+    target_size = image_ops.bounded_size(img.size, *options.max_dimensions)
+    if options.target_dpi and display_size:
+        target_size = image_ops.display_fit_size(target_size, display_size, options.target_dpi)
+    if target_size == img.size:
         return img
-
-    new_size = (max(int(width * ratio), 1), max(int(height * ratio), 1))
-    return img.resize(new_size, Image.Resampling.LANCZOS)
-
-
-def _downscale_image(img: Image.Image, options: CompressionOptions) -> Optional[Image.Image]:
-    width, height = img.size
-    target_width = max(int(width * options.downscale_step), options.min_dimensions[0])
-    target_height = max(int(height * options.downscale_step), options.min_dimensions[1])
-
-    if target_width >= width and target_height >= height:
-        return None
-
-    if target_width < 1 or target_height < 1:
-        return None
-
-    return img.resize((target_width, target_height), Image.Resampling.LANCZOS)
+    image_ops.prepare_draft(img, target_size)
+    return image_ops.resize_reduced(img, target_size, Image.Resampling.LANCZOS)
 
 
 def _optimize_image(
-    input_path: str,
-    output_stub: str,
+    data: bytes,
     options: CompressionOptions,
-) -> Optional[Tuple[str, int, int, str, float]]:
-    """Tối ưu hóa hình ảnh và trả về kích thước mới (width, height, format, size_kb)."""
+    display_size: Optional[Tuple[float, float]] = None,
+) -> Optional[Tuple[bytes, int, int, str, Dict[str, object]]]:
+    """Tối ưu hóa ảnh trong bộ nhớ và trả về (bytes, width, height, format, details).
+
+    ``display_size`` (point) là kích thước ảnh trên sheet; khi có ``target_dpi`` ảnh
+    được thu nhỏ về đúng số pixel cần để hiển thị. ``details`` chứa ``quality`` và
+    ``ssim`` (khi bật ``ssim_threshold``) của ảnh JPEG đầu ra.
+    """
 
     try:
-        with Image.open(input_path) as original_img:
-            img = _resize_image(original_img, options.max_dimensions)
+        with Image.open(io.BytesIO(data)) as original_img:
+            img = _load_resized(original_img, options, display_size)
             has_alpha = (
                 img.mode in ("RGBA", "LA")
                 or (img.mode == "P" and "transparency" in img.info)
@@ -122,53 +118,54 @@ def _optimize_image(
                     optimize=True,
                     compress_level=options.png_compress_level,
                 )
-                output_path = _normalize_output_path(output_stub, "png")
-                with open(output_path, "wb") as output_file:
-                    output_file.write(buffer.getvalue())
-                size_kb = len(buffer.getvalue()) / 1024
-                return output_path, img.width, img.height, target_format, size_kb
-
-            best_payload = None
-            last_payload = None
-            current_img = img
-
-            for _ in range(max(1, options.max_downscale_iterations + 1)):
-                quality = options.max_quality
-                while quality >= options.min_quality:
+                details = {"quality": None, "ssim": None}
+                return buffer.getvalue(), img.width, img.height, target_format, details
+
+            encoded: Dict[Tuple[Tuple[int, int], int], bytes] = {}
+
+            def encode_jpeg(candidate: Image.Image, quality: int) -> bytes:
+                key = (candidate.size, quality)
+                if key not in encoded:
                     buffer = io.BytesIO()
-                    current_img.save(
+                    candidate.save(
                         buffer,
                         format="JPEG",
                         quality=quality,
                         optimize=True,
                         progressive=options.progressive_jpeg,
                     )
-                    data = buffer.getvalue()
-                    size_kb = len(data) / 1024
-                    last_payload = (data, current_img.size, size_kb, quality)
-                    if size_kb <= options.max_size_kb:
-                        best_payload = last_payload
-                        break
-                    quality -= options.quality_step
-
-                if best_payload or not options.allow_downscaling:
-                    break
-
-                downsized = _downscale_image(current_img, options)
-                if downsized is None:
-                    break
-                current_img = downsized
-
-            payload = best_payload or last_payload
-            if payload is None:
-                return None
-
-            data, (width, height), size_kb, _ = payload
-            output_path = _normalize_output_path(output_stub, "jpg")
-            with open(output_path, "wb") as output_file:
-                output_file.write(data)
-
-            return output_path, width, height, "JPEG", size_kb
+                    encoded[key] = buffer.getvalue()
+                return encoded[key]
+
+            sizes = [img.size]
+            if options.allow_downscaling:
+                sizes = image_ops.downscale_sizes(
+                    img.size,
+                    options.downscale_step,
+                    options.max_downscale_iterations,
+                    options.min_dimensions,
+                )
+            qualities = list(range(options.max_quality, options.min_quality - 1, -options.quality_step))
+            score = None
+            if options.ssim_threshold:
+                ceiling, score = image_ops.select_quality_by_ssim(
+                    img, encode_jpeg, qualities, options.ssim_threshold
+                )
+                qualities = [q for q in qualities if q <= ceiling]
+            output, result_img, quality, _ = image_ops.encode_to_target_size(
+                img,
+                options.max_size_kb * 1024,
+                encode_jpeg,
+                qualities,
+                sizes,
+                Image.Resampling.LANCZOS,
+            )
+
+            width, height = result_img.size
+            if score is not None and (quality != ceiling or result_img.size != img.size):
+                score = None
+            details = {"quality": quality, "ssim": score}
+            return output, width, height, "JPEG", details
     except Exception as error:
         logging.error(f"Lỗi khi tối ưu hóa hình ảnh: {error}")
         return None
@@ -180,12 +177,23 @@ def compress_images(
     *,
     options: Optional[CompressionOptions] = None,
     **option_overrides,
-) -> bool:
+) -> Union[image_ops.CompressionReport, bool]:
     """Nén hình ảnh trong tệp Excel bằng Spire.Xls với nhiều tùy chọn linh hoạt.
 
     Tham số ``max_size_kb`` được giữ lại cho khả năng tương thích với phiên bản
     cũ. Để cấu hình sâu hơn, truyền ``options`` hoặc các tham số bổ sung khớp
     với :class:`CompressionOptions` thông qua ``option_overrides``.
+
+    Trả về :class:`image_ops.CompressionReport` (bảng trước/sau từng ảnh), hoặc
+    ``False`` nếu gặp lỗi nghiêm trọng. Ảnh nén không nhỏ hơn ảnh gốc ít nhất
+    ``min_saving_ratio`` sẽ được giữ nguyên.
+
+    Spire chỉ được dùng để đọc (kích thước hiển thị khi drawing không ghi); không bao giờ lưu
+    bằng Spire (bản đánh giá chèn sheet "Evaluation Warning", lưu lại toàn bộ workbook và có
+    thể mất macro). Dữ liệu ảnh nén được ghi thẳng vào media part mà picture trỏ tới bằng
+    ``package_ops`` (tra qua ``r:embed`` của picture và .rels của drawing), nên drawing (vị trí, kích thước hiển thị) luôn giữ nguyên - tùy chọn
+    ``preserve_excel_dimensions`` không còn tác dụng. Chỉ hỗ trợ gói OOXML;
+    file không được mở trong Excel lúc gọi hàm (xem ``ExcelController._run_package_operation``).
     """
     logging.info("Bắt đầu nén ảnh bằng engine Spire.Xls...")
     if options and option_overrides:
@@ -200,157 +208,141 @@ def compress_images(
             options.max_size_kb = max_size_kb
 
     logging.debug("Thông số nén sử dụng: %s", options)
-    temp_dir = tempfile.mkdtemp()
-    compressed_dir = os.path.join(temp_dir, "compressed")
-    os.makedirs(compressed_dir, exist_ok=True)
 
+    workbook = None
     try:
+        # 1. Đọc kích thước hiển thị của picture bằng Spire (chỉ đọc).
+        spire_sizes: Dict[Tuple[str, str], List[Tuple[float, float]]] = {}
         workbook = Workbook()
         workbook.LoadFromFile(file_path)
-        
-        images_to_replace = []
-        
         for sheet_index in range(workbook.Worksheets.Count):
             sheet = workbook.Worksheets[sheet_index]
             pic_count = sheet.Pictures.Count
-            
             if pic_count > 0:
                 logging.debug(f"  -> Đã tìm thấy {pic_count} ảnh trong sheet '{sheet.Name}'.")
-            
             for i in range(pic_count):
                 try:
                     pic = sheet.Pictures[i]
-                    temp_filename = f"excel_img_{uuid.uuid4()}"
-                    img_path = os.path.join(temp_dir, f"{temp_filename}.png")
-                    
-                    pic.Picture.Save(img_path)
-                    
-                    if os.path.exists(img_path) and os.path.getsize(img_path) > 0:
-                        original_size_kb = os.path.getsize(img_path) / 1024
-
-                        if (
-                            options.skip_small_images_kb
-                            and original_size_kb <= options.skip_small_images_kb
-                        ):
-                            logging.debug(
-                                "    -> Bỏ qua ảnh %.1fKB vì nhỏ hơn ngưỡng %.1fKB",
-                                original_size_kb,
-                                options.skip_small_images_kb,
+                    # Spire trả kích thước shape theo pixel (96 DPI)
+                    display_size = (
+                        image_ops.pixels_to_points(pic.Width),
+                        image_ops.pixels_to_points(pic.Height),
+                    )
+                    spire_sizes.setdefault((sheet.Name, pic.Name), []).append(display_size)
+                except Exception as e:
+                    logging.warning(f"Lỗi khi đọc ảnh trong sheet '{sheet.Name}': {str(e)}")
+        workbook.Dispose()
+        workbook = None
+
+        report = image_ops.CompressionReport()
+        with package_ops.ExcelPackage(file_path) as pkg:
+            # 2. Media của từng picture lấy từ r:embed của blip trong drawing (qua .rels), kích
+            #    thước hiển thị từ a:xfrm của drawing. Drawing không ghi kích thước thì dùng số
+            #    đo của Spire khi tên picture là duy nhất trên sheet ở cả hai phía, nếu không thì
+            #    bỏ qua media của picture đó. Media dùng chung cho nhiều picture được nén theo
+            #    kích thước hiển thị lớn nhất.
+            media_usage: Dict[str, Tuple[str, Tuple[float, float]]] = {}
+            unresolved: Set[str] = set()
+            for sheet_name, package_pictures in media_ops.sheet_picture_media(pkg).items():
+                name_counts = Counter(name for name, _, _ in package_pictures)
+                for pic_name, media, display_size in package_pictures:
+                    if display_size is None:
+                        measured = spire_sizes.get((sheet_name, pic_name), [])
+                        if name_counts[pic_name] != 1 or len(measured) != 1:
+                            logging.warning(
+                                f"    -> Bỏ qua ảnh '{pic_name}' trong sheet '{sheet_name}': "
+                                "không xác định chắc chắn được kích thước hiển thị."
                             )
+                            unresolved.add(media)
                             continue
+                        display_size = measured[0]
+                    entry_name, previous = media_usage.get(media, (f"{sheet_name}!{pic_name}", (0, 0)))
+                    media_usage[media] = (
+                        entry_name,
+                        (max(previous[0], display_size[0]), max(previous[1], display_size[1])),
+                    )
+            for media in unresolved:
+                media_usage.pop(media, None)
 
-                        output_stub = os.path.join(
-                            compressed_dir, f"compressed_{temp_filename}"
+            # 3. Nén từng media part một lần và ghi đè trong gói.
+            renames: Dict[str, str] = {}
+            replaced_count = 0
+            for media, (entry_name, display_size) in media_usage.items():
+                try:
+                    original_data = pkg.read(media)
+                    original_bytes = len(original_data)
+                    original_size_kb = original_bytes / 1024
+
+                    if (
+                        options.skip_small_images_kb
+                        and original_size_kb <= options.skip_small_images_kb
+                    ):
+                        logging.debug(
+                            "    -> Bỏ qua ảnh %.1fKB vì nhỏ hơn ngưỡng %.1fKB",
+                            original_size_kb,
+                            options.skip_small_images_kb,
                         )
+                        continue
+
+                    result = _optimize_image(original_data, options, display_size)
+                    if not result:
+                        logging.warning(
+                            "    -> Không thể tối ưu hóa ảnh %.1fKB '%s'",
+                            original_size_kb,
+                            entry_name,
+                        )
+                        continue
+
+                    compressed_data, _, _, target_format, details = result
+                    compressed_size_kb = len(compressed_data) / 1024
+                    if not image_ops.is_worth_replacing(
+                        original_bytes,
+                        len(compressed_data),
+                        options.min_saving_ratio,
+                    ):
+                        logging.info(
+                            "    -> Giữ ảnh gốc: %.1fKB -> %.1fKB không đủ giảm %.0f%%",
+                            original_size_kb,
+                            compressed_size_kb,
+                            options.min_saving_ratio * 100,
+                        )
+                        report.add(
+                            entry_name, original_bytes, original_bytes, kept_original=True,
+                            quality=details["quality"], ssim=details["ssim"],
+                        )
+                        continue
 
-                        result = _optimize_image(img_path, output_stub, options)
-
-                        if result:
-                            (
-                                compressed_path,
-                                image_width,
-                                image_height,
-                                target_format,
-                                compressed_size_kb,
-                            ) = result
-                            image_info = {
-                                'compressed_path': compressed_path,
-                                'sheet_name': sheet.Name,
-                                'left': pic.Left,
-                                'top': pic.Top,
-                                'excel_width': pic.Width,
-                                'excel_height': pic.Height,
-                                'image_width': image_width,
-                                'image_height': image_height,
-                                'format': target_format,
-                            }
-                            images_to_replace.append(image_info)
-
-                            logging.info(
-                                "    -> Đã nén ảnh thành công: %.1fKB -> %.1fKB (%s)",
-                                original_size_kb,
-                                compressed_size_kb,
-                                target_format,
-                            )
-                        else:
-                            logging.warning(
-                                "    -> Không thể tối ưu hóa ảnh %.1fKB trong sheet '%s'",
-                                original_size_kb,
-                                sheet.Name,
-                            )
-
+                    media_ops.replace_media(pkg, media, compressed_data, target_format.lower(), renames)
+                    report.add(
+                        entry_name, original_bytes, len(compressed_data), note=target_format,
+                        quality=details["quality"], ssim=details["ssim"],
+                    )
+                    replaced_count += 1
+                    logging.info(
+                        "    -> Đã nén ảnh thành công: %.1fKB -> %.1fKB (%s, chất lượng %s, SSIM %s)",
+                        original_size_kb,
+                        compressed_size_kb,
+                        target_format,
+                        details["quality"],
+                        "-" if details["ssim"] is None else f"{details['ssim']:.4f}",
+                    )
                 except Exception as e:
-                    logging.warning(f"Lỗi khi xử lý ảnh trong sheet '{sheet.Name}': {str(e)}")
+                    logging.warning(f"Lỗi khi xử lý ảnh '{entry_name}': {str(e)}")
                     continue
 
-        if images_to_replace:
-            logging.info(f"Đã tối ưu hóa {len(images_to_replace)} ảnh. Bắt đầu thay thế...")
-            
-            # SỬA LỖI: Không sao chép file nữa, làm việc trực tiếp trên file_path
-            
-            pythoncom.CoInitialize()
-            try:
-                excel = win32com.client.Dispatch("Excel.Application")
-                excel.Visible = False
-                excel.DisplayAlerts = False
-                
-                workbook_win32 = excel.Workbooks.Open(os.path.abspath(file_path))
-                
-                for img_info in images_to_replace:
-                    sheet_name = img_info['sheet_name']
-                    sheet = workbook_win32.Sheets(sheet_name)
-                    
-                    try:
-                        for shape in sheet.Shapes:
-                            if (abs(shape.Left - img_info['left']) < 5 and 
-                                abs(shape.Top - img_info['top']) < 5 and 
-                                shape.Type == 13): # msoPicture
-                                shape.Delete()
-                                logging.debug(f"    -> Đã xóa ảnh gốc trên sheet '{sheet_name}'.")
-                                break
-                    except Exception as e:
-                        logging.warning(f"Không thể xóa ảnh gốc: {str(e)}")
-                    
-                    target_width = (
-                        img_info['excel_width']
-                        if options.preserve_excel_dimensions
-                        else img_info['image_width']
-                    )
-                    target_height = (
-                        img_info['excel_height']
-                        if options.preserve_excel_dimensions
-                        else img_info['image_height']
-                    )
+            if replaced_count:
+                pkg.rename_parts(renames)
+                logging.info(f"Đã thay {replaced_count} ảnh. Đang lưu gói...")
+                pkg.save()
 
-                    sheet.Shapes.AddPicture(
-                        Filename=img_info['compressed_path'],
-                        LinkToFile=False,
-                        SaveWithDocument=True,
-                        Left=img_info['left'],
-                        Top=img_info['top'],
-                        Width=target_width,
-                        Height=target_height
-                    )
-                    logging.debug(f"    -> Đã chèn ảnh đã nén vào sheet '{sheet_name}'.")
-
-                workbook_win32.Save()
-                workbook_win32.Close()
-                excel.Quit()
-            except Exception as e:
-                logging.error(f"Lỗi khi thay thế hình ảnh: {str(e)}")
-            finally:
-                pythoncom.CoUninitialize()
-        
         logging.info("Hoàn tất nén ảnh bằng engine Spire.Xls.")
-        return True
-        
+        if report.entries:
+            logging.info("Thống kê dung lượng ảnh:\n" + report.format_table())
+        return report
+
     except Exception as e:
         logging.error(f"Lỗi nghiêm trọng trong quá trình nén ảnh với Spire.Xls: {str(e)}")
         return False
     finally:
-        try:
-            shutil.rmtree(temp_dir)
-            logging.debug("Đã xóa thư mục tạm thời.")
-        except Exception:
-            logging.warning("Không thể xóa thư mục tạm thời.")
-
+        if workbook is not None:
+            workbook.Dispose()
@@ -0,0 +1,821 @@
+# Đường dẫn: excel_toolkit/utils/image_ops.py
+# Phiên bản 2.3 - Ghi rõ PNG lossless thử chiến lược zlib, không phải bộ lọc hàng PNG
+# Ngày cập nhật: 2026-10-19
+
+import io
+import logging
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageFilter, PngImagePlugin
+
+# --- Hằng số đơn vị đo của Office ---
+EMU_PER_INCH = 914400
+EMU_PER_POINT = 12700
+POINTS_PER_INCH = 72
+PIXELS_PER_INCH = 96  # Excel quy đổi pixel <-> point theo 96 DPI
+
+# ======================================================================
+# --- Nhóm 1: Kích thước hiển thị ---
+# ======================================================================
+
+def emu_to_points(emu):
+    """Chuyển đổi EMU (English Metric Unit trong DrawingML) sang point."""
+    return float(emu) / EMU_PER_POINT
+
+def pixels_to_points(pixels):
+    """Chuyển đổi pixel màn hình (96 DPI) sang point."""
+    return float(pixels) * POINTS_PER_INCH / PIXELS_PER_INCH
+
+def display_pixel_size(display_size_pt: Tuple[float, float], target_dpi: int) -> Optional[Tuple[int, int]]:
+    """
+    Tính số pixel cần thiết để ảnh hiển thị ở kích thước ``display_size_pt`` (point)
+    đạt mật độ ``target_dpi``. Trả về ``None`` nếu kích thước không hợp lệ.
+    """
+    if not target_dpi or not display_size_pt:
+        return None
+    width_pt, height_pt = display_size_pt
+    if not width_pt or not height_pt or width_pt <= 0 or height_pt <= 0:
+        return None
+    width_px = max(1, int(round(width_pt / POINTS_PER_INCH * target_dpi)))
+    height_px = max(1, int(round(height_pt / POINTS_PER_INCH * target_dpi)))
+    return width_px, height_px
+
+def display_fit_size(
+    size: Tuple[int, int],
+    display_size_pt: Optional[Tuple[float, float]],
+    target_dpi: Optional[int],
+) -> Tuple[int, int]:
+    """
+    Kích thước (pixel) ảnh cần có để hiển thị ở ``target_dpi``.
+
+    Ảnh được co theo một tỉ lệ chung cho cả hai chiều (giữ tỉ lệ gốc), chọn sao cho
+    chiều nào cũng vẫn đủ pixel với khung hiển thị. Ảnh đã nhỏ hơn nhu cầu thì giữ nguyên.
+    """
+    needed = display_pixel_size(display_size_pt, target_dpi)
+    if needed is None:
+        return size
+
+    width, height = size
+    ratio = min(1.0, max(needed[0] / width, needed[1] / height))
+    if ratio >= 1.0:
+        return size
+    return max(1, int(round(width * ratio))), max(1, int(round(height * ratio)))
+
+def fit_to_display(
+    img: Image.Image,
+    display_size_pt: Optional[Tuple[float, float]],
+    target_dpi: Optional[int],
+    resample=Image.LANCZOS,
+) -> Image.Image:
+    """Thu nhỏ ảnh về đúng số pixel cần để hiển thị ở ``target_dpi``."""
+    new_size = display_fit_size(img.size, display_size_pt, target_dpi)
+    if new_size == img.size:
+        return img
+
+    logging.debug(
+        f"    -> Thu nhỏ theo kích thước hiển thị {display_size_pt[0]:.0f}x{display_size_pt[1]:.0f}pt "
+        f"@ {target_dpi} DPI: {img.width}x{img.height} -> {new_size[0]}x{new_size[1]}"
+    )
+    return resize_reduced(img, new_size, resample)
+
+def bounded_size(size: Tuple[int, int], max_width: Optional[int] = None, max_height: Optional[int] = None) -> Tuple[int, int]:
+    """Kích thước sau khi co (giữ tỉ lệ) để không vượt ``max_width``/``max_height``."""
+    width, height = size
+    max_w = max_width or width
+    max_h = max_height or height
+    if max_w <= 0 or max_h <= 0 or (width <= max_w and height <= max_h):
+        return size
+    ratio = min(max_w / width, max_h / height)
+    return max(int(width * ratio), 1), max(int(height * ratio), 1)
+
+# ======================================================================
+# --- Nhóm 2: Giải mã và thu nhỏ tiết kiệm bộ nhớ ---
+# ======================================================================
+
+# Các mode mà Image.reduce hỗ trợ
+_REDUCIBLE_MODES = ("L", "LA", "RGB", "RGBA", "RGBX", "CMYK", "I", "F")
+
+def prepare_draft(img: Image.Image, target_size: Tuple[int, int]) -> Image.Image:
+    """
+    Với ảnh JPEG chưa giải mã, yêu cầu bộ giải mã co sẵn theo tỉ lệ 1/2, 1/4 hoặc 1/8
+    (DCT scaling) sao cho vẫn không nhỏ hơn ``target_size``. Bộ nhớ và thời gian giải mã
+    khi đó tỉ lệ với kích thước đầu ra thay vì kích thước gốc. Phải gọi trước ``load()``.
+    """
+    if getattr(img, "format", None) != "JPEG" or target_size == img.size:
+        return img
+    original = img.size
+    try:
+        img.draft(img.mode, target_size)
+    except Exception as e:
+        logging.debug(f"    -> Không thể bật chế độ draft: {e}")
+        return img
+    if img.size != original:
+        logging.debug(f"    -> Giải mã JPEG ở độ phân giải giảm: {original} -> {img.size}")
+    return img
+
+def resize_reduced(img: Image.Image, size: Tuple[int, int], resample=Image.LANCZOS, reducing_gap: float = 2.0) -> Image.Image:
+    """
+    Thu nhỏ ảnh về ``size``: trước hết co nguyên lần bằng ``Image.reduce`` (rẻ, trung bình
+    khối) sao cho ảnh vẫn lớn hơn đích ít nhất ``reducing_gap`` lần, sau đó mới resample
+    chất lượng cao trên ảnh đã nhỏ hơn nhiều.
+    """
+    if size == img.size:
+        return img
+    factor = int(min(img.width / size[0], img.height / size[1]) / reducing_gap)
+    if factor > 1 and img.mode in _REDUCIBLE_MODES:
+        img = img.reduce(factor)
+    return img.resize(size, resample)
+
+# ======================================================================
+# --- Nhóm 3: Mã hoá theo dung lượng mục tiêu ---
+# ======================================================================
+
+def downscale_sizes(size, step, iterations, min_dimensions=(1, 1)):
+    """
+    Danh sách kích thước thử dần: kích thước gốc rồi mỗi lần nhân ``step``, không nhỏ hơn
+    ``min_dimensions``. Dừng sớm khi không thể thu nhỏ thêm.
+    """
+    width, height = size
+    sizes = [(width, height)]
+    for k in range(1, iterations + 1):
+        target = (
+            max(int(width * step ** k), min_dimensions[0], 1),
+            max(int(height * step ** k), min_dimensions[1], 1),
+        )
+        if target[0] >= sizes[-1][0] and target[1] >= sizes[-1][1]:
+            break
+        sizes.append((min(target[0], sizes[-1][0]), min(target[1], sizes[-1][1])))
+    return sizes
+
+def encode_to_target_size(
+    img: Image.Image,
+    max_bytes: int,
+    encode,
+    qualities,
+    sizes=None,
+    resample=Image.LANCZOS,
+):
+    """
+    Tìm cặp (kích thước, chất lượng) lớn nhất cho ra dữ liệu không vượt ``max_bytes``.
+
+    ``encode(image, quality) -> bytes`` là hàm mã hoá; ``qualities`` là các mức chất lượng
+    được phép; ``sizes`` là các kích thước thử (lớn -> nhỏ, phần tử đầu là kích thước gốc).
+    Tìm kiếm chia đôi trên kích thước (ở chất lượng thấp nhất) rồi chia đôi trên chất lượng,
+    mọi lần mã hoá đều được ghi nhớ để không mã hoá lại. Tổng số lần mã hoá khoảng
+    ``log2(len(sizes)) + log2(len(qualities))``.
+
+    Trả về ``(data, image, quality, fits)``; nếu không mức nào đạt thì trả về kết quả nhỏ
+    nhất (kích thước nhỏ nhất, chất lượng thấp nhất) với ``fits=False``.
+    """
+    qualities = sorted(set(qualities))
+    sizes = sizes or [img.size]
+    images = {}
+    encoded = {}
+
+    def image_at(index):
+        if index not in images:
+            target = sizes[index]
+            images[index] = img if target == img.size else img.resize(target, resample)
+        return images[index]
+
+    def data_at(index, q_index):
+        key = (index, q_index)
+        if key not in encoded:
+            encoded[key] = encode(image_at(index), qualities[q_index])
+        return encoded[key]
+
+    def fits(index, q_index):
+        return len(data_at(index, q_index)) <= max_bytes
+
+    def result(index, q_index, ok):
+        logging.debug(
+            f"    -> Mã hoá mục tiêu {max_bytes / 1024:.0f}KB: {len(encoded)} lần mã hoá, "
+            f"kích thước {sizes[index]}, chất lượng {qualities[q_index]}, "
+            f"{len(data_at(index, q_index)) / 1024:.1f}KB"
+        )
+        return data_at(index, q_index), image_at(index), qualities[q_index], ok
+
+    top_q = len(qualities) - 1
+    # Trường hợp phổ biến: chất lượng cao nhất ở kích thước gốc đã đạt.
+    if fits(0, top_q):
+        return result(0, top_q, True)
+
+    # Tìm kích thước lớn nhất đạt mục tiêu ở chất lượng thấp nhất.
+    if fits(0, 0):
+        size_index = 0
+    else:
+        last = len(sizes) - 1
+        if last == 0 or not fits(last, 0):
+            return result(last, 0, False)
+        lo, hi = 1, last
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if fits(mid, 0):
+                hi = mid
+            else:
+                lo = mid + 1
+        size_index = lo
+
+    # Tìm chất lượng cao nhất vẫn đạt mục tiêu ở kích thước đó.
+    lo, hi = 0, top_q
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if fits(size_index, mid):
+            lo = mid
+        else:
+            hi = mid - 1
+    return result(size_index, lo, True)
+
+# ======================================================================
+# --- Nhóm 4: Chất lượng cảm nhận (SSIM) ---
+# ======================================================================
+
+_SSIM_C1 = (0.01 * 255) ** 2
+_SSIM_C2 = (0.03 * 255) ** 2
+
+def luma_plane(img: Image.Image, max_side: int = 1024) -> np.ndarray:
+    """Kênh độ sáng (Y) đã thu nhỏ để cạnh dài nhất không quá ``max_side``, dạng float64."""
+    gray = img.convert("L")
+    if max(gray.size) > max_side:
+        gray = gray.copy()
+        gray.thumbnail((max_side, max_side), Image.BOX)
+    return np.asarray(gray, dtype=np.float64)
+
+def _box_mean(plane: np.ndarray, window: int) -> np.ndarray:
+    """Trung bình trượt ``window x window`` (chỉ vùng hợp lệ) bằng ảnh tích phân."""
+    integral = np.pad(plane, ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+    total = (
+        integral[window:, window:]
+        - integral[:-window, window:]
+        - integral[window:, :-window]
+        + integral[:-window, :-window]
+    )
+    return total / (window * window)
+
+def ssim(reference: np.ndarray, candidate: np.ndarray, window: int = 8) -> float:
+    """SSIM trung bình giữa hai kênh độ sáng cùng kích thước (cửa sổ vuông, vector hoá)."""
+    window = max(1, min(window, reference.shape[0], reference.shape[1]))
+    mu_x = _box_mean(reference, window)
+    mu_y = _box_mean(candidate, window)
+    var_x = _box_mean(reference * reference, window) - mu_x * mu_x
+    var_y = _box_mean(candidate * candidate, window) - mu_y * mu_y
+    cov_xy = _box_mean(reference * candidate, window) - mu_x * mu_y
+    numerator = (2 * mu_x * mu_y + _SSIM_C1) * (2 * cov_xy + _SSIM_C2)
+    denominator = (mu_x * mu_x + mu_y * mu_y + _SSIM_C1) * (var_x + var_y + _SSIM_C2)
+    return float(np.mean(numerator / denominator))
+
+def select_quality_by_ssim(img: Image.Image, encode, qualities, threshold: float, max_side: int = 1024):
+    """
+    Chọn chất lượng thấp nhất trong ``qualities`` mà ảnh giải mã lại vẫn có SSIM (trên kênh
+    độ sáng thu nhỏ) không dưới ``threshold``. Tìm bằng chia đôi.
+
+    Trả về ``(quality, score)``; nếu cả mức cao nhất cũng không đạt thì trả về mức cao nhất.
+    """
+    qualities = sorted(set(qualities))
+    reference = luma_plane(img, max_side)
+    scores = {}
+
+    def score_at(index):
+        if index not in scores:
+            with Image.open(io.BytesIO(encode(img, qualities[index]))) as decoded:
+                candidate = luma_plane(decoded, max_side)
+            if candidate.shape != reference.shape:
+                return 0.0
+            scores[index] = ssim(reference, candidate)
+        return scores[index]
+
+    lo, hi = 0, len(qualities) - 1
+    if score_at(hi) < threshold:
+        return qualities[hi], score_at(hi)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if score_at(mid) >= threshold:
+            hi = mid
+        else:
+            lo = mid + 1
+    logging.debug(
+        f"    -> SSIM: chọn chất lượng {qualities[lo]} (SSIM={score_at(lo):.4f}, "
+        f"ngưỡng {threshold}, {len(scores)} lần thử)"
+    )
+    return qualities[lo], score_at(lo)
+
+# ======================================================================
+# --- Nhóm 5: Kiểm tra "không tệ hơn" & thống kê dung lượng ---
+# ======================================================================
+
+def is_worth_replacing(original_bytes: Optional[int], new_bytes: int, min_saving_ratio: float) -> bool:
+    """
+    ``True`` nếu ảnh mới nhỏ hơn ảnh gốc ít nhất ``min_saving_ratio`` (ví dụ 0.05 = 5%).
+    Khi không biết dung lượng gốc thì luôn thay thế (giữ hành vi cũ).
+    """
+    if not original_bytes:
+        return True
+    return new_bytes <= original_bytes * (1 - max(0.0, min_saving_ratio))
+
+@dataclass
+class ImageSavings:
+    """Kết quả nén của một ảnh."""
+
+    name: str
+    original_bytes: Optional[int]
+    final_bytes: int
+    kept_original: bool = False
+    note: str = ""
+    location: str = ""
+    quality: Optional[int] = None
+    ssim: Optional[float] = None
+
+    def describe(self) -> str:
+        """Ghi chú hiển thị trong bảng: ``note`` kèm chất lượng/SSIM đã chọn (nếu có)."""
+        parts = [self.note or ("giữ ảnh gốc" if self.kept_original else "")]
+        if self.quality is not None:
+            parts.append(f"q{self.quality}")
+        if self.ssim is not None:
+            parts.append(f"SSIM {self.ssim:.4f}")
+        return ", ".join(part for part in parts if part)
+
+@dataclass
+class CompressionReport:
+    """
+    Bảng thống kê trước/sau của từng ảnh trong một lần nén.
+
+    Đối tượng luôn có giá trị ``True`` khi kiểm tra boolean để tương thích với kết quả
+    ``True``/``False`` của các hàm ``compress_images`` trước đây.
+    """
+
+    entries: List[ImageSavings] = field(default_factory=list)
+
+    def __bool__(self):
+        return True
+
+    def add(self, name, original_bytes, final_bytes, kept_original=False, note="", location="", quality=None, ssim=None):
+        entry = ImageSavings(name, original_bytes, final_bytes, kept_original, note, location, quality, ssim)
+        self.entries.append(entry)
+        return entry
+
+    @property
+    def total_original_bytes(self) -> int:
+        return sum(e.original_bytes or e.final_bytes for e in self.entries)
+
+    @property
+    def total_final_bytes(self) -> int:
+        return sum(e.final_bytes for e in self.entries)
+
+    def format_table(self) -> str:
+        """Bảng văn bản: tên ảnh, dung lượng trước/sau (KB), tỉ lệ giảm và ghi chú."""
+        rows = [("Ảnh", "Trước (KB)", "Sau (KB)", "Giảm", "Ghi chú")]
+        for e in self.entries:
+            before = "?" if e.original_bytes is None else f"{e.original_bytes / 1024:.1f}"
+            saving = "-" if not e.original_bytes else f"{(1 - e.final_bytes / e.original_bytes) * 100:.1f}%"
+            rows.append((e.name, before, f"{e.final_bytes / 1024:.1f}", saving, e.describe()))
+        total_before = self.total_original_bytes
+        total_saving = (1 - self.total_final_bytes / total_before) * 100 if total_before else 0.0
+        rows.append((
+            "TỔNG", f"{total_before / 1024:.1f}", f"{self.total_final_bytes / 1024:.1f}", f"{total_saving:.1f}%", ""
+        ))
+        return _format_rows(rows)
+
+    def format_breakdown(self) -> str:
+        """Bảng tổng hợp theo ``location``: số ảnh, dung lượng trước/sau (KB) và tỉ lệ giảm."""
+        groups: Dict[str, List[ImageSavings]] = {}
+        for e in self.entries:
+            groups.setdefault(e.location or "-", []).append(e)
+        rows = [("Vị trí", "Số ảnh", "Trước (KB)", "Sau (KB)", "Giảm")]
+        for location, entries in groups.items():
+            before = sum(e.original_bytes or e.final_bytes for e in entries)
+            after = sum(e.final_bytes for e in entries)
+            saving = (1 - after / before) * 100 if before else 0.0
+            rows.append((location, str(len(entries)), f"{before / 1024:.1f}", f"{after / 1024:.1f}", f"{saving:.1f}%"))
+        return _format_rows(rows)
+
+def _format_rows(rows) -> str:
+    """Căn cột cho bảng văn bản."""
+    widths = [max(len(str(row[i])) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join(
+        "  ".join(str(cell).ljust(widths[i]) for i, cell in enumerate(row)).rstrip()
+        for row in rows
+    )
+
+# ======================================================================
+# --- Nhóm 6: Tối ưu PNG không mất dữ liệu ---
+# ======================================================================
+
+# Chiến lược nén zlib (Pillow nhận qua ``compress_type``; không phải bộ lọc hàng PNG) và mức nén được thử
+_PNG_STRATEGIES = {
+    "default": zlib.Z_DEFAULT_STRATEGY,
+    "filtered": zlib.Z_FILTERED,
+    "rle": zlib.Z_RLE,
+    "huffman": zlib.Z_HUFFMAN_ONLY,
+}
+_PNG_LEVELS = (9, 6)
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Mode 8 bit/kênh mà mọi biến thể lossless biểu diễn chính xác được
+_LOSSLESS_PNG_MODES = ("1", "L", "LA", "P", "RGB", "RGBA")
+
+def png_bit_depth(data: bytes) -> Optional[int]:
+    """Số bit/kênh trong IHDR của file PNG, ``None`` nếu không phải PNG."""
+    if len(data) < 25 or not data.startswith(_PNG_SIGNATURE):
+        return None
+    return data[24]
+
+def has_high_bit_depth(img: Image.Image) -> bool:
+    """
+    Ảnh hơn 8 bit/kênh. Pillow đọc PNG/TIFF 16 bit RGB về mode ``RGB`` 8 bit nên còn kiểm tra
+    rawmode của tile (chỉ có khi ảnh chưa được giải mã).
+    """
+    if img.mode in ("I", "F") or img.mode.startswith("I;"):
+        return True
+    return any(
+        bits in str(tile[3]) for tile in (getattr(img, "tile", None) or []) for bits in ("16", "32")
+    )
+
+def is_lossless_png_candidate(img: Image.Image) -> bool:
+    """Ảnh 8 bit/kênh ở mode mà mọi biến thể lossless biểu diễn chính xác được."""
+    return img.mode in _LOSSLESS_PNG_MODES and not has_high_bit_depth(img)
+
+def _png_color_chunks(info: Dict[str, object]) -> Dict[str, object]:
+    """``save_kwargs`` giữ thông tin màu của ảnh gốc: ICC profile, gAMA, cHRM, sRGB."""
+    kwargs: Dict[str, object] = {}
+    if info.get("icc_profile"):
+        kwargs["icc_profile"] = info["icc_profile"]
+    chunks = PngImagePlugin.PngInfo()
+    if info.get("gamma") is not None:
+        chunks.add(b"gAMA", struct.pack(">I", round(float(info["gamma"]) * 100000)))
+    if info.get("chromaticity") is not None:
+        chunks.add(b"cHRM", struct.pack(">8I", *(round(float(v) * 100000) for v in info["chromaticity"])))
+    if info.get("srgb") is not None:
+        chunks.add(b"sRGB", bytes([int(info["srgb"])]))
+    if chunks.chunks:
+        kwargs["pnginfo"] = chunks
+    return kwargs
+
+def _same_pixels(a: Image.Image, b: Image.Image) -> bool:
+    return a.size == b.size and np.array_equal(np.asarray(a.convert("RGBA")), np.asarray(b.convert("RGBA")))
+
+def _palette_bits(colors: int) -> int:
+    for bits in (1, 2, 4):
+        if colors <= 1 << bits:
+            return bits
+    return 8
+
+def exact_palette(img: Image.Image):
+    """
+    Chuyển ảnh L/RGB/RGBA có không quá 256 màu sang mode ``P`` tương đương từng pixel.
+    Trả về ``(ảnh P, save_kwargs)`` hoặc ``None`` nếu ảnh có nhiều màu hơn.
+    """
+    if img.getcolors(256) is None:
+        return None
+    arr = np.asarray(img)
+    channels = 1 if arr.ndim == 2 else arr.shape[2]
+    flat = arr.reshape(-1, channels).astype(np.uint32)
+    packed = np.zeros(flat.shape[0], dtype=np.uint32)
+    for c in range(channels):
+        packed = (packed << 8) | flat[:, c]
+    colors, inverse = np.unique(packed, return_inverse=True)
+
+    table = np.stack([(colors >> (8 * (channels - 1 - c))) & 0xFF for c in range(channels)], axis=1)
+    if channels == 1:
+        table = np.repeat(table, 3, axis=1)
+    order = np.arange(len(colors))
+    alphas = None
+    if channels == 4:
+        # Màu trong suốt xếp trước để khối tRNS ngắn nhất.
+        order = np.argsort(table[:, 3] == 255, kind="stable")
+        alphas = table[order, 3]
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+
+    indices = rank[inverse.reshape(-1)].astype(np.uint8).reshape(arr.shape[:2])
+    pal_img = Image.fromarray(indices, "P")
+    pal_img.putpalette(table[order, :3].astype(np.uint8).tobytes())
+    save_kwargs: Dict[str, object] = {"bits": _palette_bits(len(colors))}
+    if alphas is not None and (alphas < 255).any():
+        save_kwargs["transparency"] = bytes(alphas[alphas < 255].tolist())
+    return pal_img, save_kwargs
+
+def lossless_png_variants(img: Image.Image) -> List[Tuple[str, Image.Image, Dict[str, object]]]:
+    """
+    Các biến thể tương đương từng pixel với ``img`` ở dạng lưu gọn hơn: bỏ kênh alpha toàn
+    đục, RGB xám -> L, L chỉ đen/trắng -> 1-bit, và bảng màu (1/2/4/8-bit) khi ảnh có không
+    quá 256 màu. Ảnh vốn ở mode ``P`` được giữ thêm bảng màu gốc làm một biến thể. Chỉ nhận
+    ảnh 8 bit/kênh (xem ``is_lossless_png_candidate``).
+    """
+    variants = []
+    if img.mode == "P":
+        kwargs = {"transparency": img.info["transparency"]} if "transparency" in img.info else {}
+        variants.append(("P gốc", img, kwargs))
+    if img.mode == "P":
+        img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+
+    if img.mode in ("RGBA", "LA") and img.getextrema()[-1][0] == 255:
+        img = img.convert("RGB" if img.mode == "RGBA" else "L")
+    if img.mode == "RGB":
+        r, g, b = (np.asarray(band) for band in img.split())
+        if np.array_equal(r, g) and np.array_equal(g, b):
+            img = img.convert("L")
+    if img.mode == "L" and set(v for _, v in img.getcolors(256) or []) <= {0, 255}:
+        img = img.convert("1", dither=Image.Dither.NONE)
+
+    variants.append((img.mode, img, {}))
+    if img.mode in ("L", "RGB", "RGBA"):
+        palette = exact_palette(img)
+        if palette is not None:
+            pal_img, pal_kwargs = palette
+            variants.append((f"P {pal_kwargs['bits']}-bit", pal_img, pal_kwargs))
+    return variants
+
+def optimize_png_lossless(
+    img: Image.Image,
+    dpi: Optional[Tuple[int, int]] = None,
+    max_workers: Optional[int] = None,
+) -> Optional[Tuple[bytes, str]]:
+    """
+    Thử song song mọi tổ hợp (biến thể mode/bit-depth x mức nén x chiến lược zlib) rồi giữ
+    file PNG nhỏ nhất mà khi giải mã lại vẫn giống ảnh gốc từng pixel. ICC profile và các
+    chunk gAMA/cHRM/sRGB của ảnh gốc được giữ.
+
+    Các "chiến lược" được thử là chiến lược nén của zlib (default/filtered/rle/huffman, truyền
+    qua ``compress_type``), không phải bộ lọc hàng của PNG (None/Sub/Up/Average/Paeth): Pillow
+    không cho chọn bộ lọc hàng mà luôn để libpng/zlib tự chọn (thường là adaptive).
+
+    Trả về ``(data, mô tả phương án thắng)``, hoặc ``None`` nếu ảnh không phải 8 bit/kênh
+    (ví dụ PNG 16 bit, mode ``I;16``) hay không phương án nào giữ nguyên được ảnh.
+    """
+    if not is_lossless_png_candidate(img):
+        logging.debug(f"    -> PNG lossless: bỏ qua ảnh mode '{img.mode}' (không phải 8 bit/kênh).")
+        return None
+    color_kwargs = _png_color_chunks(img.info)
+    trials = []
+    for label, variant, kwargs in lossless_png_variants(img):
+        for level in _PNG_LEVELS:
+            for strategy_name, strategy in _PNG_STRATEGIES.items():
+                save_kwargs = dict(kwargs, **color_kwargs, compress_level=level, compress_type=strategy)
+                if dpi:
+                    save_kwargs["dpi"] = dpi
+                trials.append((f"{label}, level {level}, {strategy_name}", variant, save_kwargs))
+
+    def run(trial):
+        buffer = io.BytesIO()
+        trial[1].save(buffer, format="PNG", **trial[2])
+        return buffer.getvalue()
+
+    # zlib trong Pillow nhả GIL khi nén nên dùng thread là đủ song song.
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(run, trials))
+    # Mỗi biến thể chỉ cần kiểm tra một lần (mức nén/chiến lược không đổi pixel).
+    verified: Dict[int, bool] = {}
+    for best in sorted(range(len(trials)), key=lambda i: len(results[i])):
+        variant_id = id(trials[best][1])
+        if variant_id not in verified:
+            with Image.open(io.BytesIO(results[best])) as decoded:
+                verified[variant_id] = _same_pixels(decoded, img)
+        if verified[variant_id]:
+            logging.debug(f"    -> PNG lossless: {len(trials)} phương án, chọn '{trials[best][0]}' ({len(results[best]) / 1024:.1f}KB)")
+            return results[best], trials[best][0]
+    logging.warning("    -> PNG lossless: không phương án nào giữ nguyên từng pixel, giữ ảnh gốc.")
+    return None
+
+# ======================================================================
+# --- Nhóm 7: Phân loại nội dung ảnh để chọn định dạng ---
+# ======================================================================
+
+FORMAT_JPEG = "JPEG"
+FORMAT_PNG_PALETTE = "PNG_PALETTE"
+FORMAT_PNG = "PNG"
+
+# Ngưỡng phân loại (tính trên ảnh mẫu đã thu nhỏ)
+_EDGE_THRESHOLD = 48           # chênh lệch độ sáng giữa 2 pixel kề nhau coi là cạnh sắc
+_PALETTE_MAX_COLORS = 256
+_GRAPHIC_MAX_COLORS = 4096     # đồ hoạ/ảnh chụp màn hình khử răng cưa vẫn ít màu
+_GRAPHIC_MIN_EDGE_DENSITY = 0.005
+_CHROMA_EDGE_DENSITY_444 = 0.01  # nhiều cạnh màu (chữ màu) -> JPEG 4:4:4
+
+@dataclass
+class ImageProfile:
+    """Thống kê nội dung ảnh và định dạng đề xuất."""
+
+    unique_colors: Optional[int]      # ``None`` nếu vượt ``_GRAPHIC_MAX_COLORS``
+    edge_density: float               # tỉ lệ pixel có cạnh sáng/tối sắc
+    chroma_edge_density: float        # tỉ lệ pixel có cạnh màu sắc
+    alpha: str                        # "none" | "opaque" | "binary" | "partial"
+    format: str                       # FORMAT_JPEG | FORMAT_PNG_PALETTE | FORMAT_PNG
+    subsampling: int = 2              # cho JPEG: 0 = 4:4:4, 2 = 4:2:0
+
+    @property
+    def flatten_alpha(self) -> bool:
+        return self.alpha == "opaque"
+
+def _alpha_class(alpha: np.ndarray) -> str:
+    if alpha.min() == 255:
+        return "opaque"
+    if np.count_nonzero((alpha > 0) & (alpha < 255)) <= alpha.size * 0.001:
+        return "binary"
+    return "partial"
+
+def _edge_density(plane: np.ndarray, threshold: int) -> float:
+    """Tỉ lệ pixel có chênh lệch với pixel kề phải/dưới vượt ``threshold``."""
+    if plane.shape[0] < 2 or plane.shape[1] < 2:
+        return 0.0
+    dx = np.abs(np.diff(plane, axis=1))[:-1, :]
+    dy = np.abs(np.diff(plane, axis=0))[:, :-1]
+    return float(np.count_nonzero(np.maximum(dx, dy) > threshold)) / dx.size
+
+def classify_image(img: Image.Image, max_side: int = 512) -> ImageProfile:
+    """
+    Phân loại nội dung ảnh (vector hoá bằng NumPy trên ảnh mẫu tối đa ``max_side`` pixel):
+
+    - kênh alpha đục hoàn toàn -> bỏ kênh alpha, coi như ảnh không trong suốt;
+    - có pixel trong suốt (alpha nhị phân hoặc trong mờ) -> luôn là PNG, không bao giờ JPEG;
+    - không quá 256 màu -> PNG bảng màu (không mất dữ liệu);
+    - ít màu và nhiều cạnh sắc (chữ, biểu đồ, ảnh chụp màn hình) -> PNG truecolor;
+    - còn lại (ảnh chụp) -> JPEG, giữ 4:4:4 nếu có nhiều cạnh màu, ngược lại 4:2:0.
+
+    Số màu được đếm trên ảnh gốc khi nó không quá 256 màu (``getcolors`` dừng sớm), các thống
+    kê khác dùng ảnh mẫu.
+    """
+    has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+    rgba = img.convert("RGBA" if has_alpha else "RGB")
+
+    sample = rgba
+    if max(sample.size) > max_side:
+        scale = max_side / max(sample.size)
+        size = (max(1, round(sample.width * scale)), max(1, round(sample.height * scale)))
+        # NEAREST giữ nguyên màu và cạnh sắc (không sinh màu trung gian như khi nội suy).
+        sample = sample.resize(size, Image.NEAREST)
+    arr = np.asarray(sample)
+
+    alpha = _alpha_class(arr[..., 3]) if has_alpha else "none"
+    rgb = arr[..., :3].astype(np.int32)
+
+    exact = rgba.convert("RGB") if alpha in ("none", "opaque") else rgba
+    small_palette = exact.getcolors(_PALETTE_MAX_COLORS)
+    if small_palette is not None:
+        unique_colors: Optional[int] = len(small_palette)
+    else:
+        channels = arr.shape[2] if alpha not in ("none", "opaque") else 3
+        flat = arr[..., :channels].reshape(-1, channels).astype(np.uint32)
+        packed = np.zeros(flat.shape[0], dtype=np.uint32)
+        for c in range(channels):
+            packed = (packed << 8) | flat[:, c]
+        # Ảnh gốc đã có hơn 256 màu; ảnh mẫu chỉ dùng để ước lượng (NEAREST không thêm màu).
+        count = max(len(np.unique(packed)), _PALETTE_MAX_COLORS + 1)
+        unique_colors = count if count <= _GRAPHIC_MAX_COLORS else None
+
+    luma = (rgb[..., 0] * 299 + rgb[..., 1] * 587 + rgb[..., 2] * 114) // 1000
+    edge_density = _edge_density(luma, _EDGE_THRESHOLD)
+    cb = rgb[..., 2] - luma
+    cr = rgb[..., 0] - luma
+    chroma_edge_density = max(_edge_density(cb, _EDGE_THRESHOLD), _edge_density(cr, _EDGE_THRESHOLD))
+
+    subsampling = 2
+    if small_palette is not None:
+        fmt = FORMAT_PNG_PALETTE
+    elif alpha in ("binary", "partial"):
+        fmt = FORMAT_PNG
+    elif unique_colors is not None and edge_density >= _GRAPHIC_MIN_EDGE_DENSITY:
+        fmt = FORMAT_PNG
+    else:
+        fmt = FORMAT_JPEG
+        if chroma_edge_density >= _CHROMA_EDGE_DENSITY_444:
+            subsampling = 0
+
+    return ImageProfile(unique_colors, edge_density, chroma_edge_density, alpha, fmt, subsampling)
+
+# ======================================================================
+# --- Nhóm 8: Perceptual hash & ảnh gần trùng ---
+# ======================================================================
+
+_PHASH_SIZE = 32        # ảnh thu nhỏ để tính DCT
+_PHASH_BITS_SIDE = 8    # lấy khối 8x8 tần số thấp -> hash 64 bit
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# So ảnh gần trùng ở kích thước chung: độ sáng (và alpha) làm mờ rất nhẹ, trung bình chênh lệch
+# lớn nhất trong cửa sổ 6x6 - bắt được một chữ số khác trong bảng; màu làm mờ mạnh (cửa sổ
+# 8x8) để bỏ qua nhiễu lấy mẫu màu của JPEG nhưng vẫn bắt được đổi màu. Đo thử: bản nén lại
+# (JPEG q30-q90) / xuất lại cỡ khác của cùng ảnh ~0-17; bảng chỉ khác một chữ số >= 25
+# (kể cả khi nén JPEG và đổi cỡ) -> mặc định 18 là ngưỡng thận trọng.
+NEAR_DUPLICATE_TOLERANCE = 18.0
+_NEAR_DUPLICATE_DETAIL = (0.5, 6)   # (bán kính làm mờ, cửa sổ) cho độ sáng/alpha
+_NEAR_DUPLICATE_COLOR = (2.0, 8)    # (bán kính làm mờ, cửa sổ) cho R, G, B
+_NEAR_DUPLICATE_MAX_SIDE = 2048
+_NEAR_DUPLICATE_MAX_ASPECT_DIFF = 0.02
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)
+    matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+_DCT = _dct_matrix(_PHASH_SIZE)
+
+def _flatten_on_white(img: Image.Image) -> Image.Image:
+    """Ảnh RGBA với màu đã làm phẳng trên nền trắng (kênh alpha giữ nguyên)."""
+    rgba = img.convert("RGBA")
+    base = Image.new("RGBA", rgba.size, (255, 255, 255, 255))
+    flat = Image.alpha_composite(base, rgba)
+    flat.putalpha(rgba.getchannel("A"))
+    return flat
+
+def hash_thumbnail(img: Image.Image) -> np.ndarray:
+    """Ảnh xám ``_PHASH_SIZE`` x ``_PHASH_SIZE`` (float, 0..255), alpha được làm phẳng trên nền trắng."""
+    if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info:
+        img = _flatten_on_white(img)
+    gray = img.convert("RGB").convert("L").resize((_PHASH_SIZE, _PHASH_SIZE), Image.BOX)
+    return np.asarray(gray, dtype=np.float64)
+
+def perceptual_hash(thumbnail: np.ndarray) -> int:
+    """pHash 64 bit: dấu của các hệ số DCT tần số thấp so với trung vị."""
+    coefficients = (_DCT @ thumbnail @ _DCT.T)[:_PHASH_BITS_SIDE, :_PHASH_BITS_SIDE].ravel()
+    bits = coefficients[1:] > np.median(coefficients[1:])   # bỏ hệ số DC
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+def hamming_matrix(hashes: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """Khoảng cách Hamming giữa từng cặp (``hashes`` x ``others``, mảng ``uint64``)."""
+    xor = hashes[:, None] ^ others[None, :]
+    return _POPCOUNT[xor.view(np.uint8).reshape(xor.shape + (8,))].sum(axis=2, dtype=np.uint8)
+
+def _windowed_difference(a: Image.Image, b: Image.Image, blur: float, window: int) -> float:
+    """Trung bình chênh lệch lớn nhất trong cửa sổ ``window`` (mọi kênh) sau khi làm mờ ``blur``."""
+    first = np.asarray(a.filter(ImageFilter.GaussianBlur(blur)), dtype=np.float64)
+    second = np.asarray(b.filter(ImageFilter.GaussianBlur(blur)), dtype=np.float64)
+    difference = np.abs(first - second)
+    if difference.ndim == 2:
+        difference = difference[:, :, None]
+    window = max(1, min(window, difference.shape[0], difference.shape[1]))
+    return max(float(_box_mean(difference[:, :, c], window).max()) for c in range(difference.shape[2]))
+
+def local_difference(a: Image.Image, b: Image.Image) -> Optional[float]:
+    """
+    Mức khác nhau cục bộ (0..255) giữa hai ảnh có thể khác kích thước và mức nén: cả hai được
+    đưa về kích thước chung (của ảnh nhỏ hơn, tối đa ``_NEAR_DUPLICATE_MAX_SIDE``) rồi lấy
+    giá trị lớn nhất của chênh lệch độ sáng/alpha (làm mờ rất nhẹ, cửa sổ nhỏ) và chênh lệch
+    màu (làm mờ mạnh). Khác biệt nhỏ nhưng tập trung (một chữ số trong bảng) vẫn cho giá trị
+    lớn. ``None`` nếu tỉ lệ khung hình khác nhau; 0 nghĩa là giống hệt từng pixel.
+    """
+    ratio_a, ratio_b = a.width / a.height, b.width / b.height
+    if abs(ratio_a - ratio_b) / max(ratio_a, ratio_b) > _NEAR_DUPLICATE_MAX_ASPECT_DIFF:
+        return None
+    width, height = min(a.width, b.width), min(a.height, b.height)
+    scale = min(1.0, _NEAR_DUPLICATE_MAX_SIDE / max(width, height))
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+
+    images = []
+    for img in (a, b):
+        img = _flatten_on_white(img)
+        images.append(img if img.size == size else img.resize(size, Image.LANCZOS))
+    first, second = images
+    detail = _windowed_difference(
+        first.convert("RGB").convert("L"), second.convert("RGB").convert("L"), *_NEAR_DUPLICATE_DETAIL
+    )
+    alpha = _windowed_difference(first.getchannel("A"), second.getchannel("A"), *_NEAR_DUPLICATE_DETAIL)
+    color = _windowed_difference(first.convert("RGB"), second.convert("RGB"), *_NEAR_DUPLICATE_COLOR)
+    return max(detail, alpha, color)
+
+def near_duplicate_groups(
+    hashes,
+    max_distance: int = 4,
+    order=None,
+    verify=None,
+    block_size: int = 1024,
+) -> List[List[int]]:
+    """
+    Gom nhóm ảnh trùng. pHash cách nhau không quá ``max_distance`` bit chỉ dùng để lọc ứng
+    viên (tính theo khối ``block_size`` x n bằng NumPy, không lặp từng cặp trong Python).
+
+    Ảnh được duyệt theo ``order`` (ảnh ưu tiên giữ lại trước); mỗi ảnh chưa thuộc nhóm nào
+    trở thành ảnh giữ lại, và chỉ những ứng viên mà ``verify(giữ lại, ứng viên)`` xác nhận mới
+    vào nhóm của nó - không bắc cầu A~B~C, mọi thành viên đều khớp trực tiếp với ảnh giữ lại.
+    Trả về các nhóm (phần tử đầu là ảnh giữ lại) có từ 2 ảnh trở lên.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    count = len(hashes)
+    candidates: Dict[int, List[int]] = {}
+    for start in range(0, count, block_size):
+        block = hashes[start:start + block_size]
+        rows, cols = np.nonzero(hamming_matrix(block, hashes) <= max_distance)
+        for i, j in zip((rows + start).tolist(), cols.tolist()):
+            if i != j:
+                candidates.setdefault(i, []).append(j)
+
+    assigned = [False] * count
+    groups = []
+    for keep in (order if order is not None else range(count)):
+        if assigned[keep] or keep not in candidates:
+            continue
+        members = [keep]
+        for other in candidates[keep]:
+            if not assigned[other] and (verify is None or verify(keep, other)):
+                members.append(other)
+        if len(members) > 1:
+            for i in members:
+                assigned[i] = True
+            groups.append(members)
+    return groups
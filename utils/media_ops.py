@@ -0,0 +1,689 @@
+# Đường dẫn: excel_toolkit/utils/media_ops.py
+# Phiên bản 2.1 - Tra media của picture qua r:embed kèm kích thước hiển thị đọc từ drawing
+# Ngày cập nhật: 2026-10-19
+
+import io
+import logging
+import os
+import posixpath
+import struct
+from collections import Counter
+
+from PIL import Image, JpegImagePlugin
+
+from utils import image_ops, package_ops
+from utils.package_ops import (
+    NS_DRAWING_MAIN, NS_REL, NS_XDR, REL_TYPE_CHART, REL_TYPE_DRAWING, REL_TYPE_IMAGE,
+    REL_TYPE_VML_DRAWING, qn,
+)
+
+# srcRect dùng đơn vị 1/1000 phần trăm (100000 = 100%)
+_CROP_UNIT = 100000
+_CROPPABLE_FORMATS = ("PNG", "JPEG", "GIF", "BMP", "TIFF")
+
+# --- Vị trí của ảnh trong workbook ---
+LOCATION_PICTURE = "picture"                            # picture/shape fill trên sheet hiển thị
+LOCATION_HIDDEN_SHEET_PICTURE = "hidden_sheet_picture"  # picture trên sheet ẩn
+LOCATION_BACKGROUND = "background"                      # ảnh nền sheet (Page Layout > Background)
+LOCATION_HEADER_FOOTER = "header_footer"                # logo header/footer (VML drawing)
+LOCATION_CHART_FILL = "chart_fill"                      # ảnh tô nền chart area/plot area/series
+LOCATION_OTHER = "other"                                # media không xác định được nơi dùng
+
+LOCATION_LABELS = {
+    LOCATION_PICTURE: "Ảnh trên sheet",
+    LOCATION_HIDDEN_SHEET_PICTURE: "Ảnh trên sheet ẩn",
+    LOCATION_BACKGROUND: "Nền sheet",
+    LOCATION_HEADER_FOOTER: "Header/footer (VML)",
+    LOCATION_CHART_FILL: "Tô nền chart",
+    LOCATION_OTHER: "Khác",
+}
+
+# Các vị trí mà engine nén qua Excel (chỉ duyệt Shapes) không chạm tới
+EXTRA_LOCATIONS = (
+    LOCATION_BACKGROUND, LOCATION_HEADER_FOOTER, LOCATION_CHART_FILL, LOCATION_HIDDEN_SHEET_PICTURE,
+)
+_RECOMPRESSIBLE_FORMATS = ("JPEG", "PNG")
+
+# --- Ảnh định dạng cũ/không nén ---
+_LEGACY_RASTER_FORMATS = ("BMP", "DIB", "TIFF")
+_LEGACY_EXTENSIONS = ("bmp", "dib", "tif", "tiff", "emf")
+_CONTENT_TYPES = {"png": "image/png", "jpeg": "image/jpeg"}
+
+# Bản ghi EMF (MS-EMF): chỉ chuyển đổi EMF gồm đúng một bitmap vẽ bằng EMR_STRETCHDIBITS,
+# ngoài ra chỉ có các bản ghi thiết lập trạng thái không vẽ gì.
+_EMR_HEADER = 1
+_EMR_EOF = 14
+_EMR_STRETCHDIBITS = 81
+_EMR_STATE_RECORDS = {
+    9, 10, 11, 12, 13,      # SETWINDOWEXTEX/ORGEX, SETVIEWPORTEXTEX/ORGEX, SETBRUSHORGEX
+    17, 18, 19, 20, 21, 22,  # SETMAPMODE, SETBKMODE, SETPOLYFILLMODE, SETROP2, SETSTRETCHBLTMODE, SETTEXTALIGN
+    24, 25, 30, 33, 34,     # SETTEXTCOLOR, SETBKCOLOR, INTERSECTCLIPRECT, SAVEDC, RESTOREDC
+    35, 36, 70, 75, 98, 115,  # SET/MODIFYWORLDTRANSFORM, GDICOMMENT, EXTSELECTCLIPRGN, SETICMMODE, SETLAYOUT
+}
+_SRCCOPY = 0x00CC0020
+
+# ======================================================================
+# --- Nhóm 1: Tra cứu picture ---
+# ======================================================================
+
+def _iter_sheet_pictures(pkg):
+    """
+    Duyệt ``(sheet, drawing_part, anchor, pic_element, media_part)`` của mọi picture trên các
+    sheet; ``anchor`` là phần tử anchor cấp cao nhất chứa picture (kể cả picture trong group).
+    """
+    for sheet in pkg.sheet_parts():
+        if not sheet["part"] or not pkg.has_part(sheet["part"]):
+            continue
+        for rel in pkg.get_relationships(sheet["part"]):
+            if rel["type"] != REL_TYPE_DRAWING or rel["external"] or not pkg.has_part(rel["target"]):
+                continue
+            drawing = rel["target"]
+            root, _ = pkg.read_xml(drawing)
+            targets = {r["id"]: r["target"] for r in pkg.get_relationships(drawing) if not r["external"]}
+            for anchor in root:
+                for pic in anchor.iter(qn(NS_XDR, "pic")):
+                    blip = pic.find(f"{qn(NS_XDR, 'blipFill')}/{qn(NS_DRAWING_MAIN, 'blip')}")
+                    media = targets.get(blip.get(qn(NS_REL, "embed"))) if blip is not None else None
+                    if media and pkg.has_part(media):
+                        yield sheet, drawing, anchor, pic, media
+                    else:
+                        logging.debug(
+                            f"  -> Bỏ qua picture '{_picture_name(pic)}' trong '{drawing}': "
+                            "r:embed không trỏ tới media nào trong gói (ảnh liên kết ngoài hoặc thiếu part)."
+                        )
+
+def _picture_name(pic):
+    c_nv_pr = pic.find(f"{qn(NS_XDR, 'nvPicPr')}/{qn(NS_XDR, 'cNvPr')}")
+    return c_nv_pr.get("name") if c_nv_pr is not None else None
+
+def _picture_display_size(anchor, pic):
+    """
+    Kích thước hiển thị (point) của picture: ``xdr:spPr/a:xfrm/a:ext``, không có thì ``xdr:ext``
+    của oneCellAnchor/absoluteAnchor. Picture trong group trả về ``None`` (xfrm tính theo hệ
+    tọa độ con của group, có thể đã bị co giãn).
+    """
+    if pic not in list(anchor):
+        return None
+    ext = pic.find(f"{qn(NS_XDR, 'spPr')}/{qn(NS_DRAWING_MAIN, 'xfrm')}/{qn(NS_DRAWING_MAIN, 'ext')}")
+    if ext is None:
+        ext = anchor.find(qn(NS_XDR, "ext"))
+    try:
+        width, height = int(ext.get("cx")), int(ext.get("cy"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+    if width <= 0 or height <= 0:
+        return None
+    return image_ops.emu_to_points(width), image_ops.emu_to_points(height)
+
+def sheet_picture_media(pkg):
+    """
+    ``{tên sheet: [(tên picture, media part, kích thước hiển thị), ...]}`` theo thứ tự picture
+    trong drawing. Media được tra qua ``r:embed`` của blip và .rels của drawing; picture không
+    tra được media bị bỏ qua. Kích thước hiển thị (point) là ``None`` nếu drawing không ghi.
+    """
+    pictures = {}
+    for sheet, _, anchor, pic, media in _iter_sheet_pictures(pkg):
+        pictures.setdefault(sheet["name"], []).append((_picture_name(pic), media, _picture_display_size(anchor, pic)))
+    return pictures
+
+def picture_media_index(file_path):
+    """
+    Ánh xạ ``(tên sheet, tên picture) -> {"media": part, "bytes": dung lượng}`` từ file đã lưu.
+    Tên picture khớp với ``Shape.Name`` trong Excel. Trả về ``{}`` nếu không đọc được gói.
+    """
+    index = {}
+    try:
+        with package_ops.ExcelPackage(file_path) as pkg:
+            for sheet, _, _, pic, media in _iter_sheet_pictures(pkg):
+                name = _picture_name(pic)
+                if name is None:
+                    continue
+                index[(sheet["name"], name)] = {
+                    "media": media,
+                    "bytes": pkg.part_size(media),
+                }
+    except Exception as e:
+        logging.debug(f"Không thể đọc danh sách ảnh gốc từ '{file_path}': {e}")
+    return index
+
+# ======================================================================
+# --- Nhóm 2: Cắt ảnh (crop) ---
+# ======================================================================
+
+def _read_src_rect(src_rect):
+    """Đọc ``a:srcRect`` -> (l, t, r, b) hoặc ``None`` nếu không cắt / không hỗ trợ."""
+    try:
+        crop = tuple(int(src_rect.get(key, 0)) for key in ("l", "t", "r", "b"))
+    except ValueError:
+        return None
+    left, top, right, bottom = crop
+    if not any(crop):
+        return None
+    # Giá trị âm nghĩa là thêm lề (padding) chứ không phải cắt -> giữ nguyên.
+    if min(crop) < 0 or left + right >= _CROP_UNIT or top + bottom >= _CROP_UNIT:
+        return None
+    return crop
+
+def _crop_image_bytes(data, crop):
+    """
+    Cắt ảnh theo ``crop`` (đơn vị srcRect) và mã hoá lại đúng định dạng gốc; JPEG dùng lại
+    bảng lượng tử hoá và subsampling của ảnh gốc nên chất lượng không đổi.
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        fmt = img.format
+        if fmt not in _CROPPABLE_FORMATS or getattr(img, "is_animated", False):
+            return None
+
+        left, top, right, bottom = crop
+        width, height = img.size
+        box = (
+            round(width * left / _CROP_UNIT),
+            round(height * top / _CROP_UNIT),
+            width - round(width * right / _CROP_UNIT),
+            height - round(height * bottom / _CROP_UNIT),
+        )
+        if box[2] <= box[0] or box[3] <= box[1]:
+            return None
+
+        cropped = img.crop(box)
+        save_kwargs = {}
+        if fmt == "JPEG":
+            save_kwargs.update(optimize=True, qtables=img.quantization)
+            sampling = JpegImagePlugin.get_sampling(img)
+            if sampling != -1:
+                save_kwargs["subsampling"] = sampling
+            if img.info.get("exif"):
+                save_kwargs["exif"] = img.info["exif"]
+        elif fmt == "PNG":
+            save_kwargs["optimize"] = True
+        if img.info.get("transparency") is not None and fmt in ("PNG", "GIF"):
+            save_kwargs["transparency"] = img.info["transparency"]
+        if img.info.get("icc_profile"):
+            save_kwargs["icc_profile"] = img.info["icc_profile"]
+
+        buffer = io.BytesIO()
+        cropped.save(buffer, format=fmt, **save_kwargs)
+        return buffer.getvalue()
+
+def apply_picture_crops(file_path):
+    """
+    Cắt thật dữ liệu ảnh theo vùng crop (``a:srcRect``) của picture trong drawing, sau đó
+    xoá vùng crop khỏi drawing XML. Ảnh hiển thị không đổi nhưng phần bị che không còn
+    được lưu trong ``xl/media``.
+
+    Ảnh được tham chiếu ở bất kỳ chỗ nào khác (picture khác, VML, chart, nền sheet...) được bỏ
+    qua vì chỗ đó vẫn cần ảnh đầy đủ. Ảnh chỉ được thay khi bản đã cắt nhỏ hơn bản gốc.
+    """
+    logging.debug(f"Bắt đầu áp dụng vùng crop cho ảnh trong file '{os.path.basename(file_path)}'.")
+    try:
+        with package_ops.ExcelPackage(file_path) as pkg:
+            drawings = {}
+            usage = Counter()
+            for drawing in pkg.parts_by_content_type(package_ops.CT_DRAWING):
+                root, namespaces = pkg.read_xml(drawing)
+                targets = {
+                    rel["id"]: rel["target"]
+                    for rel in pkg.get_relationships(drawing)
+                    if not rel["external"]
+                }
+                drawings[drawing] = (root, namespaces, targets)
+                for blip in root.iter(qn(NS_DRAWING_MAIN, "blip")):
+                    target = targets.get(blip.get(qn(NS_REL, "embed")))
+                    if target:
+                        usage[target] += 1
+            # Mọi relationship khác trỏ tới media (VML header/footer, chart, nền sheet...).
+            for rels_part in pkg.part_names():
+                if not rels_part.endswith(".rels"):
+                    continue
+                source = pkg.rels_source(rels_part)
+                if source in drawings:
+                    continue
+                for rel in pkg.get_relationships(source):
+                    if not rel["external"]:
+                        usage[rel["target"]] += 1
+
+            cropped_count = 0
+            saved_bytes = 0
+            for drawing, (root, namespaces, targets) in drawings.items():
+                changed = False
+                for blip_fill in root.iter(qn(NS_XDR, "blipFill")):
+                    blip = blip_fill.find(qn(NS_DRAWING_MAIN, "blip"))
+                    src_rect = blip_fill.find(qn(NS_DRAWING_MAIN, "srcRect"))
+                    if blip is None or src_rect is None:
+                        continue
+                    crop = _read_src_rect(src_rect)
+                    if crop is None:
+                        continue
+
+                    media = targets.get(blip.get(qn(NS_REL, "embed")))
+                    if not media or not pkg.has_part(media):
+                        continue
+                    if usage[media] != 1:
+                        logging.debug(f"  -> Bỏ qua '{media}' vì được dùng ở {usage[media]} chỗ.")
+                        continue
+
+                    original = pkg.read(media)
+                    try:
+                        data = _crop_image_bytes(original, crop)
+                    except Exception as crop_err:
+                        logging.warning(f"  -> Không thể cắt ảnh '{media}': {crop_err}")
+                        continue
+                    if data is None:
+                        continue
+                    if len(data) >= len(original):
+                        logging.debug(
+                            f"  -> Giữ ảnh gốc '{media}': bản đã cắt không nhỏ hơn "
+                            f"({len(original) / 1024:.1f}KB -> {len(data) / 1024:.1f}KB)."
+                        )
+                        continue
+
+                    pkg.write(media, data)
+                    for key in ("l", "t", "r", "b"):
+                        src_rect.attrib.pop(key, None)
+                    changed = True
+                    cropped_count += 1
+                    saved_bytes += len(original) - len(data)
+                    logging.debug(f"  -> Đã cắt ảnh '{media}': {len(original) / 1024:.1f}KB -> {len(data) / 1024:.1f}KB")
+
+                if changed:
+                    pkg.write_xml(drawing, root, namespaces)
+
+            if cropped_count:
+                pkg.save()
+        logging.info(f"Hoàn tất áp dụng vùng crop: {cropped_count} ảnh, giảm {saved_bytes / 1024:.1f}KB.")
+        return True
+    except Exception as e:
+        logging.error(f"Lỗi khi áp dụng vùng crop cho ảnh: {e}")
+        return False
+
+# ======================================================================
+# --- Nhóm 3: Nén ảnh theo vị trí trong gói ---
+# ======================================================================
+
+def _image_targets(pkg, part_name):
+    """Các part ảnh (nội bộ, còn tồn tại) mà ``part_name`` tham chiếu trực tiếp."""
+    return [
+        rel["target"] for rel in pkg.get_relationships(part_name)
+        if rel["type"] == REL_TYPE_IMAGE and not rel["external"] and pkg.has_part(rel["target"])
+    ]
+
+def media_locations(pkg):
+    """
+    Phân loại mọi part ảnh theo nơi sử dụng: ``{media: [(location, tên sheet), ...]}``.
+    Media trong ``xl/media`` không được tham chiếu từ sheet nào được xếp vào ``LOCATION_OTHER``.
+    """
+    locations = {}
+
+    def add(media, location, owner):
+        if (location, owner) not in locations.setdefault(media, []):
+            locations[media].append((location, owner))
+
+    for sheet in pkg.sheet_parts():
+        part = sheet["part"]
+        if not part or not pkg.has_part(part):
+            continue
+        hidden = sheet["state"] != "visible"
+        for rel in pkg.get_relationships(part):
+            target = rel["target"]
+            if rel["external"] or not pkg.has_part(target):
+                continue
+            if rel["type"] == REL_TYPE_IMAGE:
+                add(target, LOCATION_BACKGROUND, sheet["name"])
+            elif rel["type"] == REL_TYPE_VML_DRAWING:
+                for media in _image_targets(pkg, target):
+                    add(media, LOCATION_HEADER_FOOTER, sheet["name"])
+            elif rel["type"] == REL_TYPE_DRAWING:
+                for drawing_rel in pkg.get_relationships(target):
+                    if drawing_rel["external"] or not pkg.has_part(drawing_rel["target"]):
+                        continue
+                    if drawing_rel["type"] == REL_TYPE_IMAGE:
+                        location = LOCATION_HIDDEN_SHEET_PICTURE if hidden else LOCATION_PICTURE
+                        add(drawing_rel["target"], location, sheet["name"])
+                    elif drawing_rel["type"] == REL_TYPE_CHART:
+                        for media in _image_targets(pkg, drawing_rel["target"]):
+                            add(media, LOCATION_CHART_FILL, sheet["name"])
+
+    for name in pkg.part_names():
+        if name.startswith("xl/media/") and name not in locations:
+            add(name, LOCATION_OTHER, "")
+    return locations
+
+def _recompress_same_format(data, quality, max_width=None, max_height=None):
+    """
+    Nén lại ảnh JPEG/PNG nhưng giữ nguyên định dạng (không phải sửa tên part, .rels hay
+    content type). Trả về ``None`` nếu định dạng không hỗ trợ.
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        fmt = img.format
+        if fmt not in _RECOMPRESSIBLE_FORMATS or getattr(img, "is_animated", False):
+            return None
+        if fmt == "PNG" and (image_ops.png_bit_depth(data) or 8) > 8:
+            return None  # PNG 16 bit: Pillow chỉ đọc được bản 8 bit -> không nén lại được mà không mất dữ liệu
+
+        target_size = image_ops.bounded_size(img.size, max_width, max_height)
+        result = img
+        if target_size != img.size:
+            image_ops.prepare_draft(img, target_size)
+            if img.mode == "P":
+                result = img.convert("RGBA")
+            result = image_ops.resize_reduced(result, target_size)
+
+        if fmt == "PNG":
+            optimized = image_ops.optimize_png_lossless(result)
+            return optimized[0] if optimized else None
+
+        # JPEG
+        if result.mode not in ("RGB", "L", "CMYK"):
+            result = result.convert("RGB")
+        save_kwargs = {"quality": max(1, min(100, quality)), "optimize": True, "progressive": True}
+        if img.info.get("icc_profile"):
+            save_kwargs["icc_profile"] = img.info["icc_profile"]
+
+        buffer = io.BytesIO()
+        result.save(buffer, format=fmt, **save_kwargs)
+        return buffer.getvalue()
+
+def compress_package_media(
+    file_path,
+    locations=EXTRA_LOCATIONS,
+    quality=70,
+    max_width=None,
+    max_height=None,
+    min_saving_ratio=0.05,
+):
+    """
+    Nén lại trực tiếp trong gói các ảnh nằm ở ``locations`` (mặc định là những nơi engine nén
+    qua Excel bỏ sót: nền sheet, header/footer, chart, sheet ẩn). Ảnh giữ nguyên định dạng và
+    chỉ được thay khi nhỏ hơn ít nhất ``min_saving_ratio``.
+
+    Trả về :class:`image_ops.CompressionReport` (có cột ``location`` để tổng hợp theo vị trí),
+    hoặc ``False`` nếu lỗi.
+    """
+    logging.info(f"Bắt đầu nén ảnh nền/header/footer/chart trong file '{os.path.basename(file_path)}'.")
+    report = image_ops.CompressionReport()
+    try:
+        with package_ops.ExcelPackage(file_path) as pkg:
+            for media, usages in media_locations(pkg).items():
+                selected = [(loc, owner) for loc, owner in usages if loc in locations]
+                if not selected:
+                    continue
+                location, owner = selected[0]
+                label = LOCATION_LABELS.get(location, location)
+                entry_name = f"{owner}: {media}" if owner else media
+
+                original = pkg.read(media)
+                try:
+                    data = _recompress_same_format(original, quality, max_width, max_height)
+                except Exception as img_err:
+                    logging.warning(f"  -> Không thể nén ảnh '{media}': {img_err}")
+                    continue
+                if data is None:
+                    logging.debug(f"  -> Bỏ qua '{media}' (định dạng không hỗ trợ).")
+                    continue
+
+                if not image_ops.is_worth_replacing(len(original), len(data), min_saving_ratio):
+                    report.add(entry_name, len(original), len(original), kept_original=True, location=label)
+                    continue
+                pkg.write(media, data)
+                report.add(entry_name, len(original), len(data), location=label)
+                logging.debug(f"  -> [{label}] '{media}': {len(original) / 1024:.1f}KB -> {len(data) / 1024:.1f}KB")
+
+            if pkg.is_modified:
+                pkg.save()
+    except Exception as e:
+        logging.error(f"Lỗi khi nén ảnh trong gói: {e}")
+        return False
+
+    if report.entries:
+        logging.info("Thống kê dung lượng ảnh theo vị trí:\n" + report.format_breakdown())
+        logging.debug("Chi tiết:\n" + report.format_table())
+    else:
+        logging.info("Không có ảnh nền/header/footer/chart/sheet ẩn nào cần nén.")
+    return report
+
+# ======================================================================
+# --- Nhóm 4: Chuyển đổi ảnh định dạng cũ ---
+# ======================================================================
+
+def _emf_single_bitmap(data):
+    """
+    Trả về bitmap (dạng file BMP) nếu ``data`` là EMF chỉ chứa đúng một ảnh raster được chép
+    nguyên vẹn (``EMR_STRETCHDIBITS`` với SRCCOPY, lấy toàn bộ ảnh nguồn); ngược lại ``None``.
+    """
+    if len(data) < 88 or struct.unpack_from("<I", data, 0)[0] != _EMR_HEADER or data[40:44] != b" EMF":
+        return None
+    bitmap = None
+    offset = 0
+    while offset + 8 <= len(data):
+        record_type, record_size = struct.unpack_from("<II", data, offset)
+        if record_size < 8 or offset + record_size > len(data):
+            return None
+        if record_type == _EMR_STRETCHDIBITS:
+            if bitmap is not None or record_size < 80:
+                return None
+            (x_src, y_src, cx_src, cy_src, off_bmi, cb_bmi, off_bits, cb_bits,
+             _usage, rop) = struct.unpack_from("<iiiiIIIIII", data, offset + 32)
+            if rop != _SRCCOPY or x_src or y_src or not cb_bmi or not cb_bits:
+                return None
+            if off_bmi + cb_bmi > record_size or off_bits + cb_bits > record_size:
+                return None
+            bmi = data[offset + off_bmi: offset + off_bmi + cb_bmi]
+            bits = data[offset + off_bits: offset + off_bits + cb_bits]
+            width, height = struct.unpack_from("<ii", bmi, 4)
+            if (cx_src, cy_src) != (abs(width), abs(height)):
+                return None
+            file_header = struct.pack("<2sIHHI", b"BM", 14 + len(bmi) + len(bits), 0, 0, 14 + len(bmi))
+            bitmap = file_header + bmi + bits
+        elif record_type == _EMR_EOF:
+            break
+        elif record_type != _EMR_HEADER and record_type not in _EMR_STATE_RECORDS:
+            return None
+        offset += record_size
+    return bitmap
+
+def _open_legacy_raster(data):
+    """Mở ảnh BMP/TIFF (một khung) hoặc bitmap trong EMF; ``None`` nếu không phải ảnh cũ."""
+    if data[40:44] == b" EMF":
+        # Pillow chỉ hiển thị được EMF trên Windows -> tự tách bitmap bên trong.
+        bitmap = _emf_single_bitmap(data)
+        if bitmap is None:
+            return None, None
+        img = Image.open(io.BytesIO(bitmap))
+        source = "EMF"
+    else:
+        try:
+            img = Image.open(io.BytesIO(data))
+        except Exception:
+            return None, None
+        source = img.format
+    if source not in _LEGACY_RASTER_FORMATS + ("EMF",) or getattr(img, "n_frames", 1) > 1:
+        return None, None
+    if image_ops.has_high_bit_depth(img):
+        logging.debug(f"  -> Bỏ qua ảnh {source} mode '{img.mode}' hơn 8 bit/kênh (chuyển đổi sẽ mất dữ liệu).")
+        return None, None
+    img.load()
+    return img, source
+
+def _transcode_raster(img, quality):
+    """Chọn định dạng theo nội dung ảnh: PNG không mất dữ liệu hoặc JPEG. Trả về ``(data, ext)``."""
+    profile = image_ops.classify_image(img)
+    if profile.flatten_alpha or img.mode not in ("1", "L", "LA", "P", "RGB", "RGBA"):
+        img = img.convert("RGBA" if profile.alpha in ("binary", "partial") else "RGB")
+    if profile.format == image_ops.FORMAT_JPEG:
+        buffer = io.BytesIO()
+        img.convert("RGB").save(
+            buffer, format="JPEG", quality=max(1, min(100, quality)), optimize=True,
+            progressive=True, subsampling=profile.subsampling,
+        )
+        return buffer.getvalue(), "jpeg"
+    optimized = image_ops.optimize_png_lossless(img)
+    if optimized is None:
+        raise ValueError(f"không mã hoá được PNG giữ nguyên ảnh (mode '{img.mode}')")
+    return optimized[0], "png"
+
+def _unique_part_name(pkg, name, taken):
+    base, ext = posixpath.splitext(name)
+    candidate, counter = name, 1
+    while candidate in taken or pkg.has_part(candidate):
+        candidate = f"{base}_{counter}{ext}"
+        counter += 1
+    return candidate
+
+def replace_media(pkg, media, data, ext, renames):
+    """
+    Ghi ``data`` (định dạng ``ext``: "png"/"jpeg") vào part ``media``. Nếu đuôi part khác định dạng
+    mới, tên mới được thêm vào ``renames`` - gọi ``pkg.rename_parts(renames)`` sau khi thay xong.
+    """
+    pkg.write(media, data)
+    current = posixpath.splitext(media)[1].lstrip(".").lower()
+    if current == ext or (current == "jpg" and ext == "jpeg"):
+        return
+    renames[media] = _unique_part_name(pkg, posixpath.splitext(media)[0] + "." + ext, renames.values())
+    pkg.set_default_content_type(ext, _CONTENT_TYPES[ext])
+
+def transcode_legacy_media(file_path, quality=85, min_saving_ratio=0.05):
+    """
+    Chuyển các ảnh BMP/DIB/TIFF và EMF chỉ chứa bitmap trong ``xl/media`` sang định dạng hiện
+    đại (PNG không mất dữ liệu cho đồ hoạ/ảnh ít màu, JPEG cho ảnh chụp - xem
+    ``image_ops.classify_image``), đổi tên part, cập nhật relationship và content type.
+
+    Trả về :class:`image_ops.CompressionReport` hoặc ``False`` nếu lỗi.
+    """
+    logging.info(f"Bắt đầu chuyển đổi ảnh định dạng cũ trong file '{os.path.basename(file_path)}'.")
+    report = image_ops.CompressionReport()
+    try:
+        with package_ops.ExcelPackage(file_path) as pkg:
+            renames = {}
+            for media in pkg.part_names():
+                if not media.startswith("xl/media/"):
+                    continue
+                original = pkg.read(media)
+                img, source = _open_legacy_raster(original)
+                if img is None:
+                    continue
+                try:
+                    data, ext = _transcode_raster(img, quality)
+                except Exception as img_err:
+                    logging.warning(f"  -> Không thể chuyển đổi ảnh '{media}': {img_err}")
+                    continue
+                note = f"{source} -> {ext.upper()}"
+                if not image_ops.is_worth_replacing(len(original), len(data), min_saving_ratio):
+                    report.add(media, len(original), len(original), kept_original=True, note=f"{source}, giữ nguyên")
+                    continue
+
+                replace_media(pkg, media, data, ext, renames)
+                report.add(media, len(original), len(data), note=note)
+                logging.debug(f"  -> '{media}' ({note}): {len(original) / 1024:.1f}KB -> {len(data) / 1024:.1f}KB")
+
+            if renames:
+                pkg.rename_parts(renames)
+                pkg.remove_unused_default_content_types(_LEGACY_EXTENSIONS)
+                pkg.save()
+    except Exception as e:
+        logging.error(f"Lỗi khi chuyển đổi ảnh định dạng cũ: {e}")
+        return False
+
+    if report.entries:
+        logging.info("Chuyển đổi ảnh định dạng cũ:\n" + report.format_table())
+    else:
+        logging.info("Không có ảnh BMP/TIFF/EMF dạng bitmap nào cần chuyển đổi.")
+    return report
+
+# ======================================================================
+# --- Nhóm 5: Gộp ảnh trùng ---
+# ======================================================================
+
+def _media_fingerprint(data):
+    """``(phash, (rộng, cao))`` của ảnh raster, ``None`` nếu không đọc được."""
+    with Image.open(io.BytesIO(data)) as img:
+        if img.format in ("WMF", "EMF") or getattr(img, "is_animated", False):
+            return None
+        size = img.size
+        img.draft("RGB", (256, 256))  # JPEG: giải mã ở độ phân giải nhỏ cho nhanh
+        thumbnail = image_ops.hash_thumbnail(img)
+    return image_ops.perceptual_hash(thumbnail), size
+
+def consolidate_near_duplicate_media(file_path, max_distance=4, tolerance=image_ops.NEAR_DUPLICATE_TOLERANCE):
+    """
+    Tìm các ảnh trùng/gần trùng trong ``xl/media`` (cùng ảnh chèn nhiều lần, xuất lại ở kích
+    thước hơi khác hoặc lưu với định dạng/mức nén khác) rồi cho mọi tham chiếu trong nhóm dùng
+    chung một media. Các bản còn lại bị xoá khỏi gói.
+
+    Perceptual hash (``max_distance``) chỉ dùng để lọc ứng viên; hai ảnh chỉ được gộp khi cùng
+    tỉ lệ khung hình và ``image_ops.local_difference`` (so ở kích thước chung) không vượt
+    ``tolerance``. 0 = chỉ gộp ảnh giống hệt từng pixel; mặc định
+    ``image_ops.NEAR_DUPLICATE_TOLERANCE`` đủ chặt để ảnh chụp bảng số chỉ khác một ô không bị gộp.
+    Bản giữ lại là ảnh có độ phân giải lớn nhất (cùng độ phân giải thì lấy file nhỏ nhất) để
+    chỗ hiển thị lớn không bị mờ.
+
+    Trả về :class:`image_ops.CompressionReport` (mỗi dòng là một media bị gộp) hoặc ``False``.
+    """
+    logging.info(f"Bắt đầu gộp ảnh trùng trong file '{os.path.basename(file_path)}'.")
+    report = image_ops.CompressionReport()
+    try:
+        with package_ops.ExcelPackage(file_path) as pkg:
+            names, hashes, sizes = [], [], []
+            for media in pkg.part_names():
+                if not media.startswith("xl/media/"):
+                    continue
+                try:
+                    fingerprint = _media_fingerprint(pkg.read(media))
+                except Exception as img_err:
+                    logging.debug(f"  -> Bỏ qua '{media}': {img_err}")
+                    continue
+                if fingerprint is None:
+                    continue
+                names.append(media)
+                hashes.append(fingerprint[0])
+                sizes.append(fingerprint[1])
+
+            if len(names) < 2:
+                logging.info("Không có đủ ảnh để so sánh.")
+                return report
+
+            decoded = {}
+
+            def pixels(i):
+                if i not in decoded:
+                    with Image.open(io.BytesIO(pkg.read(names[i]))) as img:
+                        img.load()
+                        decoded[i] = img.copy()
+                return decoded[i]
+
+            def verify(keep, other):
+                difference = image_ops.local_difference(pixels(keep), pixels(other))
+                decoded.pop(other, None)
+                return difference is not None and difference <= tolerance
+
+            # Giữ bản có độ phân giải lớn nhất, rồi file nhỏ nhất; mọi thành viên được so trực tiếp với nó.
+            order = sorted(
+                range(len(names)), key=lambda i: (-sizes[i][0] * sizes[i][1], pkg.part_size(names[i]))
+            )
+            groups = []
+            for members in image_ops.near_duplicate_groups(hashes, max_distance, order=order, verify=verify):
+                groups.append(members)
+                decoded.pop(members[0], None)
+
+            mapping = {}
+            for keep, *duplicates in groups:
+                for i in duplicates:
+                    mapping[names[i]] = names[keep]
+                logging.debug(f"  -> Nhóm ảnh trùng: {[names[i] for i in duplicates]} -> giữ '{names[keep]}'")
+
+            if mapping:
+                pkg.retarget_relationships(mapping)
+                for duplicate, canonical in mapping.items():
+                    size = pkg.part_size(duplicate)
+                    pkg.remove(duplicate)
+                    pkg.remove_override(duplicate)
+                    report.add(duplicate, size, 0, note=f"dùng chung {posixpath.basename(canonical)}")
+                pkg.save()
+    except Exception as e:
+        logging.error(f"Lỗi khi gộp ảnh trùng: {e}")
+        return False
+
+    if report.entries:
+        logging.info(f"Đã gộp {len(report.entries)} ảnh trùng:\n" + report.format_table())
+    else:
+        logging.info("Không tìm thấy ảnh trùng.")
+    return report
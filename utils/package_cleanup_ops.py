@@ -0,0 +1,1307 @@
+# Đường dẫn: excel_toolkit/utils/package_cleanup_ops.py
+# Phiên bản 2.6 - Pivot cache: bỏ qua pivotCacheId (x14) khi so sánh cache trùng
+# Ngày cập nhật: 2026-10-19
+
+import logging
+import os
+import posixpath
+import re
+import xml.etree.ElementTree as ET
+from collections import Counter
+
+from utils import package_ops
+
+# ======================================================================
+# --- Nhóm 1: Tiện ích địa chỉ ô ---
+# ======================================================================
+
+_CELL_REF_RE = re.compile(r"^\$?([A-Za-z]{1,3})\$?(\d+)$")
+
+def column_index(letters):
+    """Chuyển ký tự cột (A, B, ..., XFD) thành chỉ số cột (bắt đầu từ 1)."""
+    index = 0
+    for char in letters.upper():
+        index = index * 26 + ord(char) - 64
+    return index
+
+def column_letters(index):
+    """Chuyển chỉ số cột (bắt đầu từ 1) thành ký tự cột."""
+    letters = ""
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def parse_cell_ref(ref):
+    """``"B12"`` -> ``(12, 2)``; trả về ``None`` nếu không phải địa chỉ một ô."""
+    match = _CELL_REF_RE.match(ref.strip())
+    if not match:
+        return None
+    return int(match.group(2)), column_index(match.group(1))
+
+def parse_range_ref(ref):
+    """``"A1:C3"`` -> ``((1, 1), (3, 3))`` (hàng, cột); ô đơn coi như vùng 1x1."""
+    parts = ref.split(":")
+    start = parse_cell_ref(parts[0])
+    end = parse_cell_ref(parts[-1])
+    if start is None or end is None:
+        return None
+    return start, end
+
+# ======================================================================
+# --- Nhóm 2: Xóa định dạng ô thừa trong sheet ---
+# ======================================================================
+
+# Sheet có thể rất lớn nên không dựng cây XML: quét tuần tự bằng regex trên bytes, từng
+# <row>/<c> một. Tên thẻ có thể có prefix namespace (vd: <x:row>).
+_SHEET_DATA_RE = re.compile(rb"(<(?:\w+:)?sheetData\b[^>]*>)(.*?)(</(?:\w+:)?sheetData>)", re.S)
+_ROW_RE = re.compile(rb"<((?:\w+:)?)row\b([^>]*?)(?:/>|>(.*?)</(?:\w+:)?row>)", re.S)
+_CELL_RE = re.compile(rb"<(?:\w+:)?c\b([^>]*?)(?:/>|>(.*?)</(?:\w+:)?c>)", re.S)
+_CELL_CONTENT_RE = re.compile(rb"<(?:\w+:)?(?:v|f|is)\b")
+_COLS_RE = re.compile(rb"<(?:\w+:)?cols\b[^>]*>.*?</(?:\w+:)?cols>", re.S)
+_COL_RE = re.compile(rb"<((?:\w+:)?)col\b([^>]*?)/>")
+_DIMENSION_RE = re.compile(rb'(<(?:\w+:)?dimension\b[^>]*?\bref=")([^"]*)(")')
+_MERGE_CELL_RE = re.compile(rb'<(?:\w+:)?mergeCell\b[^>]*?\bref="([^"]*)"')
+_ATTR_RE = re.compile(rb'([\w:]+)="([^"]*)"')
+_R_ATTR_RE = re.compile(rb'\br="([A-Za-z]*)(\d*)"')
+
+# Thuộc tính chỉ mang định dạng (bị xóa ở hàng/cột nằm ngoài vùng dữ liệu).
+_ROW_FORMAT_ATTRS = (b"s", b"customFormat", b"thickTop", b"thickBot", b"spans")
+_COL_FORMAT_ATTRS = (b"style",)
+# Thuộc tính bố cục: hàng/cột còn thuộc tính này thì giữ lại (chiều cao/rộng, ẩn, group).
+_ROW_LAYOUT_ATTRS = (b"customHeight", b"hidden", b"outlineLevel", b"collapsed")
+_COL_LAYOUT_ATTRS = (b"customWidth", b"hidden", b"outlineLevel", b"collapsed")
+
+def _attrs(raw):
+    return dict(_ATTR_RE.findall(raw))
+
+def _format_attrs(attrs):
+    return b"".join(b' %s="%s"' % (k, v) for k, v in attrs.items())
+
+def _is_set(attrs, keys):
+    return any(attrs.get(k, b"0") not in (b"0", b"false") for k in keys)
+
+def _iter_rows(sheet_data):
+    """Duyệt ``(match, số hàng)`` của mọi ``<row>``, tính cả hàng không ghi thuộc tính ``r``."""
+    row_index = 0
+    for match in _ROW_RE.finditer(sheet_data):
+        r_attr = _attrs(match.group(2)).get(b"r")
+        row_index = int(r_attr) if r_attr else row_index + 1
+        yield match, row_index
+
+def _iter_cells(row_body):
+    """Duyệt ``(match, số cột)`` của mọi ``<c>`` trong một hàng."""
+    col_index = 0
+    for match in _CELL_RE.finditer(row_body or b""):
+        ref = _R_ATTR_RE.search(match.group(1))
+        col_index = column_index(ref.group(1).decode()) if ref and ref.group(1) else col_index + 1
+        yield match, col_index
+
+def _content_bounds(sheet_data, sheet_xml):
+    """
+    Vùng thật sự có dữ liệu/công thức: ``(min_row, min_col, max_row, max_col)`` hoặc ``None``.
+    Vùng gộp ô (merge) cũng được tính vào để không mất viền/định dạng của ô gộp.
+    """
+    bounds = None
+
+    def extend(row, col):
+        nonlocal bounds
+        if bounds is None:
+            bounds = [row, col, row, col]
+        else:
+            bounds = [min(bounds[0], row), min(bounds[1], col), max(bounds[2], row), max(bounds[3], col)]
+
+    for row_match, row_index in _iter_rows(sheet_data):
+        row_body = row_match.group(3)
+        if not row_body or not _CELL_CONTENT_RE.search(row_body):
+            continue
+        for cell_match, col_index in _iter_cells(row_body):
+            if cell_match.group(2) and _CELL_CONTENT_RE.search(cell_match.group(2)):
+                extend(row_index, col_index)
+
+    for ref in _MERGE_CELL_RE.findall(sheet_xml):
+        area = parse_range_ref(ref.decode())
+        if area:
+            extend(*area[0])
+            extend(*area[1])
+    return tuple(bounds) if bounds else None
+
+def _trim_rows(sheet_data, last_row, last_col, stats):
+    """Bỏ ô trống ngoài ``last_col`` và hàng trống ngoài ``last_row`` (giữ hàng có bố cục riêng)."""
+    pieces = []
+    position = 0
+    rows_dropped = False
+    for row_match, row_index in _iter_rows(sheet_data):
+        prefix, raw_attrs, row_body = row_match.group(1), row_match.group(2), row_match.group(3)
+        attrs = _attrs(raw_attrs)
+        replacement = None
+
+        if row_index > last_row:
+            stats["cells"] += sum(1 for _ in _CELL_RE.finditer(row_body or b""))
+            for key in _ROW_FORMAT_ATTRS:
+                attrs.pop(key, None)
+            if _is_set(attrs, _ROW_LAYOUT_ATTRS):
+                attrs[b"r"] = str(row_index).encode()
+                replacement = b"<%srow%s/>" % (prefix, _format_attrs(attrs))
+            else:
+                replacement = b""
+                rows_dropped = True
+                stats["rows"] += 1
+        elif row_body:
+            dropped = [m.span() for m, col_index in _iter_cells(row_body) if col_index > last_col]
+            if dropped:
+                stats["cells"] += len(dropped)
+                attrs.pop(b"spans", None)
+                attrs[b"r"] = str(row_index).encode()
+                body, cut = [], 0
+                for start, end in dropped:
+                    body.append(row_body[cut:start])
+                    cut = end
+                body.append(row_body[cut:])
+                replacement = b"<%srow%s>%s</%srow>" % (prefix, _format_attrs(attrs), b"".join(body), prefix)
+        if replacement is None and rows_dropped and b"r" not in attrs:
+            # Bỏ hàng phía trước sẽ làm lệch số hàng ngầm định -> ghi rõ thuộc tính r.
+            replacement = row_match.group(0).replace(b"row", b'row r="%d"' % row_index, 1)
+
+        if replacement is not None:
+            pieces.append(sheet_data[position:row_match.start()])
+            pieces.append(replacement)
+            position = row_match.end()
+    if not pieces:
+        return sheet_data
+    pieces.append(sheet_data[position:])
+    return b"".join(pieces)
+
+def _trim_cols(cols_xml, last_col, stats):
+    """Xóa style của các cột ngoài ``last_col``; bỏ hẳn cột không còn thiết lập bố cục nào."""
+
+    def replace(match):
+        prefix, attrs = match.group(1), _attrs(match.group(2))
+        try:
+            first, last = int(attrs[b"min"]), int(attrs[b"max"])
+        except (KeyError, ValueError):
+            return match.group(0)
+        if last <= last_col:
+            return match.group(0)
+        stats["cols"] += 1
+        result = b""
+        if first <= last_col:
+            inside = {**attrs, b"max": str(last_col).encode()}
+            result += b"<%scol%s/>" % (prefix, _format_attrs(inside))
+            first = last_col + 1
+        outside = {**attrs, b"min": str(first).encode()}
+        for key in _COL_FORMAT_ATTRS:
+            outside.pop(key, None)
+        if _is_set(outside, _COL_LAYOUT_ATTRS):
+            result += b"<%scol%s/>" % (prefix, _format_attrs(outside))
+        return result
+
+    trimmed = _COL_RE.sub(replace, cols_xml)
+    if _COL_RE.search(trimmed) is None:
+        # <cols> rỗng không hợp lệ theo schema.
+        return b""
+    return trimmed
+
+def trim_sheet_xml(sheet_xml):
+    """
+    Cắt định dạng thừa của một part sheet. Trả về ``(xml mới, thống kê)``; ``xml mới`` là
+    ``None`` nếu không có gì thay đổi. Thống kê gồm ``cells``, ``rows``, ``cols`` đã xóa/cắt,
+    ``old_ref`` và ``new_ref`` của ``<dimension>``.
+    """
+    stats = {"cells": 0, "rows": 0, "cols": 0, "old_ref": None, "new_ref": None}
+    match = _SHEET_DATA_RE.search(sheet_xml)
+    if match is None:
+        return None, stats
+
+    bounds = _content_bounds(match.group(2), sheet_xml)
+    min_row, min_col, last_row, last_col = bounds or (1, 1, 0, 0)
+
+    sheet_data = _trim_rows(match.group(2), last_row, last_col, stats)
+    result = sheet_xml[:match.start(2)] + sheet_data + sheet_xml[match.end(2):]
+
+    cols = _COLS_RE.search(result)
+    if cols:
+        result = result[:cols.start()] + _trim_cols(cols.group(0), last_col, stats) + result[cols.end():]
+
+    if bounds is None:
+        new_ref = b"A1"
+    elif (min_row, min_col) == (last_row, last_col):
+        new_ref = b"%s%d" % (column_letters(min_col).encode(), min_row)
+    else:
+        new_ref = b"%s%d:%s%d" % (column_letters(min_col).encode(), min_row, column_letters(last_col).encode(), last_row)
+    dimension = _DIMENSION_RE.search(result)
+    if dimension:
+        stats["old_ref"], stats["new_ref"] = dimension.group(2).decode(), new_ref.decode()
+        if dimension.group(2) != new_ref:
+            result = result[:dimension.start(2)] + new_ref + result[dimension.end(2):]
+
+    if result == sheet_xml:
+        return None, stats
+    return result, stats
+
+def trim_excess_formatting(file_path):
+    """
+    Xóa định dạng ô thừa của mọi sheet trực tiếp trong gói (không cần Excel).
+
+    Vùng dữ liệu thật được xác định từ các ô có giá trị/công thức (không tin ``<dimension>``
+    hay ``UsedRange`` vốn bị phình bởi chính định dạng thừa). Ngoài vùng đó: ô trống có style
+    bị xóa, hàng/cột bị xóa style (bỏ hẳn nếu không có chiều cao/rộng riêng, ẩn hay group),
+    ``<dimension>`` được ghi lại đúng vùng dữ liệu.
+    """
+    logging.info(f"Bắt đầu xóa định dạng ô thừa (trực tiếp trên XML) cho file '{os.path.basename(file_path)}'.")
+    try:
+        with package_ops.ExcelPackage(file_path) as pkg:
+            for sheet in pkg.sheet_parts():
+                part = sheet["part"]
+                if not part or not pkg.has_part(part):
+                    continue
+                new_xml, stats = trim_sheet_xml(pkg.read(part))
+                if new_xml is None:
+                    logging.debug(f"  -> Sheet '{sheet['name']}': không có định dạng thừa.")
+                    continue
+                logging.info(
+                    f"  -> Sheet '{sheet['name']}': vùng dữ liệu {stats['old_ref']} -> {stats['new_ref']}, "
+                    f"xóa {stats['cells']} ô, {stats['rows']} hàng, cắt {stats['cols']} khoảng cột "
+                    f"({pkg.part_size(part) / 1024:.1f}KB -> {len(new_xml) / 1024:.1f}KB)."
+                )
+                pkg.write(part, new_xml)
+            if pkg.is_modified:
+                pkg.save()
+        logging.info("Hoàn tất việc xóa định dạng ô thừa.")
+        return True
+    except Exception as e:
+        logging.error(f"Lỗi khi xóa định dạng ô thừa trong gói: {e}")
+        return False
+
+# ======================================================================
+# --- Nhóm 3: Gộp & dọn bảng định dạng ô (styles.xml) ---
+# ======================================================================
+
+_XF_REF_RE = re.compile(rb'(<(?:\w+:)?(?:c|row)\b[^>]*?\ss=")(\d+)(")')
+_COL_XF_REF_RE = re.compile(rb'(<(?:\w+:)?col\b[^>]*?\sstyle=")(\d+)(")')
+_NUM_FMT_REF_RE = re.compile(rb'\bnumFmtId="(\d+)"')
+
+# Mục bắt buộc ở đầu bảng (Excel coi là mặc định): font 0, fill 0-1 (none, gray125), border 0, xf 0.
+_RESERVED_ENTRIES = {"fonts": 1, "fills": 2, "borders": 1, "cellXfs": 1}
+_XF_COMPONENTS = (("fontId", "fonts"), ("fillId", "fills"), ("borderId", "borders"))
+
+def workbook_related_part(pkg, rel_type):
+    """Part đầu tiên mà workbook trỏ tới bằng relationship ``rel_type``, hoặc ``None``."""
+    for rel in pkg.get_relationships(pkg.workbook_part()):
+        if rel["type"] == rel_type and not rel["external"]:
+            return rel["target"]
+    return None
+
+def styles_part(pkg):
+    """Tên part ``styles.xml`` của workbook, hoặc ``None``."""
+    return workbook_related_part(pkg, package_ops.REL_TYPE_STYLES)
+
+def _canonical_key(element):
+    """Khóa so sánh không phụ thuộc thứ tự thuộc tính / khoảng trắng."""
+    return (
+        element.tag,
+        tuple(sorted(element.attrib.items())),
+        (element.text or "").strip(),
+        tuple(_canonical_key(child) for child in element),
+    )
+
+def _dedupe(elements, reserved=0):
+    """Trả về ``(danh sách mục duy nhất, ánh xạ chỉ số cũ -> mới)``; ``reserved`` mục đầu giữ nguyên vị trí."""
+    unique, index_map, seen = [], [], {}
+    for index, element in enumerate(elements):
+        key = _canonical_key(element)
+        if index >= reserved and key in seen:
+            index_map.append(seen[key])
+            continue
+        seen.setdefault(key, len(unique))
+        index_map.append(len(unique))
+        unique.append(element)
+    return unique, index_map
+
+def _compact(elements, used, reserved=0):
+    """Bỏ các mục không nằm trong ``used`` (trừ ``reserved`` mục đầu); trả về ``(mục còn lại, ánh xạ)``."""
+    kept, index_map = [], {}
+    for index, element in enumerate(elements):
+        if index < reserved or index in used:
+            index_map[index] = len(kept)
+            kept.append(element)
+    return kept, index_map
+
+def _replace_children(table, elements):
+    for child in list(table):
+        table.remove(child)
+    table.extend(elements)
+    table.set("count", str(len(elements)))
+
+def _remap_xf_components(xfs, maps):
+    """Đổi ``fontId``/``fillId``/``borderId`` của các xf theo ``maps`` (tên bảng -> {cũ: mới})."""
+    for xf in xfs:
+        for attr, table in _XF_COMPONENTS:
+            value = xf.get(attr)
+            if value is not None:
+                xf.set(attr, str(maps[table].get(int(value), 0)))
+
+def _format_counts_table(counts):
+    header = ("Bảng", "Trước", "Sau")
+    rows = [(name, str(before), str(after)) for name, (before, after) in counts.items()]
+    widths = [max(len(row[i]) for row in [header] + rows) for i in range(3)]
+    return "\n".join(
+        "  ".join(cell.ljust(widths[i]) if i == 0 else cell.rjust(widths[i]) for i, cell in enumerate(row))
+        for row in [header] + rows
+    )
+
+_STYLE_TABLES = ("numFmts", "fonts", "fills", "borders", "cellStyleXfs", "cellXfs", "cellStyles")
+
+def _read_style_tables(root):
+    """``(tables, entries)``: phần tử bảng (hoặc ``None``) và danh sách mục con của từng bảng."""
+    tables = {name: root.find(package_ops.qn(package_ops.NS_MAIN, name)) for name in _STYLE_TABLES}
+    entries = {name: list(table) if table is not None else [] for name, table in tables.items()}
+    return tables, entries
+
+def _worksheet_parts(pkg):
+    return [s["part"] for s in pkg.sheet_parts() if s["part"] and pkg.has_part(s["part"])]
+
+def _used_xf_indexes(pkg, sheets):
+    """Các chỉ số ``cellXfs`` được ô/hàng/cột trên các sheet dùng (luôn gồm 0)."""
+    used = {0}
+    for part in sheets:
+        data = pkg.read(part)
+        for regex in (_XF_REF_RE, _COL_XF_REF_RE):
+            used.update(int(value) for value in set(m.group(2) for m in regex.finditer(data)))
+    return used
+
+def _remap_sheet_xfs(pkg, sheets, xf_map):
+    """Đánh lại chỉ số ``s=``/``style=`` trên từng sheet theo ``xf_map`` (chỉ số ngoài map -> 0)."""
+    if all(old == new for old, new in xf_map.items()):
+        return
+
+    def remap(match):
+        return match.group(1) + str(xf_map.get(int(match.group(2)), 0)).encode() + match.group(3)
+
+    for part in sheets:
+        data = pkg.read(part)
+        new_data = _COL_XF_REF_RE.sub(remap, _XF_REF_RE.sub(remap, data))
+        if new_data != data:
+            pkg.write(part, new_data)
+
+def _gc_xf_components(pkg, styles, sheets, entries, all_xfs):
+    """
+    Bỏ font/fill/border không còn xf nào dùng và numFmt tùy chỉnh không còn được tham chiếu
+    (kể cả từ pivot table/cache và các part khác), rồi đánh lại chỉ số trong ``all_xfs``.
+    """
+    compact_maps = {}
+    for attr, table in _XF_COMPONENTS:
+        used = {int(xf.get(attr)) for xf in all_xfs if xf.get(attr) is not None}
+        entries[table], compact_maps[table] = _compact(entries[table], used, _RESERVED_ENTRIES[table])
+    _remap_xf_components(all_xfs, compact_maps)
+
+    referenced_ids = {xf.get("numFmtId") for xf in all_xfs}
+    for part in pkg.part_names():
+        if part.endswith(".xml") and part != styles and part not in sheets:
+            referenced_ids.update(v.decode() for v in _NUM_FMT_REF_RE.findall(pkg.read(part)))
+    entries["numFmts"] = [f for f in entries["numFmts"] if f.get("numFmtId") in referenced_ids]
+
+def _finish_style_cleanup(pkg, styles, root, namespaces, tables, entries, counts, title):
+    """Ghi các bảng đã đổi vào ``styles.xml``, in bảng trước/sau; trả về ``counts`` dạng tuple."""
+    for name in counts:
+        counts[name].append(len(entries[name]))
+    counts = {name: tuple(c) for name, c in counts.items()}
+    if any(before != after for before, after in counts.values()):
+        for name in counts:
+            if tables[name] is not None:
+                _replace_children(tables[name], entries[name])
+        pkg.write_xml(styles, root, namespaces)
+        logging.info(f"{title}:\n" + _format_counts_table(counts))
+    return counts
+
+def optimize_cell_formats(file_path):
+    """
+    Gộp các mục trùng trong ``numFmts``, ``fonts``, ``fills``, ``borders``, ``cellXfs`` của
+    ``styles.xml``, bỏ các mục không còn ô/hàng/cột nào dùng và đánh lại chỉ số ``s=``/``style=``
+    trên mọi sheet (quét regex từng sheet, không dựng cây XML).
+
+    Trả về ``{tên bảng: (số mục trước, số mục sau)}``, hoặc ``False`` nếu lỗi.
+    """
+    logging.info(f"Bắt đầu gộp & dọn bảng định dạng ô cho file '{os.path.basename(file_path)}'.")
+    try:
+        with package_ops.ExcelPackage(file_path) as pkg:
+            styles = styles_part(pkg)
+            if not styles or not pkg.has_part(styles):
+                logging.info("Workbook không có styles.xml, bỏ qua.")
+                return {}
+            root, namespaces = pkg.read_xml(styles)
+            tables, entries = _read_style_tables(root)
+            counts = {name: [len(entries[name])] for name in ("numFmts", "fonts", "fills", "borders", "cellXfs")}
+            style_xfs = entries["cellStyleXfs"]
+
+            # 1. Gộp mục trùng: numFmt theo formatCode, font/fill/border theo nội dung.
+            num_fmt_map = {}
+            first_id_by_code = {}
+            for num_fmt in entries["numFmts"]:
+                num_id, code = num_fmt.get("numFmtId"), num_fmt.get("formatCode")
+                num_fmt_map[num_id] = first_id_by_code.setdefault(code, num_id)
+            dedupe_maps = {}
+            for table in ("fonts", "fills", "borders"):
+                entries[table], index_map = _dedupe(entries[table], _RESERVED_ENTRIES[table])
+                dedupe_maps[table] = dict(enumerate(index_map))
+            for xf in style_xfs + entries["cellXfs"]:
+                if xf.get("numFmtId") in num_fmt_map:
+                    xf.set("numFmtId", num_fmt_map[xf.get("numFmtId")])
+            _remap_xf_components(style_xfs + entries["cellXfs"], dedupe_maps)
+            cell_xfs, xf_dedupe = _dedupe(entries["cellXfs"], _RESERVED_ENTRIES["cellXfs"])
+
+            # 2. Chỉ giữ xf thực sự được dùng trên các sheet.
+            sheets = _worksheet_parts(pkg)
+            used_xfs = {xf_dedupe[i] for i in _used_xf_indexes(pkg, sheets) if i < len(xf_dedupe)}
+            entries["cellXfs"], xf_compact = _compact(cell_xfs, used_xfs, _RESERVED_ENTRIES["cellXfs"])
+            xf_map = {old: xf_compact.get(new, 0) for old, new in enumerate(xf_dedupe)}
+
+            # 3. Bỏ font/fill/border/numFmt không còn được dùng.
+            _gc_xf_components(pkg, styles, sheets, entries, style_xfs + entries["cellXfs"])
+
+            counts = _finish_style_cleanup(
+                pkg, styles, root, namespaces, tables, entries, counts, "Kết quả gộp & dọn bảng định dạng ô"
+            )
+            _remap_sheet_xfs(pkg, sheets, xf_map)
+            if pkg.is_modified:
+                pkg.save()
+            else:
+                logging.info("Bảng định dạng ô không có mục trùng hay thừa.")
+        return counts
+    except Exception as e:
+        logging.error(f"Lỗi khi gộp & dọn bảng định dạng ô: {e}")
+        return False
+
+# ======================================================================
+# --- Nhóm 4: Dọn style có tên (cellStyles) ---
+# ======================================================================
+
+# "Normal 2", "Comma 15", "Style 1 3": bản sao sinh ra khi dán từ workbook khác.
+_STYLE_COPY_RE = re.compile(r"^(.*\S)\s+\d+$")
+
+_STYLE_COMPONENT_TABLES = {"fontId": "fonts", "fillId": "fills", "borderId": "borders"}
+
+def _style_xf_key(xf, entries):
+    """Khóa định dạng của một ``cellStyleXfs``: thuộc tính xf với font/fill/border/numFmt thay bằng nội dung."""
+    formats = {fmt.get("numFmtId"): fmt.get("formatCode") for fmt in entries["numFmts"]}
+    attrs = []
+    for key, value in sorted(xf.attrib.items()):
+        table = _STYLE_COMPONENT_TABLES.get(key)
+        if table and value.isdigit() and int(value) < len(entries[table]):
+            value = _canonical_key(entries[table][int(value)])
+        elif key == "numFmtId":
+            value = formats.get(value, value)
+        attrs.append((key, value))
+    return tuple(attrs), tuple(_canonical_key(child) for child in xf)
+
+def _style_roots(cell_styles, definition_of):
+    """
+    Ánh xạ ``id(cellStyle) -> cellStyle gốc``. Style trùng tên gộp về style xuất hiện trước
+    (ưu tiên style dựng sẵn), bản sao "Tên N" gộp về "Tên" nếu workbook có style đó và
+    ``definition_of`` (khóa định dạng của style) của hai style bằng nhau - "Level 2" khác
+    định dạng "Level" là style riêng, không phải bản sao.
+    """
+    by_name = {}
+    for style in sorted(cell_styles, key=lambda st: st.get("builtinId") is None):
+        by_name.setdefault(style.get("name", "").lower(), style)
+
+    roots = {}
+    for style in cell_styles:
+        current = by_name[style.get("name", "").lower()]
+        seen = {id(current)}
+        while current.get("builtinId") is None:
+            match = _STYLE_COPY_RE.match(current.get("name", ""))
+            base = by_name.get(match.group(1).lower()) if match else None
+            if base is None or id(base) in seen or definition_of(base) != definition_of(style):
+                break
+            seen.add(id(base))
+            current = base
+        roots[id(style)] = style if style.get("builtinId") is not None else current
+    return roots
+
+def clean_named_styles(file_path):
+    """
+    Dọn ``cellStyles``/``cellStyleXfs`` trong ``styles.xml``: gộp style trùng tên và các bản
+    sao "Tên N" có định dạng giống hệt về style gốc, xóa style tự tạo không còn ô nào dùng, rồi bỏ các
+    ``cellStyleXfs`` (và font/fill/border/numFmt) không còn được tham chiếu. ``xfId`` của
+    ``cellXfs`` được đánh lại nên chỉ số ``s=`` trên sheet không đổi.
+
+    Trả về ``{tên bảng: (số mục trước, số mục sau)}``, hoặc ``False`` nếu lỗi.
+    """
+    logging.info(f"Bắt đầu dọn style có tên cho file '{os.path.basename(file_path)}'.")
+    try:
+        with package_ops.ExcelPackage(file_path) as pkg:
+            styles = styles_part(pkg)
+            if not styles or not pkg.has_part(styles):
+                logging.info("Workbook không có styles.xml, bỏ qua.")
+                return {}
+            root, namespaces = pkg.read_xml(styles)
+            tables, entries = _read_style_tables(root)
+            counts = {
+                name: [len(entries[name])]
+                for name in ("cellStyles", "cellStyleXfs", "numFmts", "fonts", "fills", "borders")
+            }
+            cell_styles, style_xfs, cell_xfs = entries["cellStyles"], entries["cellStyleXfs"], entries["cellXfs"]
+
+            # 1. Gộp style trùng tên / bản sao về style gốc.
+            def definition_of(style):
+                xf_id = int(style.get("xfId", 0))
+                return _style_xf_key(style_xfs[xf_id], entries) if xf_id < len(style_xfs) else None
+
+            roots = _style_roots(cell_styles, definition_of)
+            merge_map = {}
+            for style in cell_styles:
+                target = roots[id(style)]
+                if target is not style:
+                    merge_map[int(style.get("xfId", 0))] = int(target.get("xfId", 0))
+            for xf in cell_xfs:
+                xf_id = int(xf.get("xfId", 0))
+                if xf_id in merge_map:
+                    xf.set("xfId", str(merge_map[xf_id]))
+
+            # 2. Bỏ bản sao và style tự tạo không còn ô nào dùng (giữ mọi style dựng sẵn).
+            sheets = _worksheet_parts(pkg)
+            used_style_xfs = {0} | {
+                int(cell_xfs[i].get("xfId", 0)) for i in _used_xf_indexes(pkg, sheets) if i < len(cell_xfs)
+            }
+            merged = unused = 0
+            kept_styles = []
+            for style in cell_styles:
+                if roots[id(style)] is not style:
+                    merged += 1
+                elif style.get("builtinId") is None and int(style.get("xfId", 0)) not in used_style_xfs:
+                    unused += 1
+                else:
+                    kept_styles.append(style)
+            entries["cellStyles"] = kept_styles
+
+            # 3. Bỏ cellStyleXfs không còn style hay ô nào tham chiếu.
+            used_style_xfs.update(int(style.get("xfId", 0)) for style in kept_styles)
+            entries["cellStyleXfs"], style_xf_map = _compact(style_xfs, used_style_xfs, reserved=1)
+            for element in kept_styles + cell_xfs:
+                if element.get("xfId") is not None:
+                    element.set("xfId", str(style_xf_map.get(int(element.get("xfId")), 0)))
+
+            # 4. Bỏ font/fill/border/numFmt chỉ còn style đã xóa dùng.
+            _gc_xf_components(pkg, styles, sheets, entries, entries["cellStyleXfs"] + cell_xfs)
+
+            logging.info(f"  -> Gộp {merged} style trùng tên/bản sao, xóa {unused} style không dùng.")
+            counts = _finish_style_cleanup(
+                pkg, styles, root, namespaces, tables, entries, counts, "Kết quả dọn style có tên"
+            )
+            if pkg.is_modified:
+                pkg.save()
+            else:
+                logging.info("Không có style có tên nào cần dọn.")
+        return counts
+    except Exception as e:
+        logging.error(f"Lỗi khi dọn style có tên: {e}")
+        return False
+
+# ======================================================================
+# --- Nhóm 5: Nén bảng chuỗi dùng chung (sharedStrings.xml) ---
+# ======================================================================
+
+_SHARED_STRING_CELL_RE = re.compile(
+    rb'(<(?:\w+:)?c\b[^>]*?\st="s"[^>]*>\s*<(?:\w+:)?v>)\s*(\d+)\s*(</(?:\w+:)?v>)'
+)
+_SST_START_RE = re.compile(rb"<(?:\w+:)?sst\b[^>]*>")
+_SST_ITEM_RE = re.compile(rb"<(?:\w+:)?si\b[^>]*?(?:/>|>.*?</(?:\w+:)?si>)", re.S)
+_SST_COUNT_ATTR_RE = re.compile(rb'\s(count|uniqueCount)="\d*"')
+
+def compact_shared_strings(file_path):
+    """
+    Bỏ các chuỗi trong ``sharedStrings.xml`` không còn ô nào tham chiếu (sau khi xóa sheet/nội
+    dung) và gộp các chuỗi trùng nhau, rồi đánh lại chỉ số ``<v>`` của các ô ``t="s"``.
+
+    Chỉ dùng một mảng đánh dấu và một mảng ánh xạ kích thước bằng bảng chuỗi; các sheet được
+    quét/ghi lại bằng regex, không dựng cây XML.
+
+    Trả về ``(số chuỗi trước, số chuỗi sau)``, hoặc ``False`` nếu lỗi.
+    """
+    logging.info(f"Bắt đầu nén bảng chuỗi dùng chung cho file '{os.path.basename(file_path)}'.")
+    try:
+        with package_ops.ExcelPackage(file_path) as pkg:
+            sst_part = workbook_related_part(pkg, package_ops.REL_TYPE_SHARED_STRINGS)
+            if not sst_part or not pkg.has_part(sst_part):
+                logging.info("Workbook không có sharedStrings.xml, bỏ qua.")
+                return (0, 0)
+            sst = pkg.read(sst_part)
+            items = [m.span() for m in _SST_ITEM_RE.finditer(sst)]
+
+            # 1. Đánh dấu chỉ số đang được dùng.
+            sheets = _worksheet_parts(pkg)
+            used = bytearray(len(items))
+            references = 0
+            for part in sheets:
+                for match in _SHARED_STRING_CELL_RE.finditer(pkg.read(part)):
+                    index = int(match.group(2))
+                    if index < len(items):
+                        used[index] = 1
+                    references += 1
+
+            # 2. Mảng ánh xạ chỉ số cũ -> mới; chuỗi trùng (cùng XML) dùng chung một chỉ số.
+            remap = [0] * len(items)
+            first_index = {}
+            kept = []
+            for index, (start, end) in enumerate(items):
+                if not used[index]:
+                    continue
+                item = sst[start:end]
+                new_index = first_index.setdefault(item, len(kept))
+                if new_index == len(kept):
+                    kept.append(item)
+                remap[index] = new_index
+
+            if len(kept) == len(items):
+                logging.info(f"Bảng chuỗi dùng chung không có chuỗi thừa ({len(items)} chuỗi).")
+                return (len(items), len(items))
+
+            # 3. Ghi lại sharedStrings.xml và chỉ số trên từng sheet.
+            start_tag = _SST_START_RE.search(sst)
+            header = _SST_COUNT_ATTR_RE.sub(b"", start_tag.group(0))
+            header = header[:-1].rstrip(b"/") + b' count="%d" uniqueCount="%d">' % (references, len(kept))
+            new_sst = sst[:start_tag.start()] + header + b"".join(kept) + sst[items[-1][1]:]
+            pkg.write(sst_part, new_sst)
+
+            def replace(match):
+                return match.group(1) + str(remap[int(match.group(2))]).encode() + match.group(3)
+
+            for part in sheets:
+                data = pkg.read(part)
+                new_data = _SHARED_STRING_CELL_RE.sub(replace, data)
+                if new_data != data:
+                    pkg.write(part, new_data)
+            pkg.save()
+
+        logging.info(
+            f"Hoàn tất nén bảng chuỗi dùng chung: {len(items)} -> {len(kept)} chuỗi "
+            f"({len(sst) / 1024:.1f}KB -> {len(new_sst) / 1024:.1f}KB)."
+        )
+        return (len(items), len(kept))
+    except Exception as e:
+        logging.error(f"Lỗi khi nén bảng chuỗi dùng chung: {e}")
+        return False
+
+# ======================================================================
+# --- Nhóm 6: Pivot cache ---
+# ======================================================================
+
+_PIVOT_CACHE_DEF_START_RE = re.compile(rb"<(?:\w+:)?pivotCacheDefinition\b[^>]*>")
+_XML_ATTR_RE = re.compile(rb'\s([\w:]+)="([^"]*)"')
+
+def pivot_cache_parts(pkg):
+    """Danh sách part ``pivotCacheDefinition`` mà workbook khai báo."""
+    return [
+        rel["target"] for rel in pkg.get_relationships(pkg.workbook_part())
+        if rel["type"] == package_ops.REL_TYPE_PIVOT_CACHE_DEFINITION and not rel["external"]
+        and pkg.has_part(rel["target"])
+    ]
+
+def _set_start_tag_attrs(start_tag, values, drop=()):
+    """Đặt/ghi đè thuộc tính của một thẻ mở (bytes) và bỏ các thuộc tính trong ``drop``."""
+    closing = b"/>" if start_tag.endswith(b"/>") else b">"
+    body = start_tag[:-len(closing)]
+    for match in reversed(list(_XML_ATTR_RE.finditer(body))):
+        if match.group(1) in values or match.group(1) in drop:
+            body = body[:match.start()] + body[match.end():]
+    body += b"".join(b' %s="%s"' % (key, value) for key, value in values.items())
+    return body + closing
+
+def strip_pivot_cache_records(file_path):
+    """
+    Xóa các part ``pivotCacheRecords`` (bản sao dữ liệu nguồn lưu trong file) trực tiếp trong
+    gói, đặt ``saveData="0"`` và ``refreshOnLoad="1"`` cho cache definition để Excel tự dựng
+    lại cache khi mở; sửa relationship và ``[Content_Types].xml`` tương ứng. Không cần Excel
+    và không refresh về nguồn dữ liệu.
+
+    Trả về số byte (chưa nén) đã bỏ, hoặc ``False`` nếu lỗi.
+    """
+    logging.info(f"Bắt đầu dọn Pivot cache records (trực tiếp trong gói) cho file '{os.path.basename(file_path)}'.")
+    try:
+        removed_bytes = 0
+        with package_ops.ExcelPackage(file_path) as pkg:
+            caches = pivot_cache_parts(pkg)
+            if not caches:
+                logging.info("Không tìm thấy Pivot Table cache nào trong workbook.")
+                return 0
+            for definition in caches:
+                records = [
+                    rel for rel in pkg.get_relationships(definition)
+                    if rel["type"] == package_ops.REL_TYPE_PIVOT_CACHE_RECORDS
+                ]
+                rel_ids = {rel["id"] for rel in records}
+                data = pkg.read(definition)
+                start = _PIVOT_CACHE_DEF_START_RE.search(data)
+                if start is None:
+                    continue
+                # r:id trên thẻ gốc trỏ tới records -> bỏ cùng với relationship.
+                drop = {
+                    m.group(1) for m in _XML_ATTR_RE.finditer(start.group(0))
+                    if m.group(1).endswith(b":id") and m.group(2).decode() in rel_ids
+                }
+                new_tag = _set_start_tag_attrs(start.group(0), {b"saveData": b"0", b"refreshOnLoad": b"1"}, drop)
+                if new_tag != start.group(0):
+                    pkg.write(definition, data[:start.start()] + new_tag + data[start.end():])
+
+                pkg.remove_relationships(definition, rel_ids)
+                for rel in records:
+                    if rel["external"] or not pkg.has_part(rel["target"]):
+                        continue
+                    size = pkg.part_size(rel["target"])
+                    removed_bytes += size
+                    pkg.remove(rel["target"])
+                    pkg.remove(pkg.rels_name(rel["target"]))
+                    pkg.remove_override(rel["target"])
+                    logging.debug(f"  -> Đã xóa '{rel['target']}' ({size / 1024:.1f}KB).")
+            if pkg.is_modified:
+                pkg.save()
+        logging.info(
+            f"Hoàn tất dọn {len(caches)} Pivot cache: bỏ {removed_bytes / 1024:.1f}KB dữ liệu records, "
+            "cache sẽ được dựng lại khi mở file."
+        )
+        return removed_bytes
+    except Exception as e:
+        logging.error(f"Lỗi khi dọn Pivot cache records: {e}")
+        return False
+
+# Thuộc tính gốc của cache definition thay đổi theo lần refresh/lưu, không ảnh hưởng nội dung cache.
+_VOLATILE_CACHE_ATTRS = {
+    "refreshedBy", "refreshedDate", "refreshedDateIso", "createdVersion", "refreshedVersion",
+    "minRefreshableVersion", "recordCount", "upgradeOnRefresh", "saveData", "refreshOnLoad",
+    "enableRefresh", "invalid", package_ops.qn(package_ops.NS_REL, "id"),
+}
+_PIVOT_TABLE_CACHE_ID_RE = re.compile(rb'(<(?:\w+:)?pivotTableDefinition\b[^>]*?\scacheId=")(\d+)(")')
+# Slicer/timeline cache trỏ tới ``x14:pivotCacheDefinition@pivotCacheId`` trong extLst của cache
+# definition (không phải ``cacheId`` của workbook).
+_PIVOT_CACHE_ID_REF_RE = re.compile(rb'\bpivotCacheId="(\d+)"')
+_X14_PIVOT_CACHE_ID_RE = re.compile(rb'<(?:\w+:)?pivotCacheDefinition\b[^>]*?\spivotCacheId="(\d+)"')
+_PIVOT_CACHE_CONSUMER_FOLDERS = ("xl/slicerCaches/", "xl/timelineCaches/")
+
+def _pivot_cache_key(pkg, definition):
+    """
+    Khóa so sánh cache: nguồn, field, shared items... (bỏ qua thuộc tính refresh/lưu và
+    ``pivotCacheId`` của x14 - Excel cấp số riêng cho từng cache, kể cả bản sao).
+    """
+    root, _ = pkg.read_xml(definition)
+    for element in root.iter():
+        if element is not root and element.tag.endswith("}pivotCacheDefinition"):
+            element.attrib.pop("pivotCacheId", None)
+    attrs = tuple(sorted((k, v) for k, v in root.attrib.items() if k not in _VOLATILE_CACHE_ATTRS))
+    return attrs, tuple(_canonical_key(child) for child in root)
+
+def _remove_part_tree(pkg, part):
+    """Xóa ``part`` cùng các part chỉ nó trỏ tới (records), .rels và Override; trả về số byte đã bỏ."""
+    removed = pkg.part_size(part)
+    for rel in pkg.get_relationships(part):
+        if rel["type"] == package_ops.REL_TYPE_PIVOT_CACHE_RECORDS and not rel["external"] and pkg.has_part(rel["target"]):
+            removed += pkg.part_size(rel["target"])
+            pkg.remove(rel["target"])
+            pkg.remove(pkg.rels_name(rel["target"]))
+            pkg.remove_override(rel["target"])
+    pkg.remove(part)
+    pkg.remove(pkg.rels_name(part))
+    pkg.remove_override(part)
+    return removed
+
+def consolidate_pivot_caches(file_path):
+    """
+    Gộp các pivot cache có cùng nguồn và cùng định nghĩa field (bản sao sinh ra khi copy pivot
+    table) về một cache dùng chung: trỏ lại mọi pivot table (relationship và ``cacheId``) sang
+    cache giữ lại rồi xóa các cache thừa. Cache được slicer/timeline tham chiếu (qua
+    ``pivotCacheId`` của x14) được giữ nguyên.
+
+    Trả về số cache đã xóa, hoặc ``False`` nếu lỗi.
+    """
+    logging.info(f"Bắt đầu gộp pivot cache trùng cho file '{os.path.basename(file_path)}'.")
+    try:
+        removed_count = removed_bytes = 0
+        with package_ops.ExcelPackage(file_path) as pkg:
+            workbook = pkg.workbook_part()
+            wb_root, wb_namespaces = pkg.read_xml(workbook)
+            wb_xml = pkg.read(workbook)
+            rel_targets = {
+                rel["id"]: rel["target"] for rel in pkg.get_relationships(workbook)
+                if rel["type"] == package_ops.REL_TYPE_PIVOT_CACHE_DEFINITION and not rel["external"]
+            }
+            caches_element = wb_root.find(package_ops.qn(package_ops.NS_MAIN, "pivotCaches"))
+            if caches_element is None or not rel_targets:
+                logging.info("Không tìm thấy Pivot Table cache nào trong workbook.")
+                return 0
+
+            slicer_cache_ids = set()
+            for part in pkg.part_names():
+                if part.startswith(_PIVOT_CACHE_CONSUMER_FOLDERS) and part.endswith(".xml"):
+                    slicer_cache_ids.update(_PIVOT_CACHE_ID_REF_RE.findall(pkg.read(part)))
+
+            # 1. Nhóm các cache tương đương; cache đầu tiên của nhóm được giữ lại.
+            keep_by_key = {}
+            duplicates = []  # (phần tử <pivotCache>, cache giữ lại)
+            for cache in list(caches_element):
+                rel_id = cache.get(package_ops.qn(package_ops.NS_REL, "id"))
+                definition = rel_targets.get(rel_id)
+                if not definition or not pkg.has_part(definition):
+                    continue
+                key = _pivot_cache_key(pkg, definition)
+                if key not in keep_by_key:
+                    keep_by_key[key] = cache
+                # Slicer/timeline đang dùng cache này -> giữ nguyên.
+                elif set(_X14_PIVOT_CACHE_ID_RE.findall(pkg.read(definition))) & slicer_cache_ids:
+                    continue
+                # r:id còn xuất hiện ở extLst (x14/x15 pivotCaches) -> không gộp cho an toàn.
+                elif wb_xml.count(b'"%s"' % rel_id.encode()) == 1:
+                    duplicates.append((cache, keep_by_key[key]))
+            if not duplicates:
+                logging.info("Không có pivot cache trùng lặp.")
+                return 0
+
+            id_map, part_map = {}, {}
+            for cache, kept in duplicates:
+                id_map[cache.get("cacheId").encode()] = kept.get("cacheId").encode()
+                part_map[rel_targets[cache.get(package_ops.qn(package_ops.NS_REL, "id"))]] = \
+                    rel_targets[kept.get(package_ops.qn(package_ops.NS_REL, "id"))]
+
+            # 2. Trỏ pivot table sang cache giữ lại.
+            def remap_id(match):
+                return match.group(1) + id_map.get(match.group(2), match.group(2)) + match.group(3)
+
+            for part in pkg.part_names():
+                if not (part.startswith("xl/pivotTables/") and part.endswith(".xml")):
+                    continue
+                data = pkg.read(part)
+                new_data = _PIVOT_TABLE_CACHE_ID_RE.sub(remap_id, data)
+                if new_data != data:
+                    pkg.write(part, new_data)
+
+            removed_bytes = sum(_remove_part_tree(pkg, part) for part in part_map)
+            pkg.retarget_relationships(part_map)
+
+            # 3. Bỏ <pivotCache> và relationship của cache thừa khỏi workbook.
+            removed_rel_ids = set()
+            for cache, _ in duplicates:
+                removed_rel_ids.add(cache.get(package_ops.qn(package_ops.NS_REL, "id")))
+                caches_element.remove(cache)
+            pkg.write_xml(workbook, wb_root, wb_namespaces)
+            pkg.remove_relationships(workbook, removed_rel_ids)
+            removed_count = len(duplicates)
+            pkg.save()
+
+        logging.info(
+            f"Hoàn tất gộp pivot cache: xóa {removed_count} cache trùng ({removed_bytes / 1024:.1f}KB)."
+        )
+        return removed_count
+    except Exception as e:
+        logging.error(f"Lỗi khi gộp pivot cache trùng: {e}")
+        return False
+
+# ======================================================================
+# --- Nhóm 7: Defined Name ---
+# ======================================================================
+
+# Nhóm phân loại (mỗi name thuộc đúng một nhóm, xét theo thứ tự dưới đây)
+NAME_PRINT = "print"        # name dựng sẵn _xlnm.* (vùng in, tiêu đề in, vùng lọc...)
+NAME_IN_USE = "in_use"      # được công thức/chart/pivot/name khác tham chiếu
+NAME_BROKEN = "broken"      # công thức chứa #REF!
+NAME_EXTERNAL = "external"  # trỏ tới workbook khác ([1]Sheet!A1)
+NAME_HIDDEN = "hidden"      # name ẩn (thường do add-in/bản sao để lại)
+NAME_UNUSED = "unused"      # name hiển thị, hợp lệ nhưng không ai dùng
+
+NAME_CLASS_LABELS = {
+    NAME_PRINT: "Thiết lập in/lọc (_xlnm)",
+    NAME_IN_USE: "Đang được dùng",
+    NAME_BROKEN: "Lỗi #REF!",
+    NAME_EXTERNAL: "Liên kết workbook ngoài",
+    NAME_HIDDEN: "Name ẩn",
+    NAME_UNUSED: "Không được dùng",
+}
+# Name ẩn thường do add-in tạo và dùng qua VBA/COM (không dò được) -> chỉ xóa khi được yêu cầu.
+DEFAULT_NAME_CLASSES_TO_REMOVE = (NAME_BROKEN, NAME_EXTERNAL, NAME_UNUSED)
+
+# Name nội bộ của Excel (hàm mới, tham số LAMBDA...) luôn được giữ.
+_INTERNAL_NAME_PREFIXES = ("_xlfn.", "_xlpm.", "_xlws.", "_xleta.")
+_FORMULA_TEXT_RE = re.compile(
+    rb"<(?:\w+:)?(?:f|formula|formula1|formula2|calculatedColumnFormula|totalsRowFormula)\b[^>/]*>(.*?)</", re.S
+)
+_PIVOT_SOURCE_NAME_RE = re.compile(rb'<(?:\w+:)?worksheetSource\b[^>]*?\sname="([^"]*)"')
+# Công thức/tham chiếu lưu ở chỗ khác: hyperlink nội bộ (``location``), form control trong
+# ``xl/ctrlProps`` (``fmlaRange``/``fmlaLink``...), data validation ghi dạng thuộc tính, và
+# form control kiểu cũ trong VML (``<x:FmlaRange>``...).
+_FORMULA_ATTR_RE = re.compile(
+    rb'\s(?:location|fmlaRange|fmlaLink|fmlaTxbx|fmlaGroup|formula1|formula2)="([^"]*)"'
+)
+_VML_FORMULA_RE = re.compile(rb"<(?:\w+:)?(?:FmlaRange|FmlaLink|FmlaTxbx|FmlaGroup|FmlaPict)>(.*?)</", re.S)
+_NAME_TOKEN_RE = re.compile(r"[A-Za-z_\\][\w.\\?]*")
+# Tham chiếu workbook ngoài trong công thức đã lưu: ``[1]Sheet1!A1``, ``[1]Sheet1:Sheet3!A1``,
+# ``'[1]My Sheet'!A1``, ``[1]!Name``. Không khớp structured reference như ``Table1[2020]``.
+_EXTERNAL_REF_RE = re.compile(r"(?:'\[\d+\][^']*'|(?<![\w.\[\]])\[\d+\][\w.]*(?::[\w.]+)?)!")
+
+def _name_tokens(text):
+    return {token.lower() for token in _NAME_TOKEN_RE.findall(text)}
+
+def _referenced_name_tokens(pkg, workbook):
+    """
+    Các từ (chữ thường) xuất hiện trong công thức của sheet, chart, table, pivot, hyperlink,
+    form control (kể cả VML)... trong gói.
+    """
+    tokens = set()
+    for part in pkg.part_names():
+        if not part.endswith((".xml", ".vml")) or part == workbook:
+            continue
+        data = pkg.read(part)
+        for regex in (_FORMULA_TEXT_RE, _FORMULA_ATTR_RE, _VML_FORMULA_RE):
+            for match in regex.finditer(data):
+                tokens |= _name_tokens(match.group(1).decode("utf-8", "replace"))
+        for name in _PIVOT_SOURCE_NAME_RE.findall(data):
+            tokens.add(name.decode("utf-8", "replace").lower())
+    return tokens
+
+def classify_defined_names(pkg, defined_names, used_tokens=None):
+    """
+    Phân loại từng ``<definedName>``; trả về danh sách ``(phần tử, nhóm)`` theo thứ tự gốc.
+    ``used_tokens`` là kết quả ``_referenced_name_tokens`` nếu đã tính sẵn.
+    """
+    if used_tokens is None:
+        used_tokens = _referenced_name_tokens(pkg, pkg.workbook_part())
+    # Name được name khác tham chiếu (không tính chính nó) cũng coi là đang dùng.
+    references_by_name = Counter()
+    for element in defined_names:
+        for token in _name_tokens(element.text or ""):
+            references_by_name[token] += 1
+
+    result = []
+    for element in defined_names:
+        name = element.get("name", "")
+        lower = name.lower()
+        formula = element.text or ""
+        self_refs = 1 if lower in _name_tokens(formula) else 0
+        if lower.startswith("_xlnm.") or "print_area" in lower or "print_titles" in lower:
+            category = NAME_PRINT
+        # Name lỗi nhưng còn được tham chiếu: xóa sẽ biến #REF! thành #NAME? ở nơi dùng.
+        elif (
+            lower.startswith(_INTERNAL_NAME_PREFIXES)
+            or lower in used_tokens
+            or references_by_name[lower] > self_refs
+        ):
+            category = NAME_IN_USE
+        elif "#REF!" in formula.upper():
+            category = NAME_BROKEN
+        elif _EXTERNAL_REF_RE.search(formula):
+            category = NAME_EXTERNAL
+        elif element.get("hidden") in ("1", "true"):
+            category = NAME_HIDDEN
+        else:
+            category = NAME_UNUSED
+        result.append((element, category))
+    return result
+
+def clean_defined_names(file_path, remove_classes=None):
+    """
+    Phân loại mọi Defined Name trong ``workbook.xml`` (in/lọc, đang dùng, #REF!, workbook
+    ngoài, ẩn, không dùng) và xóa các nhóm trong ``remove_classes`` trong một lần ghi.
+
+    Mặc định xóa ``DEFAULT_NAME_CLASSES_TO_REMOVE``; với file có macro, nhóm ``unused`` được
+    giữ lại vì VBA có thể dùng name mà không thể dò được. Name in/lọc, name đang dùng và
+    name ẩn không bị xóa theo mặc định.
+
+    Trả về ``{nhóm: (số name, số đã xóa)}``, hoặc ``False`` nếu lỗi.
+    """
+    logging.info(f"Bắt đầu dọn Defined Name (trực tiếp trong gói) cho file '{os.path.basename(file_path)}'.")
+    try:
+        with package_ops.ExcelPackage(file_path) as pkg:
+            has_macros = any(part.lower().endswith("vbaproject.bin") for part in pkg.part_names())
+            if remove_classes is None:
+                remove_classes = DEFAULT_NAME_CLASSES_TO_REMOVE
+                if has_macros:
+                    remove_classes = tuple(c for c in remove_classes if c != NAME_UNUSED)
+            workbook = pkg.workbook_part()
+            root, namespaces = pkg.read_xml(workbook)
+            container = root.find(package_ops.qn(package_ops.NS_MAIN, "definedNames"))
+            defined_names = list(container) if container is not None else []
+            if not defined_names:
+                logging.info("Workbook không có Defined Name nào.")
+                return {}
+
+            # Tham chiếu từ sheet/chart/pivot... không đổi khi xóa name -> chỉ dò một lần.
+            used_tokens = _referenced_name_tokens(pkg, workbook)
+            removed = Counter()
+            # Lặp tới khi ổn định: xóa một name có thể khiến name chỉ nó dùng thành "không dùng".
+            while True:
+                kept = Counter()
+                removed_this_pass = 0
+                for element, category in classify_defined_names(pkg, list(container), used_tokens):
+                    if category in remove_classes:
+                        container.remove(element)
+                        removed[category] += 1
+                        removed_this_pass += 1
+                        logging.debug(f"  -> Xóa name [{category}] '{element.get('name')}' = {element.text}")
+                    else:
+                        kept[category] += 1
+                if not removed_this_pass:
+                    break
+            totals = kept + removed
+
+            if removed:
+                if not len(container):
+                    # <definedNames> rỗng không hợp lệ theo schema.
+                    root.remove(container)
+                pkg.write_xml(workbook, root, namespaces)
+                pkg.save()
+
+        summary = {category: (totals[category], removed[category]) for category in NAME_CLASS_LABELS if totals[category]}
+        rows = [("Nhóm", "Số name", "Đã xóa")] + [
+            (NAME_CLASS_LABELS[category], str(total), str(count)) for category, (total, count) in summary.items()
+        ]
+        widths = [max(len(row[i]) for row in rows) for i in range(3)]
+        logging.info(
+            f"Hoàn tất dọn Defined Name: xóa {sum(removed.values())}/{sum(totals.values())} name.\n"
+            + "\n".join("  ".join(cell.ljust(widths[i]) for i, cell in enumerate(row)) for row in rows)
+        )
+        return summary
+    except Exception as e:
+        logging.error(f"Lỗi khi dọn Defined Name: {e}")
+        return False
+
+# ======================================================================
+# --- Nhóm 8: Liên kết workbook ngoài ---
+# ======================================================================
+
+_FORMULA_CELL_RE = re.compile(rb"<((?:\w+:)?)c\b([^>]*?)(?:/>|>(.*?)</(?:\w+:)?c>)", re.S)
+_F_RE = re.compile(rb"<(?:\w+:)?f\b([^>]*?)(?:/>|>(.*?)</(?:\w+:)?f>)", re.S)
+_V_RE = re.compile(rb"<(?:\w+:)?v>(.*?)</(?:\w+:)?v>", re.S)
+_FORMULA_STRING_LITERAL_RE = re.compile(r'"[^"]*"|&quot;.*?&quot;')
+_CELL_VOLATILE_ATTRS = (b"t", b"cm")
+
+def _is_external_formula(formula, external_names):
+    """Công thức (dạng text) có trỏ tới workbook ngoài ``[n]`` hoặc tới name trỏ ra ngoài không."""
+    formula = _FORMULA_STRING_LITERAL_RE.sub("", formula)
+    if _EXTERNAL_REF_RE.search(formula):
+        return True
+    return bool(external_names) and not external_names.isdisjoint(_name_tokens(formula))
+
+def _frozen_cell(prefix, attrs, body):
+    """Bỏ ``<f>`` và giữ giá trị ``<v>`` đã lưu; chuỗi công thức (``t="str"``) thành inline string."""
+    values = _attrs(attrs)
+    cell_type = values.get(b"t")
+    for name in _CELL_VOLATILE_ATTRS:
+        values.pop(name, None)
+    value = _V_RE.search(body)
+    if value is None:
+        content = b""
+    elif cell_type == b"str":
+        values[b"t"] = b"inlineStr"
+        content = b'<%sis><%st xml:space="preserve">%s</%st></%sis>' % (
+            prefix, prefix, value.group(1), prefix, prefix)
+    else:
+        if cell_type in (b"b", b"e", b"n"):
+            values[b"t"] = cell_type
+        content = b"<%sv>%s</%sv>" % (prefix, value.group(1), prefix)
+    if not content:
+        return b"<%sc%s/>" % (prefix, _format_attrs(values))
+    return b"<%sc%s>%s</%sc>" % (prefix, _format_attrs(values), content, prefix)
+
+def _freeze_external_formulas(data, external_names):
+    """Đóng băng mọi ô có công thức trỏ ra ngoài trong XML của một sheet; trả về ``(data mới, số ô)``."""
+    # Shared formula: chỉ ô gốc chứa text công thức, các ô con (cùng si) phải đóng băng theo.
+    frozen_shared = set()
+    for match in _F_RE.finditer(data):
+        f_attrs = _attrs(match.group(1))
+        if f_attrs.get(b"t") == b"shared" and match.group(2) and _is_external_formula(
+            match.group(2).decode("utf-8", "replace"), external_names
+        ):
+            frozen_shared.add(f_attrs.get(b"si"))
+
+    frozen = 0
+
+    def replace(match):
+        nonlocal frozen
+        formula = _F_RE.search(match.group(3)) if match.group(3) else None
+        if formula is None:
+            return match.group(0)
+        f_attrs = _attrs(formula.group(1))
+        if f_attrs.get(b"t") == b"shared" and f_attrs.get(b"si") in frozen_shared:
+            pass
+        elif not formula.group(2) or not _is_external_formula(
+            formula.group(2).decode("utf-8", "replace"), external_names
+        ):
+            return match.group(0)
+        frozen += 1
+        return _frozen_cell(match.group(1), match.group(2), match.group(3))
+
+    return _FORMULA_CELL_RE.sub(replace, data), frozen
+
+NS_CHART = "http://schemas.openxmlformats.org/drawingml/2006/chart"
+
+def _chart_tag(tag):
+    return package_ops.qn(NS_CHART, tag)
+
+def _rich_text(text):
+    """``<c:rich>`` một đoạn chữ, thay cho ``<c:strRef>`` trong ``<c:tx>`` của tiêu đề/nhãn."""
+    a = lambda tag: package_ops.qn(package_ops.NS_DRAWING_MAIN, tag)
+    rich = ET.Element(_chart_tag("rich"))
+    ET.SubElement(rich, a("bodyPr"))
+    run = ET.SubElement(ET.SubElement(rich, a("p")), a("r"))
+    ET.SubElement(run, a("t")).text = text
+    return rich
+
+def _freeze_chart_references(root, external_names):
+    """
+    Thay ``<c:strRef>``/``<c:numRef>`` có ``<c:f>`` trỏ ra ngoài bằng giá trị Excel đã cache:
+    ``<c:strLit>``/``<c:numLit>`` cho dữ liệu series, ``<c:v>`` cho tên series và ``<c:rich>``
+    cho tiêu đề. Tham chiếu không có cache được để nguyên. Trả về số tham chiếu đã đóng băng.
+    """
+    parents = {child: parent for parent in root.iter() for child in parent}
+    frozen = 0
+    for kind in ("str", "num"):
+        for ref in list(root.iter(_chart_tag(kind + "Ref"))):
+            formula = ref.find(_chart_tag("f"))
+            cache = ref.find(_chart_tag(kind + "Cache"))
+            if formula is None or cache is None or not _is_external_formula(formula.text or "", external_names):
+                continue
+            parent = parents[ref]
+            if parent.tag == _chart_tag("tx"):
+                point = cache.find(f"{_chart_tag('pt')}/{_chart_tag('v')}")
+                text = point.text if point is not None else ""
+                if parents.get(parent) is not None and parents[parent].tag == _chart_tag("ser"):
+                    literal = ET.Element(_chart_tag("v"))
+                    literal.text = text
+                else:
+                    literal = _rich_text(text)
+            else:
+                literal = ET.Element(_chart_tag(kind + "Lit"))
+                literal.extend(list(cache))
+            parent.insert(list(parent).index(ref), literal)
+            parent.remove(ref)
+            frozen += 1
+    return frozen
+
+def remove_external_links(file_path):
+    """
+    Gỡ liên kết tới workbook ngoài mà không mở/kết nối tới file nguồn (không đụng mạng):
+    công thức trên sheet tham chiếu ``[n]`` (hoặc name trỏ ra ngoài) được thay bằng giá trị
+    ``<v>`` Excel đã lưu, các name trỏ ra ngoài bị xóa, rồi xóa part ``externalLinks`` cùng
+    relationship và ``<externalReferences>`` trong ``workbook.xml``.
+
+    Tham chiếu ngoài trong chart được thay bằng giá trị cache của chart. Nếu vẫn còn tham chiếu
+    không đóng băng được (validation, định dạng có điều kiện, chart không có cache...) thì không
+    ghi gì cả, vì xóa part liên kết khi đó sẽ để lại chỉ số ``[n]`` treo và Excel phải sửa file
+    khi mở; trả về ``None`` để phía gọi chuyển sang BreakLink qua Excel.
+
+    Trả về ``(số liên kết đã gỡ, số ô/tham chiếu chart đã đóng băng)``, ``None`` nếu còn tham
+    chiếu không đóng băng được, hoặc ``False`` nếu lỗi.
+    """
+    logging.info(f"Bắt đầu gỡ liên kết ngoài (trực tiếp trong gói) cho file '{os.path.basename(file_path)}'.")
+    try:
+        with package_ops.ExcelPackage(file_path) as pkg:
+            workbook = pkg.workbook_part()
+            link_rels = [
+                rel for rel in pkg.get_relationships(workbook)
+                if rel["type"] == package_ops.REL_TYPE_EXTERNAL_LINK
+            ]
+            if not link_rels:
+                logging.info("Workbook không có liên kết ngoài.")
+                return (0, 0)
+
+            # 1. Name trỏ ra ngoài: xóa, và công thức dùng các name đó cũng phải đóng băng.
+            root, namespaces = pkg.read_xml(workbook)
+            external_names = set()
+            container = root.find(package_ops.qn(package_ops.NS_MAIN, "definedNames"))
+            if container is not None:
+                for element in list(container):
+                    if _is_external_formula(element.text or "", ()):
+                        external_names.add(element.get("name", "").lower())
+                        container.remove(element)
+                        logging.debug(f"  -> Xóa name trỏ ra ngoài '{element.get('name')}' = {element.text}")
+                if not len(container):
+                    root.remove(container)
+            references = root.find(package_ops.qn(package_ops.NS_MAIN, "externalReferences"))
+            if references is not None:
+                root.remove(references)
+            pkg.write_xml(workbook, root, namespaces)
+
+            # 2. Đóng băng công thức trên từng sheet.
+            frozen_cells = 0
+            for part in _worksheet_parts(pkg):
+                data = pkg.read(part)
+                new_data, frozen = _freeze_external_formulas(data, external_names)
+                if frozen:
+                    pkg.write(part, new_data)
+                    frozen_cells += frozen
+
+            # 3. Chart: thay tham chiếu ngoài bằng giá trị cache.
+            for part in pkg.part_names():
+                if not (part.startswith("xl/charts/") and part.endswith(".xml")) or not any(
+                    _is_external_formula(m.group(1).decode("utf-8", "replace"), external_names)
+                    for m in _FORMULA_TEXT_RE.finditer(pkg.read(part))
+                ):
+                    continue
+                chart, chart_namespaces = pkg.read_xml(part)
+                frozen = _freeze_chart_references(chart, external_names)
+                if frozen:
+                    pkg.write_xml(part, chart, chart_namespaces)
+                    frozen_cells += frozen
+
+            # 4. Tham chiếu ngoài còn sót ở chỗ không có giá trị để đóng băng -> dừng, không ghi file.
+            leftovers = [
+                part for part in pkg.part_names()
+                if part.endswith(".xml") and any(
+                    _is_external_formula(m.group(1).decode("utf-8", "replace"), external_names)
+                    for m in _FORMULA_TEXT_RE.finditer(pkg.read(part))
+                )
+            ]
+            if leftovers:
+                logging.warning(
+                    f"Dừng gỡ liên kết ngoài: còn tham chiếu workbook ngoài không đóng băng được trong "
+                    f"{', '.join(leftovers)}. File không bị thay đổi."
+                )
+                return None
+
+            # 5. Xóa part externalLink (kèm .rels chứa đường dẫn file nguồn) và relationship.
+            for rel in link_rels:
+                if not rel["external"] and pkg.has_part(rel["target"]):
+                    pkg.remove(rel["target"])
+                    pkg.remove(pkg.rels_name(rel["target"]))
+                    pkg.remove_override(rel["target"])
+            pkg.remove_relationships(workbook, {rel["id"] for rel in link_rels})
+            pkg.save()
+
+        logging.info(
+            f"Hoàn tất gỡ liên kết ngoài: {len(link_rels)} liên kết, {frozen_cells} ô/tham chiếu chart chuyển thành giá trị, "
+            f"{len(external_names)} name bị xóa."
+        )
+        return (len(link_rels), frozen_cells)
+    except Exception as e:
+        logging.error(f"Lỗi khi gỡ liên kết ngoài: {e}")
+        return False
+
+# ======================================================================
+# --- Nhóm 9: Chuỗi tính toán (calcChain) ---
+# ======================================================================
+
+def remove_calc_chain(file_path):
+    """
+    Xóa ``xl/calcChain.xml`` (thứ tự tính lại các ô công thức Excel lưu kèm file). Với mô hình
+    lớn part này có thể vài MB, và khi lỗi thời khiến Excel phải sửa file lúc mở; Excel tự dựng
+    lại chuỗi tính toán ở lần tính/lưu kế tiếp.
+
+    Trả về số byte đã bỏ, hoặc ``False`` nếu lỗi.
+    """
+    logging.info(f"Bắt đầu xóa calcChain cho file '{os.path.basename(file_path)}'.")
+    try:
+        with package_ops.ExcelPackage(file_path) as pkg:
+            removed = pkg.remove_calc_chain()
+            if not pkg.is_modified:
+                logging.info("Workbook không có calcChain.xml.")
+                return 0
+            pkg.save()
+
+        with package_ops.ExcelPackage(file_path) as pkg:
+            leftover = [name for name in pkg.part_names() if posixpath.basename(name).lower() == "calcchain.xml"]
+        if leftover:
+            logging.error(f"File sau khi lưu vẫn còn calcChain: {', '.join(leftover)}.")
+            return False
+
+        logging.info(f"Hoàn tất xóa calcChain: bỏ {removed / 1024:.1f}KB.")
+        return removed
+    except Exception as e:
+        logging.error(f"Lỗi khi xóa calcChain: {e}")
+        return False
@@ -0,0 +1,452 @@
+# Đường dẫn: excel_toolkit/utils/package_ops.py
+# Phiên bản 2.0 - Đổi tên part sang phần mở rộng khác thì bỏ Override, dùng Default của đuôi mới
+# Ngày cập nhật: 2026-10-19
+
+import io
+import logging
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import zipfile
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional
+
+# --- Namespace & content type thường dùng ---
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+NS_CONTENT_TYPES = "http://schemas.openxmlformats.org/package/2006/content-types"
+NS_DRAWING_MAIN = "http://schemas.openxmlformats.org/drawingml/2006/main"
+NS_XDR = "http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing"
+
+CONTENT_TYPES_PART = "[Content_Types].xml"
+
+# Thẻ công thức ``<f>`` trong XML sheet (không khớp ``<filters>``, ``<filterColumn>``...).
+_FORMULA_TAG_RE = re.compile(rb"<(?:\w+:)?f[\s>/]")
+CT_DRAWING = "application/vnd.openxmlformats-officedocument.drawing+xml"
+
+REL_TYPE_OFFICE_DOCUMENT = NS_REL + "/officeDocument"
+REL_TYPE_WORKSHEET = NS_REL + "/worksheet"
+REL_TYPE_DRAWING = NS_REL + "/drawing"
+REL_TYPE_IMAGE = NS_REL + "/image"
+REL_TYPE_VML_DRAWING = NS_REL + "/vmlDrawing"
+REL_TYPE_CHART = NS_REL + "/chart"
+REL_TYPE_STYLES = NS_REL + "/styles"
+REL_TYPE_SHARED_STRINGS = NS_REL + "/sharedStrings"
+REL_TYPE_PIVOT_CACHE_DEFINITION = NS_REL + "/pivotCacheDefinition"
+REL_TYPE_PIVOT_CACHE_RECORDS = NS_REL + "/pivotCacheRecords"
+REL_TYPE_EXTERNAL_LINK = NS_REL + "/externalLink"
+REL_TYPE_CALC_CHAIN = NS_REL + "/calcChain"
+
+_XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\r\n'
+
+# ======================================================================
+# --- Nhóm 1: Tiện ích XML ---
+# ======================================================================
+
+def qn(namespace, tag):
+    """Tạo tên đầy đủ ``{namespace}tag`` cho ElementTree."""
+    return f"{{{namespace}}}{tag}"
+
+def parse_xml(data):
+    """
+    Phân tích XML và trả về ``(root, namespaces)``.
+
+    ``namespaces`` là danh sách ``(prefix, uri)`` khai báo trong tài liệu, cần giữ lại để
+    ghi ra đúng như cũ (Excel báo lỗi nếu mất các prefix dùng trong ``mc:Ignorable``).
+    """
+    namespaces = []
+    iterator = ET.iterparse(io.BytesIO(data), events=("start-ns",))
+    for _, item in iterator:
+        if item not in namespaces:
+            namespaces.append(item)
+    return iterator.root, namespaces
+
+def serialize_xml(root, namespaces):
+    """Ghi cây XML về bytes, khôi phục mọi khai báo namespace của tài liệu gốc."""
+    # Đăng ký prefix "" cho namespace mặc định để ElementTree không sinh "ns0:".
+    for prefix, uri in namespaces:
+        ET.register_namespace(prefix, uri)
+
+    text = ET.tostring(root, encoding="unicode")
+
+    # ElementTree chỉ khai báo namespace thực sự được dùng -> bổ sung phần còn thiếu.
+    end = text.index(">")
+    if text[end - 1] == "/":
+        end -= 1
+    root_tag = text[:end]
+    missing = []
+    for prefix, uri in namespaces:
+        attr = f'xmlns:{prefix}="' if prefix else 'xmlns="'
+        if attr not in root_tag:
+            missing.append(f' {attr}{uri}"')
+    if missing:
+        text = text[:end] + "".join(missing) + text[end:]
+
+    return (_XML_DECLARATION + text).encode("utf-8")
+
+# ======================================================================
+# --- Nhóm 2: Gói OOXML ---
+# ======================================================================
+
+class ExcelPackage:
+    """
+    Truy cập các part trong gói OOXML của workbook.
+
+    Các part chưa sửa được giữ nguyên trong file zip gốc và chỉ được sao chép dạng stream
+    khi ``save``; part đã sửa được giữ trong bộ nhớ.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._zip = zipfile.ZipFile(file_path)
+        self._names = [info.filename for info in self._zip.infolist()]
+        self._modified: Dict[str, bytes] = {}
+        self._removed = set()
+        self._content_types = None
+        self._content_types_dirty = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self._zip:
+            self._zip.close()
+            self._zip = None
+
+    # --- Part ---
+
+    @property
+    def is_modified(self):
+        return bool(self._modified or self._removed)
+
+    def part_names(self) -> List[str]:
+        names = [n for n in self._names if n not in self._removed]
+        names.extend(n for n in self._modified if n not in self._names)
+        return names
+
+    def has_part(self, name):
+        return name not in self._removed and (name in self._modified or name in self._names)
+
+    def read(self, name) -> bytes:
+        if name in self._removed:
+            raise KeyError(name)
+        if name in self._modified:
+            return self._modified[name]
+        return self._zip.read(name)
+
+    def write(self, name, data: bytes):
+        self._removed.discard(name)
+        self._modified[name] = data
+
+    def remove(self, name):
+        self._modified.pop(name, None)
+        if name in self._names:
+            self._removed.add(name)
+
+    def part_size(self, name) -> int:
+        """Kích thước (byte, chưa nén) của part."""
+        if name in self._modified:
+            return len(self._modified[name])
+        return self._zip.getinfo(name).file_size
+
+    def read_xml(self, name):
+        return parse_xml(self.read(name))
+
+    def write_xml(self, name, root, namespaces):
+        self.write(name, serialize_xml(root, namespaces))
+
+    def save(self, output_path=None):
+        """
+        Ghi gói ra ``output_path`` (mặc định ghi đè file gốc) qua file tạm cùng thư mục.
+
+        Nếu đã xóa sheet hoặc thay đổi công thức trên sheet, ``calcChain.xml`` cũ được bỏ luôn
+        để Excel không phải sửa file (repair) khi mở; Excel tự dựng lại chuỗi tính toán.
+        """
+        if self._calc_chain_is_stale():
+            removed = self.remove_calc_chain()
+            logging.debug(f"Đã bỏ calcChain.xml lỗi thời ({removed / 1024:.1f}KB).")
+        if self._content_types_dirty:
+            self.write_xml(CONTENT_TYPES_PART, *self._content_types)
+
+        output_path = output_path or self.file_path
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(os.path.abspath(output_path)))
+        os.close(fd)
+        try:
+            with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as zout:
+                names = self.part_names()
+                if CONTENT_TYPES_PART in names:
+                    names.remove(CONTENT_TYPES_PART)
+                    names.insert(0, CONTENT_TYPES_PART)
+                for name in names:
+                    if name in self._modified:
+                        zout.writestr(name, self._modified[name])
+                        continue
+                    source_info = self._zip.getinfo(name)
+                    info = zipfile.ZipInfo(name, date_time=source_info.date_time)
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    zip64 = source_info.file_size > zipfile.ZIP64_LIMIT
+                    with self._zip.open(name) as src, zout.open(info, "w", force_zip64=zip64) as dst:
+                        shutil.copyfileobj(src, dst, 1 << 20)
+            if os.path.abspath(output_path) == os.path.abspath(self.file_path):
+                self.close()
+            os.replace(tmp_path, output_path)
+            logging.debug(f"Đã ghi gói OOXML ra '{output_path}'.")
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _calc_chain_is_stale(self):
+        """Có sheet bị xóa, hoặc sheet đã sửa có số ô công thức khác bản gốc."""
+        changed = self._removed | set(self._modified)
+        if not any(posixpath.basename(n) == "calcChain.xml" for n in self._names if n not in changed):
+            return False
+        for name in changed:
+            if posixpath.basename(posixpath.dirname(name)) != "worksheets" or name not in self._names:
+                continue
+            if name in self._removed:
+                return True
+            original = self._zip.read(name)
+            if len(_FORMULA_TAG_RE.findall(original)) != len(_FORMULA_TAG_RE.findall(self._modified[name])):
+                return True
+        return False
+
+    def remove_calc_chain(self) -> int:
+        """Xoá ``calcChain.xml`` cùng relationship và Override; trả về số byte đã bỏ."""
+        workbook = self.workbook_part()
+        rels = [rel for rel in self.get_relationships(workbook) if rel["type"] == REL_TYPE_CALC_CHAIN]
+        removed = 0
+        for rel in rels:
+            if not rel["external"] and self.has_part(rel["target"]):
+                removed += self.part_size(rel["target"])
+                self.remove(rel["target"])
+                self.remove_override(rel["target"])
+        self.remove_relationships(workbook, {rel["id"] for rel in rels})
+        return removed
+
+    # --- Relationship ---
+
+    @staticmethod
+    def rels_name(part_name):
+        """Đường dẫn part .rels đi kèm ``part_name``."""
+        folder, base = posixpath.split(part_name)
+        return posixpath.join(folder, "_rels", base + ".rels")
+
+    @staticmethod
+    def rels_source(rels_name):
+        """Part nguồn của một part .rels (ngược lại với ``rels_name``); ``""`` là gói."""
+        folder, base = posixpath.split(rels_name)
+        return posixpath.join(posixpath.dirname(folder), base[:-len(".rels")])
+
+    @staticmethod
+    def resolve_target(part_name, target):
+        """Chuyển ``Target`` tương đối trong .rels thành tên part tuyệt đối trong gói."""
+        if target.startswith("/"):
+            return target.lstrip("/")
+        return posixpath.normpath(posixpath.join(posixpath.dirname(part_name), target))
+
+    def get_relationships(self, part_name) -> List[Dict[str, Optional[str]]]:
+        """
+        Danh sách relationship của ``part_name``; mỗi phần tử gồm ``id``, ``type``,
+        ``target`` (tên part đã resolve, hoặc URL nếu ``external``) và ``external``.
+        """
+        rels_name = self.rels_name(part_name)
+        if not self.has_part(rels_name):
+            return []
+        root, _ = self.read_xml(rels_name)
+        relationships = []
+        for rel in root.findall(qn(NS_PKG_REL, "Relationship")):
+            external = rel.get("TargetMode") == "External"
+            target = rel.get("Target", "")
+            relationships.append({
+                "id": rel.get("Id"),
+                "type": rel.get("Type"),
+                "target": target if external else self.resolve_target(part_name, target),
+                "external": external,
+            })
+        return relationships
+
+    def rename_parts(self, mapping: Dict[str, str]):
+        """
+        Đổi tên các part theo ``mapping`` (tên cũ -> tên mới, cùng thư mục), cập nhật mọi
+        relationship trỏ tới chúng và Override trong ``[Content_Types].xml``. Part đổi phần mở
+        rộng thì bỏ Override cũ (ContentType không còn đúng) và dùng ``<Default>`` của đuôi mới -
+        gọi ``set_default_content_type`` trước; thiếu Default thì báo ``ValueError``.
+        """
+        if not mapping:
+            return
+        root = self._content_types_root()
+        defaults = {d.get("Extension", "").lower() for d in root.findall(qn(NS_CONTENT_TYPES, "Default"))}
+        for old_name, new_name in mapping.items():
+            new_ext = posixpath.splitext(new_name)[1].lstrip(".").lower()
+            if new_ext != posixpath.splitext(old_name)[1].lstrip(".").lower() and new_ext not in defaults:
+                raise ValueError(f"Chưa có <Default> content type cho phần mở rộng '{new_ext}' ({new_name}).")
+
+        for old_name, new_name in mapping.items():
+            self.write(new_name, self.read(old_name))
+            self.remove(old_name)
+            old_rels = self.rels_name(old_name)
+            if self.has_part(old_rels):
+                self.write(self.rels_name(new_name), self.read(old_rels))
+                self.remove(old_rels)
+
+        self.retarget_relationships(mapping)
+
+        for override in root.findall(qn(NS_CONTENT_TYPES, "Override")):
+            old_name = override.get("PartName", "").lstrip("/")
+            new_name = mapping.get(old_name)
+            if new_name is None:
+                continue
+            if posixpath.splitext(new_name)[1].lower() != posixpath.splitext(old_name)[1].lower():
+                root.remove(override)
+            else:
+                override.set("PartName", "/" + new_name)
+            self._content_types_dirty = True
+
+    def remove_relationships(self, part_name, rel_ids) -> int:
+        """
+        Xoá các relationship có Id trong ``rel_ids`` khỏi .rels của ``part_name`` (xoá luôn part
+        .rels nếu không còn relationship nào); trả về số đã xoá.
+        """
+        rels_name = self.rels_name(part_name)
+        if not self.has_part(rels_name):
+            return 0
+        root, namespaces = self.read_xml(rels_name)
+        removed = 0
+        for rel in root.findall(qn(NS_PKG_REL, "Relationship")):
+            if rel.get("Id") in rel_ids:
+                root.remove(rel)
+                removed += 1
+        if removed and len(root):
+            self.write_xml(rels_name, root, namespaces)
+        elif removed:
+            self.remove(rels_name)
+        return removed
+
+    def retarget_relationships(self, mapping: Dict[str, str]) -> int:
+        """
+        Sửa mọi relationship (nội bộ) đang trỏ tới part trong ``mapping`` sang part tương ứng.
+        Trả về số relationship đã sửa.
+        """
+        updated = 0
+        for rels_name in [n for n in self.part_names() if n.endswith(".rels")]:
+            source = self.rels_source(rels_name)
+            root, namespaces = self.read_xml(rels_name)
+            changed = False
+            for rel in root.findall(qn(NS_PKG_REL, "Relationship")):
+                target = rel.get("Target", "")
+                if rel.get("TargetMode") == "External" or not target:
+                    continue
+                new_name = mapping.get(self.resolve_target(source, target))
+                if new_name is None:
+                    continue
+                if target.startswith("/"):
+                    rel.set("Target", "/" + new_name)
+                else:
+                    rel.set("Target", posixpath.relpath(new_name, posixpath.dirname(source) or "."))
+                changed = True
+                updated += 1
+            if changed:
+                self.write_xml(rels_name, root, namespaces)
+        return updated
+
+    # --- Workbook & sheet ---
+
+    def workbook_part(self) -> str:
+        """Tên part workbook chính (thường là ``xl/workbook.xml``)."""
+        for rel in self.get_relationships(""):
+            if rel["type"] == REL_TYPE_OFFICE_DOCUMENT:
+                return rel["target"]
+        return "xl/workbook.xml"
+
+    def sheet_parts(self) -> List[Dict[str, str]]:
+        """
+        Danh sách sheet theo thứ tự trong workbook; mỗi phần tử gồm ``name``, ``part``
+        (tên part, ``None`` nếu không tìm thấy), ``state`` (visible/hidden/veryHidden) và ``rel_id``.
+        """
+        workbook = self.workbook_part()
+        targets = {rel["id"]: rel["target"] for rel in self.get_relationships(workbook)}
+        root, _ = self.read_xml(workbook)
+        sheets = []
+        for sheet in root.iter(qn(NS_MAIN, "sheet")):
+            rel_id = sheet.get(qn(NS_REL, "id"))
+            sheets.append({
+                "name": sheet.get("name"),
+                "part": targets.get(rel_id),
+                "state": sheet.get("state", "visible"),
+                "rel_id": rel_id,
+            })
+        return sheets
+
+    # --- Content type ---
+
+    def _content_types_root(self):
+        if self._content_types is None:
+            self._content_types = self.read_xml(CONTENT_TYPES_PART)
+        return self._content_types[0]
+
+    def _content_type_maps(self):
+        root = self._content_types_root()
+        overrides = {
+            o.get("PartName", "").lstrip("/"): o.get("ContentType")
+            for o in root.findall(qn(NS_CONTENT_TYPES, "Override"))
+        }
+        defaults = {
+            d.get("Extension", "").lower(): d.get("ContentType")
+            for d in root.findall(qn(NS_CONTENT_TYPES, "Default"))
+        }
+        return overrides, defaults
+
+    @staticmethod
+    def _lookup_content_type(part_name, overrides, defaults):
+        if part_name in overrides:
+            return overrides[part_name]
+        return defaults.get(posixpath.splitext(part_name)[1].lstrip(".").lower())
+
+    def content_type(self, part_name) -> Optional[str]:
+        return self._lookup_content_type(part_name, *self._content_type_maps())
+
+    def parts_by_content_type(self, content_type) -> List[str]:
+        overrides, defaults = self._content_type_maps()
+        return [
+            n for n in self.part_names()
+            if self._lookup_content_type(n, overrides, defaults) == content_type
+        ]
+
+    def set_default_content_type(self, extension, content_type):
+        """Thêm/sửa ``<Default Extension=...>`` cho phần mở rộng ``extension``."""
+        root = self._content_types_root()
+        extension = extension.lower()
+        for default in root.findall(qn(NS_CONTENT_TYPES, "Default")):
+            if default.get("Extension", "").lower() == extension:
+                if default.get("ContentType") != content_type:
+                    default.set("ContentType", content_type)
+                    self._content_types_dirty = True
+                return
+        element = ET.Element(qn(NS_CONTENT_TYPES, "Default"), {"Extension": extension, "ContentType": content_type})
+        root.insert(0, element)
+        self._content_types_dirty = True
+
+    def remove_override(self, part_name):
+        """Xoá ``<Override>`` của ``part_name`` (dùng khi đã xoá part)."""
+        root = self._content_types_root()
+        for override in root.findall(qn(NS_CONTENT_TYPES, "Override")):
+            if override.get("PartName", "").lstrip("/") == part_name:
+                root.remove(override)
+                self._content_types_dirty = True
+
+    def remove_unused_default_content_types(self, extensions):
+        """Xoá ``<Default>`` của các phần mở rộng trong ``extensions`` không còn part nào dùng."""
+        used = {posixpath.splitext(n)[1].lstrip(".").lower() for n in self.part_names()}
+        root = self._content_types_root()
+        for default in root.findall(qn(NS_CONTENT_TYPES, "Default")):
+            extension = default.get("Extension", "").lower()
+            if extension in extensions and extension not in used:
+                root.remove(default)
+                self._content_types_dirty = True